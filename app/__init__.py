@@ -34,7 +34,8 @@ def create_app(config_class=Config):
     db.init_app(app)
     migrate.init_app(app, db)
     login.init_app(app)
-    socketio.init_app(app, manage_session=False)
+    socketio.init_app(app, manage_session=False,
+                      message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'))
     csrf.init_app(app)
     
     # Initialize Vault client
@@ -54,6 +55,10 @@ def create_app(config_class=Config):
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
     
+    # Справочник регионов кэшируется на время жизни процесса
+    from app import regions
+    regions.init_app(app)
+    
     app.logger.info('Приложение инициализировано')
     return app
 
@@ -0,0 +1,157 @@
+import io
+import csv
+import logging
+import itertools
+from typing import Dict, Iterable, Iterator, Optional
+from urllib.parse import urlparse
+from openpyxl import load_workbook
+from sqlalchemy import select
+from app import db
+from app.models import Keyword, URL
+from app.reports.cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 1000
+UPLOAD_EXTENSIONS = ('csv', 'txt', 'xlsx')
+# Первая строка файла с таким значением считается заголовком
+HEADER_NAMES = {'keyword', 'keywords', 'query', 'url', 'urls',
+                'ключевое слово', 'ключевые слова', 'запрос', 'адрес'}
+KEYWORD_MAX_LENGTH = Keyword.__table__.c.keyword.type.length
+URL_MAX_LENGTH = URL.__table__.c.url.type.length
+
+def _first_column(rows: Iterable) -> Iterator[str]:
+    """Значения первой колонки, заголовок и пустые ячейки пропускаются"""
+    for index, row in enumerate(rows):
+        if not row or row[0] is None:
+            continue
+        value = str(row[0]).strip()
+        if index == 0 and value.lower() in HEADER_NAMES:
+            continue
+        yield value
+
+def _iter_xlsx(stream) -> Iterator[str]:
+    # read_only: openpyxl читает лист потоково, не загружая книгу в память
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from _first_column(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+def _iter_csv(stream) -> Iterator[str]:
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    # Разделитель определяется по началу файла, дочитанному до конца строки
+    sample = text.read(4096) + text.readline()
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    lines = itertools.chain(io.StringIO(sample, newline=''), text)
+    yield from _first_column(csv.reader(lines, dialect))
+
+def iter_upload_values(file_storage) -> Iterator[str]:
+    """
+    Значения первой колонки загруженного файла CSV/TXT/XLSX
+
+    Файл читается построчно по мере потребления итератора.
+
+    Raises:
+        ValueError: Неподдерживаемый формат файла
+    """
+    extension = (file_storage.filename or '').rsplit('.', 1)[-1].lower()
+    if extension not in UPLOAD_EXTENSIONS:
+        raise ValueError(f"Поддерживаются файлы {', '.join(UPLOAD_EXTENSIONS)}")
+    if extension == 'xlsx':
+        return _iter_xlsx(file_storage.stream)
+    return _iter_csv(file_storage.stream)
+
+def normalize_keyword(value: str) -> str:
+    """Убирает лишние пробелы в ключевом слове"""
+    return ' '.join(value.split())
+
+def normalize_url(value: str) -> Optional[str]:
+    """URL со схемой (по умолчанию https://) или None, если значение не является URL"""
+    value = value.strip()
+    if not value.startswith(('http://', 'https://')):
+        value = 'https://' + value
+    result = urlparse(value)
+    if not all([result.scheme, result.netloc]) or ' ' in result.netloc:
+        return None
+    return value
+
+def _insert_new(table, project_id: int, candidates: Dict[str, dict], existing: set, chunk_size: int) -> int:
+    """Вставляет кандидатов, которых нет среди existing, многострочными INSERT"""
+    rows = [row for key, row in candidates.items() if key not in existing]
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(table.insert(), rows[start:start + chunk_size])
+    if rows:
+        bump_data_version(project_id)
+    return len(rows)
+
+def import_keywords(project_id: int, values: Iterable[str], region_id: Optional[int] = None,
+                    chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Массово добавляет ключевые слова в проект
+
+    Значения нормализуются и дедуплицируются в памяти (без учета регистра),
+    уже существующие слова проекта читаются одним запросом, новые вставляются
+    порциями. Транзакцию не фиксирует.
+
+    Returns:
+        Счетчики: received, added, existing, duplicates, invalid
+    """
+    stats = {'received': 0, 'added': 0, 'existing': 0, 'duplicates': 0, 'invalid': 0}
+    candidates = {}
+    for value in values:
+        keyword = normalize_keyword(value)
+        if not keyword:
+            continue
+        stats['received'] += 1
+        if len(keyword) > KEYWORD_MAX_LENGTH:
+            stats['invalid'] += 1
+            continue
+        key = keyword.lower()
+        if key in candidates:
+            stats['duplicates'] += 1
+            continue
+        row = {'project_id': project_id, 'keyword': keyword}
+        if region_id is not None:
+            # Без region_id срабатывает значение по умолчанию столбца (регион по умолчанию)
+            row['region_id'] = region_id
+        candidates[key] = row
+
+    existing = {normalize_keyword(keyword).lower() for (keyword,) in db.session.execute(
+        select(Keyword.keyword).where(Keyword.project_id == project_id)
+    )}
+    stats['added'] = _insert_new(Keyword.__table__, project_id, candidates, existing, chunk_size)
+    stats['existing'] = len(candidates) - stats['added']
+    logger.info(f"Импорт ключевых слов проекта {project_id}: {stats}")
+    return stats
+
+def import_urls(project_id: int, values: Iterable[str], chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Массово добавляет URL в проект по той же схеме, что и import_keywords
+
+    Returns:
+        Счетчики: received, added, existing, duplicates, invalid
+    """
+    stats = {'received': 0, 'added': 0, 'existing': 0, 'duplicates': 0, 'invalid': 0}
+    candidates = {}
+    for value in values:
+        if not value.strip():
+            continue
+        stats['received'] += 1
+        url = normalize_url(value)
+        if url is None or len(url) > URL_MAX_LENGTH:
+            stats['invalid'] += 1
+            continue
+        if url in candidates:
+            stats['duplicates'] += 1
+            continue
+        candidates[url] = {'project_id': project_id, 'url': url}
+
+    existing = {url for (url,) in db.session.execute(select(URL.url).where(URL.project_id == project_id))}
+    stats['added'] = _insert_new(URL.__table__, project_id, candidates, existing, chunk_size)
+    stats['existing'] = len(candidates) - stats['added']
+    logger.info(f"Импорт URL проекта {project_id}: {stats}")
+    return stats
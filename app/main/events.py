@@ -0,0 +1,41 @@
+from flask_login import current_user
+from flask_socketio import join_room, leave_room
+from app import socketio
+from app.models import Project
+from app.tasks.progress import project_room
+
+def _project_id(data):
+    """ID проекта из данных события или None, если данные некорректны"""
+    if not isinstance(data, dict):
+        return None
+    try:
+        project_id = int(data.get('project_id'))
+    except (TypeError, ValueError):
+        return None
+    return project_id if project_id > 0 else None
+
+@socketio.on('join_project')
+def join_project(data):
+    """Подписка клиента на события обновления проекта"""
+    if not current_user.is_authenticated:
+        return False
+
+    project_id = _project_id(data)
+    if project_id is None:
+        return False
+
+    project = Project.query.get(project_id)
+    if not project or project.user_id != current_user.id:
+        return False
+
+    join_room(project_room(project.id))
+    return True
+
+@socketio.on('leave_project')
+def leave_project(data):
+    project_id = _project_id(data)
+    if project_id is None:
+        return False
+
+    leave_room(project_room(project_id))
+    return True
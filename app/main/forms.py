@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, TextAreaField, SubmitField, HiddenField
 from wtforms.validators import DataRequired, Length, URL, Optional
 
@@ -19,9 +20,11 @@ class ProjectForm(FlaskForm):
     submit = SubmitField('Создать проект')
 
 class KeywordForm(FlaskForm):
-    keywords = TextAreaField('Ключевые слова', validators=[DataRequired()])
+    keywords = TextAreaField('Ключевые слова', validators=[Optional()])
+    file = FileField('Файл CSV/XLSX', validators=[FileAllowed(['csv', 'txt', 'xlsx'])])
     submit = SubmitField('Добавить ключевые слова')
 
 class URLForm(FlaskForm):
-    urls = TextAreaField('URLs', validators=[DataRequired()])
+    urls = TextAreaField('URLs', validators=[Optional()])
+    file = FileField('Файл CSV/XLSX', validators=[FileAllowed(['csv', 'txt', 'xlsx'])])
     submit = SubmitField('Добавить URLs')
@@ -1,21 +1,26 @@
 from datetime import datetime
-from flask import render_template, flash, redirect, url_for, request, jsonify, current_app, session, send_file
+from flask import render_template, flash, redirect, url_for, request, jsonify, current_app, session
 from flask_login import login_required, current_user
 from flask_wtf import FlaskForm
-from app import db, socketio, csrf
+from app import db, csrf
 from app.main import bp
 from app.main.forms import ProjectForm, URLForm, KeywordForm
-from app.models import User, Project, Keyword, KeywordPosition, URL, URLTraffic, Region
+from app.models import User, Project, Keyword, KeywordPosition, URL, URLTraffic, Region, RefreshJob
 from app.yandex import YandexMetrikaAPI, YandexWebmasterAPI
 import logging
 import threading
 import time
-from urllib.parse import urlparse
-import io
-import xlsxwriter
 import builtins
-from app.tasks.update_positions import update_project_positions  # Добавляем импорт
-import os
+import itertools
+from app.tasks.jobs import enqueue_job, get_active_job, get_latest_job, request_cancel
+from app.tasks.progress import job_progress
+from app.tasks.position_writer import PositionWriter, rebuild_position_snapshots
+from app.reports import build_positions_report, position_distribution, position_bucket_condition, positions_page, daily_positions_series, build_traffic_report
+from app.reports.cache import cached_report, bump_data_version
+from app.bulk_import import import_keywords, import_urls, iter_upload_values
+from app.regions import region_name
+from app.reports.export import xlsx_response, csv_gzip_response, traffic_matrix, traffic_header, EXPORT_YIELD_PER
+from sqlalchemy import func
 
 logger = logging.getLogger(__name__)
 
@@ -71,21 +76,16 @@ def project(id):
         flash('У вас нет доступа к этому проекту')
         return redirect(url_for('main.index'))
         
-    # Проверяем наличие региона по умолчанию
-    default_region = Region.query.filter_by(code=213).first()  # 213 - код Москвы
-    if not default_region:
-        default_region = Region(name='Москва', code=213)
-        db.session.add(default_region)
-        db.session.commit()
-        current_app.logger.info('Создан регион по умолчанию (Москва)')
-    
-    # Проверяем и обновляем регион для ключевых слов
-    for keyword in project.keywords:
-        if not keyword.region_id:
-            keyword.region_id = default_region.id
-    db.session.commit()
+    # Сводка по ключевым словам одним агрегатным запросом; названия регионов - из справочника в памяти
+    keyword_count, last_update = db.session.query(
+        func.count(Keyword.id), func.max(Keyword.last_webmaster_update)
+    ).filter(Keyword.project_id == project.id).one()
+    region_ids = [region_id for (region_id,) in
+                  db.session.query(Keyword.region_id).filter(Keyword.project_id == project.id).distinct()]
+    region_names = sorted(filter(None, (region_name(region_id) for region_id in region_ids)))
         
-    return render_template('main/project.html', project=project)
+    return render_template('main/project.html', project=project, keyword_count=keyword_count,
+                           keyword_regions=region_names, keywords_updated=last_update)
 
 @bp.route('/project/<int:project_id>/keywords')
 @login_required
@@ -95,7 +95,19 @@ def project_keywords(project_id):
         flash('У вас нет доступа к этому проекту', 'error')
         return redirect(url_for('main.dashboard'))
 
-    return render_template('main/keywords.html', project=project)
+    return render_template('main/keywords.html', project=project, form=KeywordForm(),
+                           regions=Region.query.order_by(Region.name).all())
+
+def _import_values(field):
+    """Значения для импорта: из загруженного файла или из текстового поля формы"""
+    upload = request.files.get('file')
+    if upload and upload.filename:
+        return iter_upload_values(upload)
+    return request.form.get(field, '').splitlines()
+
+def _import_message(stats, noun):
+    return (f"{noun}: добавлено {stats['added']}, уже были в проекте {stats['existing']}, "
+            f"повторы {stats['duplicates']}, пропущено {stats['invalid']}")
 
 @bp.route('/project/<int:project_id>/keywords/add', methods=['POST'])
 @login_required
@@ -106,31 +118,24 @@ def add_keyword(project_id):
             flash('У вас нет доступа к этому проекту', 'error')
             return redirect(url_for('main.dashboard'))
 
-        keywords_text = request.form.get('keywords', '').strip()
-        if not keywords_text:
-            flash('Введите хотя бы одно ключевое слово', 'error')
+        region_id = request.form.get('region_id', type=int)
+        if region_id is not None and not db.session.get(Region, region_id):
+            flash('Выбран неизвестный регион', 'error')
             return redirect(url_for('main.project_keywords', project_id=project_id))
 
-        # Разбиваем текст на отдельные ключевые слова
-        keywords = [kw.strip() for kw in keywords_text.split('\n') if kw.strip()]
-        
-        # Добавляем каждое ключевое слово
-        for keyword_text in keywords:
-            try:
-                # Проверяем, существует ли уже такое ключевое слово
-                if not Keyword.query.filter_by(project_id=project_id, keyword=keyword_text).first():
-                    keyword = Keyword(project_id=project_id, keyword=keyword_text)
-                    db.session.add(keyword)
-
-            except Exception as e:
-                flash(f'Ошибка при добавлении ключевого слова {keyword_text}: {str(e)}', 'error')
-                continue
+        # Нормализация, дедупликация и проверка существующих слов - одним проходом,
+        # новые слова вставляются пакетно
+        stats = import_keywords(project_id, _import_values('keywords'), region_id=region_id)
+        if not stats['received']:
+            flash('Введите хотя бы одно ключевое слово или загрузите файл', 'error')
+            return redirect(url_for('main.project_keywords', project_id=project_id))
 
         db.session.commit()
-        flash('Ключевые слова успешно добавлены', 'success')
+        flash(_import_message(stats, 'Ключевые слова'), 'success')
         return redirect(url_for('main.project_keywords', project_id=project_id))
 
     except Exception as e:
+        db.session.rollback()
         flash(f'Произошла ошибка: {str(e)}', 'error')
         return redirect(url_for('main.project_keywords', project_id=project_id))
 
@@ -144,6 +149,7 @@ def delete_keyword(project_id, keyword_id):
 
     try:
         db.session.delete(keyword)
+        bump_data_version(project_id)
         db.session.commit()
         flash('Ключевое слово успешно удалено', 'success')
     except Exception as e:
@@ -161,6 +167,7 @@ def clear_all_keywords(project_id):
 
     try:
         Keyword.query.filter_by(project_id=project_id).delete()
+        bump_data_version(project_id)
         db.session.commit()
         flash('Все ключевые слова успешно удалены', 'success')
     except Exception as e:
@@ -176,7 +183,7 @@ def project_urls(project_id):
         flash('У вас нет доступа к этому проекту', 'error')
         return redirect(url_for('main.dashboard'))
 
-    return render_template('main/urls.html', project=project)
+    return render_template('main/urls.html', project=project, form=URLForm())
 
 @bp.route('/project/<int:project_id>/urls/add', methods=['POST'])
 @login_required
@@ -187,40 +194,17 @@ def add_urls(project_id):
             flash('У вас нет доступа к этому проекту', 'error')
             return redirect(url_for('main.dashboard'))
 
-        urls_text = request.form.get('urls', '').strip()
-        if not urls_text:
-            flash('Введите хотя бы один URL', 'error')
+        stats = import_urls(project_id, _import_values('urls'))
+        if not stats['received']:
+            flash('Введите хотя бы один URL или загрузите файл', 'error')
             return redirect(url_for('main.project_urls', project_id=project_id))
 
-        # Разбиваем текст на отдельные URL
-        urls = [url.strip() for url in urls_text.split('\n') if url.strip()]
-        
-        # Проверяем каждый URL
-        for url_str in urls:
-            try:
-                # Проверяем, что URL начинается с http:// или https://
-                if not url_str.startswith(('http://', 'https://')):
-                    url_str = 'https://' + url_str
-
-                # Проверяем, что URL валидный
-                result = urlparse(url_str)
-                if not all([result.scheme, result.netloc]):
-                    raise ValueError(f'Неверный формат URL: {url_str}')
-
-                # Проверяем, существует ли уже такой URL
-                if not URL.query.filter_by(project_id=project_id, url=url_str).first():
-                    url = URL(project_id=project_id, url=url_str)
-                    db.session.add(url)
-
-            except Exception as e:
-                flash(f'Ошибка при добавлении URL {url_str}: {str(e)}', 'error')
-                continue
-
         db.session.commit()
-        flash('URL успешно добавлены', 'success')
+        flash(_import_message(stats, 'URL'), 'success')
         return redirect(url_for('main.project_urls', project_id=project_id))
 
     except Exception as e:
+        db.session.rollback()
         flash(f'Произошла ошибка: {str(e)}', 'error')
         return redirect(url_for('main.project_urls', project_id=project_id))
 
@@ -234,6 +218,7 @@ def delete_url(project_id, url_id):
 
     try:
         db.session.delete(url)
+        bump_data_version(project_id)
         db.session.commit()
         flash('URL успешно удален', 'success')
     except Exception as e:
@@ -251,6 +236,7 @@ def clear_all_urls(project_id):
 
     try:
         URL.query.filter_by(project_id=project_id).delete()
+        bump_data_version(project_id)
         db.session.commit()
         flash('Все URL успешно удалены', 'success')
     except Exception as e:
@@ -351,14 +337,15 @@ def get_project_data(project_id):
         if project.user_id != current_user.id:
             return jsonify({'error': 'Unauthorized'}), 403
 
-        # Эмулируем процесс обновления с отправкой прогресса
-        for progress in range(0, 101, 20):
-            socketio.emit('update_progress', {'progress': progress})
-            time.sleep(1)  # Имитация длительной операции
-        
-        # После завершения обновления
-        socketio.emit('update_complete', {'message': 'Данные успешно обновлены'})
-        return jsonify({'status': 'success', 'message': 'Данные успешно обновлены'})
+        # Прогресс (update_progress) и завершение (update_complete) воркер
+        # публикует в комнату проекта Socket.IO
+        job, created = enqueue_job(project_id, kind='positions')
+        return jsonify({
+            'status': 'success',
+            'message': 'Обновление данных запущено' if created else 'Обновление данных уже выполняется',
+            'job_id': job.id,
+            'progress': job_progress(job)
+        })
 
     except Exception as e:
         current_app.logger.error(f"Error in get_project_data: {str(e)}")
@@ -372,124 +359,18 @@ def project_positions_report(project_id):
         flash('У вас нет доступа к этому проекту', 'error')
         return redirect(url_for('main.dashboard'))
 
-    # Получаем все записи о позициях
-    position_records = (KeywordPosition.query
-                       .join(Keyword)
-                       .filter(Keyword.project_id == project_id)
-                       .order_by(KeywordPosition.check_date.asc())
-                       .all())
-
-    # Группируем данные по ключевым словам и датам
-    positions_data = {}
-    check_dates = set()
-    date_intervals = {}  # Добавляем словарь для хранения интервалов дат
-    avg_positions = []
-    
-    for record in position_records:
-        keyword = record.keyword.keyword
-        date = record.check_date.strftime('%Y-%m-%d')
-        check_dates.add(date)
-        
-        if keyword not in positions_data:
-            positions_data[keyword] = {}
-            
-        # Сохраняем интервал дат для каждой проверки
-        if date not in date_intervals:
-            date_intervals[date] = {
-                'start': record.data_date_start.strftime('%Y-%m-%d') if record.data_date_start else None,
-                'end': record.data_date_end.strftime('%Y-%m-%d') if record.data_date_end else None
-            }
-            
-        positions_data[keyword][date] = {
-            'position': record.position,
-            'data_date_start': record.data_date_start.strftime('%Y-%m-%d') if record.data_date_start else None,
-            'data_date_end': record.data_date_end.strftime('%Y-%m-%d') if record.data_date_end else None,
-            'change': None,  # Будет вычислено позже
-            'change_value': None  # Будет вычислено позже
-        }
-
-    # Сортируем даты
-    check_dates = sorted(list(check_dates))
-
-    # Вычисляем изменения для каждого ключевого слова
-    for keyword in positions_data:
-        dates = sorted(positions_data[keyword].keys())
-        for i in range(1, len(dates)):
-            current_date = dates[i]
-            prev_date = dates[i-1]
-            current_pos = positions_data[keyword][current_date]['position']
-            prev_pos = positions_data[keyword][prev_date]['position']
-            
-            if current_pos > 0 and prev_pos > 0:
-                change = prev_pos - current_pos
-                positions_data[keyword][current_date]['change'] = change
-                positions_data[keyword][current_date]['change_value'] = abs(change)
-
-    # Вычисляем средние позиции для графика и статистики
-    for date in check_dates:
-        positions = []
-        total_change = 0
-        for data in positions_data.values():
-            if date in data and data[date]['position'] > 0:
-                positions.append(data[date]['position'])
-                if data[date]['change'] is not None:
-                    total_change += data[date]['change']
-        
-        if positions:
-            avg = sum(positions) / len(positions)
-            avg_positions.append({
-                'x': date,
-                'y': round(avg, 1),
-                'change': round(total_change / len(positions), 1) if positions else 0
-            })
-
-    # Подготавливаем данные об изменениях
-    changes_data = {
-        'total_keywords': len(positions_data),
-        'improved': 0,
-        'worsened': 0,
-        'unchanged': 0
-    }
-
-    biggest_improvements = []
-    biggest_drops = []
-
-    for keyword, data in positions_data.items():
-        dates = sorted(data.keys())
-        if len(dates) >= 2:
-            current = data[dates[-1]]['position']
-            previous = data[dates[-2]]['position']
-            
-            if current > 0 and previous > 0:
-                change = previous - current
-                change_data = {
-                    'keyword': keyword,
-                    'current_position': current,
-                    'previous_position': previous,
-                    'change': abs(change)
-                }
-                
-                if change > 0:
-                    changes_data['improved'] += 1
-                    biggest_improvements.append(change_data)
-                elif change < 0:
-                    changes_data['worsened'] += 1
-                    biggest_drops.append(change_data)
-                else:
-                    changes_data['unchanged'] += 1
-
-    # Сортируем улучшения и падения
-    biggest_improvements = sorted(biggest_improvements, key=lambda x: x['change'], reverse=True)[:5]
-    biggest_drops = sorted(biggest_drops, key=lambda x: x['change'], reverse=True)[:5]
+    # Тяжелые вычисления (изменения, средние, топы) выполняются в SQL, результат кэшируется
+    # до следующей записи данных проекта. Таблица рендерится только первой страницей,
+    # остальные страницы подгружаются из project_positions_data
+    report = cached_report('positions_report', project_id, lambda: dict(
+        build_positions_report(project_id),
+        distribution=position_distribution(project_id),
+        first_page=positions_page(project_id)
+    ))
 
     return render_template('main/positions_report.html',
                          project=project,
-                         positions_data=positions_data,
-                         check_dates=check_dates,
-                         avg_positions=avg_positions,
-                         changes_data=changes_data,
-                         biggest_improvements=biggest_improvements,
-                         biggest_drops=biggest_drops)
+                         **report)
 
 @bp.route('/project/<int:project_id>/positions/table')
 @login_required
@@ -499,31 +380,58 @@ def project_positions_table(project_id):
         flash('У вас нет доступа к этому проекту', 'error')
         return redirect(url_for('main.dashboard'))
 
-    # Get all keyword positions for the project
-    positions = (KeywordPosition.query
-                .join(Keyword)
-                .filter(Keyword.project_id == project_id)
-                .order_by(KeywordPosition.check_date.desc())
-                .all())
-
-    # Group positions by keyword and date
-    positions_by_keyword = {}
-    for pos in positions:
-        keyword = pos.keyword.keyword
-        if keyword not in positions_by_keyword:
-            positions_by_keyword[keyword] = []
-        positions_by_keyword[keyword].append({
-            'date': pos.check_date.strftime('%Y-%m-%d'),
-            'position': pos.position
-        })
-
-    # Sort positions for each keyword by date
-    for keyword in positions_by_keyword:
-        positions_by_keyword[keyword].sort(key=lambda x: x['date'], reverse=True)
+    # Первая страница keyset-пагинации; фильтры, сортировка и следующие страницы
+    # загружаются из project_positions_data
+    first_page = cached_report('positions_table', project_id, lambda: positions_page(project_id))
 
     return render_template('main/positions_table.html',
                          project=project,
-                         positions_data=positions_by_keyword)
+                         first_page=first_page)
+
+@bp.route('/project/<int:project_id>/positions/data')
+@login_required
+def project_positions_data(project_id):
+    project = Project.query.get_or_404(project_id)
+    if project.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    keyword = request.args.get('keyword', '').strip()
+    try:
+        page = positions_page(
+            project_id,
+            search=keyword or None,
+            bucket=request.args.get('position') or None,
+            sort=request.args.get('sort', 'keyword'),
+            order=request.args.get('order', 'asc'),
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', 100, type=int)
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    page['distribution'] = position_distribution(project_id, search=keyword or None)
+    return jsonify(page)
+
+@bp.route('/project/<int:project_id>/positions/history')
+@login_required
+def project_positions_history(project_id):
+    project = Project.query.get_or_404(project_id)
+    if project.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    try:
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        series = daily_positions_series(
+            project_id,
+            granularity=request.args.get('granularity', 'week'),
+            date_from=datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None,
+            date_to=datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None,
+            keyword_ids=request.args.getlist('keyword_id', type=int) or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(series)
 
 @bp.route('/project/<int:project_id>/positions/changes')
 @login_required
@@ -533,45 +441,26 @@ def project_positions_changes(project_id):
         flash('У вас нет доступа к этому проекту', 'error')
         return redirect(url_for('main.dashboard'))
 
-    # Get all keyword positions for the project
-    positions = (KeywordPosition.query
-                .join(Keyword)
-                .filter(Keyword.project_id == project_id)
-                .order_by(KeywordPosition.check_date.desc())
-                .all())
-
-    # Group positions by keyword and date
-    positions_by_keyword = {}
-    for pos in positions:
-        keyword = pos.keyword.keyword
-        if keyword not in positions_by_keyword:
-            positions_by_keyword[keyword] = []
-        positions_by_keyword[keyword].append({
-            'date': pos.check_date.strftime('%Y-%m-%d'),
-            'position': pos.position
-        })
-
-    # Sort positions for each keyword by date
-    for keyword in positions_by_keyword:
-        positions_by_keyword[keyword].sort(key=lambda x: x['date'], reverse=True)
-
-    # Calculate position changes
-    position_changes = []
-    for keyword in positions_by_keyword:
-        positions_list = positions_by_keyword[keyword]
-        if len(positions_list) > 1:
-            current_pos = positions_list[0]['position']
-            previous_pos = positions_list[1]['position']
-            change = previous_pos - current_pos
-            position_changes.append({
-                'keyword': keyword,
-                'current_position': current_pos,
-                'previous_position': previous_pos,
-                'change': change
-            })
-
-    # Sort by absolute change value for biggest changes
-    position_changes.sort(key=lambda x: abs(x['change']), reverse=True)
+    # Read the latest/previous position snapshot kept on Keyword
+    def build_changes():
+        snapshots = (db.session.query(Keyword.keyword,
+                                      Keyword.current_position,
+                                      Keyword.previous_position,
+                                      Keyword.position_delta)
+                     .filter(Keyword.project_id == project_id,
+                             Keyword.previous_position.isnot(None))
+                     .order_by(func.abs(Keyword.position_delta).desc())
+                     .all())
+
+        # Biggest changes first
+        return [{
+            'keyword': keyword,
+            'current_position': current_pos,
+            'previous_position': previous_pos,
+            'change': change
+        } for keyword, current_pos, previous_pos, change in snapshots]
+
+    position_changes = cached_report('positions_changes', project_id, build_changes)
 
     return render_template('main/positions_changes.html',
                          project=project,
@@ -609,76 +498,22 @@ def refresh_project_data(project_id):
         # Проверяем токены
         if not project.yandex_metrika_token or not project.yandex_webmaster_token:
             flash('Необходимо добавить токены Яндекс.Метрики и Яндекс.Вебмастера', 'error')
-            return redirect(url_for('main.project', project_id=project_id))
+            return redirect(url_for('main.project', id=project_id))
 
-        # Создаем API клиенты
-        webmaster_api = YandexWebmasterAPI(project.yandex_webmaster_token)
-        metrika_api = YandexMetrikaAPI(project.yandex_metrika_token)
-
-        # Обновляем данные по ключевым словам
-        current_app.logger.info(f"Updating keyword data for project {project_id}")
-        keywords_list = [(kw.keyword, kw) for kw in project.keywords]
-        positions = webmaster_api.get_keywords_positions(project.yandex_webmaster_host, [kw for kw, _ in keywords_list])
-        
-        for keyword, keyword_obj in keywords_list:
-            try:
-                # Проверяем, существует ли уже такое ключевое слово
-                if keyword in positions:
-                    pos_data = positions[keyword]
-                    position = KeywordPosition(
-                        keyword_id=keyword_obj.id,
-                        position=pos_data['position'],
-                        check_date=datetime.utcnow(),
-                        data_date_start=datetime.strptime(pos_data['date_from'], '%Y-%m-%d'),
-                        data_date_end=datetime.strptime(pos_data['date_to'], '%Y-%m-%d')
-                    )
-                    db.session.add(position)
-            except Exception as e:
-                current_app.logger.error(f"Error processing keyword {keyword}: {str(e)}")
-                continue
-
-        # Обновляем данные по URL
-        current_app.logger.info(f"Updating URL data for project {project_id}")
-        for url in project.urls:
-            try:
-                # Получаем трафик из Метрики за последние 7 дней
-                traffic_data = metrika_api.get_url_traffic(
-                    counter_id=project.yandex_metrika_counter,
-                    url=url.url,
-                    date_from=(datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'),
-                    date_to=datetime.now().strftime('%Y-%m-%d')
-                )
-                
-                if traffic_data:
-                    traffic = URLTraffic(
-                        url_id=url.id,
-                        visits=traffic_data['visits'],
-                        check_date=datetime.utcnow()
-                    )
-                    db.session.add(traffic)
-                
-                # Получаем данные по URL из Вебмастера
-                url_data = webmaster_api.get_url_data(project.yandex_webmaster_host, url.url)
-                if url_data:
-                    url.last_status = url_data.get('status', 'UNKNOWN')
-                    url.last_status_code = url_data.get('http_code')
-                    url.last_check = datetime.utcnow()
-            
-            except Exception as e:
-                current_app.logger.error(f"Error processing URL {url.url}: {str(e)}")
-                continue
-
-        # Сохраняем все изменения
-        db.session.commit()
-        current_app.logger.info(f"Successfully updated all data for project {project_id}")
-        flash('Данные успешно обновлены', 'success')
+        # Позиции и трафик обновляет воркер: трафик всех URL - одним отчетом Метрики
+        created = [enqueue_job(project_id, kind=kind)[1] for kind in ('positions', 'traffic')]
+        current_app.logger.info(f"Обновление данных проекта {project_id} поставлено в очередь")
+        if any(created):
+            flash('Обновление данных запущено', 'success')
+        else:
+            flash('Обновление данных уже выполняется', 'info')
         
-        return redirect(url_for('main.project', project_id=project_id))
+        return redirect(url_for('main.project', id=project_id))
 
     except Exception as e:
         current_app.logger.error(f"Error updating data: {str(e)}")
         flash('Произошла ошибка при обновлении данных', 'error')
-        return redirect(url_for('main.project', project_id=project_id))
+        return redirect(url_for('main.project', id=project_id))
 
 @bp.route('/project/<int:project_id>/refresh_positions', methods=['POST'])
 @login_required
@@ -694,51 +529,22 @@ def refresh_positions(project_id):
                 'message': 'У вас нет доступа к этому проекту'
             })
 
-        # Проверяем, не запущен ли уже процесс
-        pid_file = os.path.join(current_app.root_path, '..', 'logs', f'update_positions_{project_id}.pid')
-        process_running = False
-        
-        if os.path.exists(pid_file):
-            try:
-                with open(pid_file, 'r') as f:
-                    pid = int(f.read().strip())
-                # Проверяем, существует ли процесс
-                os.kill(pid, 0)  # Проверка существования процесса
-                process_running = True
-            except (ProcessLookupError, ValueError, OSError):
-                # Если процесс не существует, удаляем pid файл
-                try:
-                    os.remove(pid_file)
-                except OSError:
-                    pass
-
-        if process_running:
-            current_app.logger.warning(f"Процесс обновления позиций для проекта {project_id} уже запущен (PID: {pid})")
+        # Ставим задачу в очередь; выполняет ее отдельный процесс worker.py
+        job, created = enqueue_job(project_id, kind='positions')
+        if not created:
+            current_app.logger.warning(f"Процесс обновления позиций для проекта {project_id} уже запущен (задача {job.id})")
             return jsonify({
                 'status': 'error',
-                'message': 'Процесс обновления уже запущен'
+                'message': 'Процесс обновления уже запущен',
+                'job_id': job.id
             })
-        
-        # Создаем директорию для логов если её нет
-        log_dir = os.path.join(current_app.root_path, '..', 'logs')
-        os.makedirs(log_dir, exist_ok=True)
 
-        current_app.logger.info(f"Запускаем обновление позиций для проекта {project_id}")
-        
-        # Запускаем процесс обновления позиций
-        try:
-            update_project_positions(project_id)
-            current_app.logger.info(f"Процесс обновления позиций для проекта {project_id} успешно запущен")
-            return jsonify({
-                'status': 'success',
-                'message': 'Процесс обновления позиций запущен'
-            })
-        except Exception as e:
-            current_app.logger.error(f"Ошибка при запуске обновления позиций для проекта {project_id}: {str(e)}")
-            return jsonify({
-                'status': 'error',
-                'message': str(e)
-            })
+        current_app.logger.info(f"Обновление позиций для проекта {project_id} поставлено в очередь (задача {job.id})")
+        return jsonify({
+            'status': 'success',
+            'message': 'Процесс обновления позиций запущен',
+            'job_id': job.id
+        })
 
     except Exception as e:
         current_app.logger.error(f"Критическая ошибка при обработке запроса на обновление позиций: {str(e)}")
@@ -772,12 +578,13 @@ def generate_test_data(project_id):
     check_dates = [base_date - timedelta(days=i*3) for i in range(10)]  # Каждые 3 дня
 
     # Для каждого ключевого слова генерируем позиции
-    for keyword in keywords:
+    writer = PositionWriter(update_keywords=False, update_snapshot=False)
+    for index, keyword in enumerate(keywords):
         # Определяем тренд для ключевого слова
-        if keywords.index(keyword) == 0:  # Первое слово - рост
+        if index == 0:  # Первое слово - рост
             start_pos = 50
             end_pos = 5
-        elif keywords.index(keyword) == 1:  # Второе слово - падение
+        elif index == 1:  # Второе слово - падение
             start_pos = 10
             end_pos = 80
         else:  # Остальные - случайные колебания
@@ -795,15 +602,17 @@ def generate_test_data(project_id):
             position = max(1, base_position + uniform(-5, 5))
             
             # Создаем запись о позиции
-            position_record = KeywordPosition(
-                keyword_id=keyword.id,
-                position=position,
+            writer.add(
+                keyword.id,
+                position,
                 check_date=check_dates[i],
                 data_date_start=check_dates[i] - timedelta(days=7),
-                data_date_end=check_dates[i]
+                data_date_end=check_dates[i],
+                region_id=keyword.region_id
             )
-            db.session.add(position_record)
 
+    writer.flush()
+    rebuild_position_snapshots(project_id)
     db.session.commit()
     flash('Тестовые данные успешно сгенерированы', 'success')
     return redirect(url_for('main.project_positions_report', project_id=project_id))
@@ -833,50 +642,44 @@ def export_positions(project_id):
         query = query.filter(Keyword.keyword.ilike(f'%{keyword}%'))
 
     if position_filter:
-        if position_filter == 'top1':
-            query = query.filter(KeywordPosition.position >= 1.0, KeywordPosition.position < 2.0)
-        elif position_filter == 'top3':
-            query = query.filter(KeywordPosition.position >= 1.0, KeywordPosition.position < 4.0)
-        elif position_filter == 'top5':
-            query = query.filter(KeywordPosition.position >= 1.0, KeywordPosition.position < 6.0)
-        elif position_filter == 'top10':
-            query = query.filter(KeywordPosition.position >= 1.0, KeywordPosition.position < 11.0)
-        elif position_filter == 'top100':
-            query = query.filter(KeywordPosition.position >= 100.0)
+        try:
+            query = query.filter(position_bucket_condition(KeywordPosition.position, position_filter))
+        except ValueError:
+            pass
 
     if date_from:
         query = query.filter(KeywordPosition.check_date >= datetime.strptime(date_from, '%Y-%m-%d'))
     if date_to:
         query = query.filter(KeywordPosition.check_date <= datetime.strptime(date_to, '%Y-%m-%d'))
 
-    # Get positions ordered by date and keyword
-    positions = query.order_by(KeywordPosition.check_date.desc(), Keyword.keyword).all()
+    # Stream rows from the database instead of loading them all at once
+    rows = (query.with_entities(Keyword.keyword, KeywordPosition.position, KeywordPosition.check_date)
+            .order_by(KeywordPosition.check_date.desc(), Keyword.keyword)
+            .yield_per(EXPORT_YIELD_PER))
+    headers = ['Ключевое слово', 'Позиция', 'Дата']
+    file_name = f'positions_{datetime.now().strftime("%Y%m%d")}'
 
-    # Create Excel file
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output)
-    worksheet = workbook.add_worksheet()
+    if request.args.get('format') == 'csv':
+        return csv_gzip_response(
+            headers,
+            ((keyword_text, position, check_date.strftime('%Y-%m-%d')) for keyword_text, position, check_date in rows),
+            f'{file_name}.csv.gz'
+        )
 
-    # Add headers
-    headers = ['Ключевое слово', 'Позиция', 'Дата']
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header)
+    def write_workbook(workbook):
+        worksheet = workbook.add_worksheet()
 
-    # Add data
-    for row, position in enumerate(positions, 1):
-        worksheet.write(row, 0, position.keyword.keyword)
-        worksheet.write(row, 1, position.position)
-        worksheet.write(row, 2, position.check_date.strftime('%Y-%m-%d'))
+        # Add headers
+        for col, header in enumerate(headers):
+            worksheet.write(0, col, header)
 
-    workbook.close()
-    output.seek(0)
+        # Add data
+        for row, (keyword_text, position, check_date) in enumerate(rows, 1):
+            worksheet.write(row, 0, keyword_text)
+            worksheet.write(row, 1, position)
+            worksheet.write(row, 2, check_date.strftime('%Y-%m-%d'))
 
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'positions_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    )
+    return xlsx_response(write_workbook, f'{file_name}.xlsx')
 
 @bp.route('/test-chart')
 @login_required
@@ -888,6 +691,30 @@ def test_chart():
     }
     return render_template('main/test_chart.html', title='Тестовый график', chart_data=data, zip=builtins.zip)
 
+@bp.route('/project/<int:project_id>/cancel_refresh', methods=['POST'])
+@login_required
+def cancel_refresh(project_id):
+    project = Project.query.get_or_404(project_id)
+    if project.user_id != current_user.id:
+        return jsonify({
+            'status': 'error',
+            'message': 'У вас нет доступа к этому проекту'
+        })
+
+    job = get_active_job(project_id, kind='positions')
+    if not job or not request_cancel(job.id):
+        return jsonify({
+            'status': 'error',
+            'message': 'Процесс обновления не запущен'
+        })
+
+    current_app.logger.info(f"Запрошена остановка обновления позиций для проекта {project_id} (задача {job.id})")
+    return jsonify({
+        'status': 'success',
+        'message': 'Остановка процесса обновления запрошена',
+        'job_id': job.id
+    })
+
 @bp.route('/project/<int:project_id>/update_status')
 @login_required
 def check_update_status(project_id):
@@ -899,74 +726,52 @@ def check_update_status(project_id):
                 'message': 'У вас нет доступа к этому проекту'
             })
         
-        # Проверяем флаг в сессии
-        session_key = f'update_completed_{project_id}'
-        if session.get(session_key):
-            # Если флаг установлен, сбрасываем его и возвращаем статус not_running
-            session.pop(session_key, None)
+        # Статус читается из записи задачи в очереди: один запрос по индексу
+        job = get_latest_job(project_id, kind='positions')
+        if job is None:
             return jsonify({
                 'status': 'not_running',
                 'message': 'Процесс обновления не запущен'
             })
-        
-        # Проверяем наличие ошибок в логах
-        try:
-            log_file = os.path.join(current_app.root_path, '..', 'logs', 'update_positions.log')
-            if os.path.exists(log_file):
-                with open(log_file, 'r', encoding='cp1251') as f:
-                    last_lines = f.readlines()[-10:]  # Читаем последние 10 строк
-                    for line in reversed(last_lines):
-                        if str(project_id) in line and 'ERROR' in line:
-                            return jsonify({
-                                'status': 'error',
-                                'message': line.split('ERROR - ')[-1].strip()
-                            })
-        except Exception as e:
-            current_app.logger.error(f"Ошибка при чтении лог-файла: {e}")
-        
-        # Проверяем, запущен ли процесс
-        pid_file = os.path.join(current_app.root_path, '..', 'logs', f'update_positions_{project_id}.pid')
-        process_running = False
-        
-        if os.path.exists(pid_file):
-            try:
-                with open(pid_file, 'r') as f:
-                    pid = int(f.read().strip())
-                # Проверяем, существует ли процесс
-                os.kill(pid, 0)  # Проверка существования процесса
-                process_running = True
-            except (ProcessLookupError, ValueError, OSError):
-                # Если процесс не существует, удаляем pid файл
-                try:
-                    os.remove(pid_file)
-                except OSError:
-                    pass
-
-        if process_running:
+
+        progress = job_progress(job)
+        if job.is_active:
             return jsonify({
                 'status': 'running',
-                'message': 'Процесс обновления позиций выполняется'
+                'message': 'Процесс обновления позиций выполняется',
+                'job_id': job.id,
+                'progress': progress
             })
-        
-        # Проверяем, было ли обновление успешным
-        one_minute_ago = datetime.utcnow() - timedelta(minutes=1)
-        recent_update = KeywordPosition.query.join(Keyword).filter(
-            Keyword.project_id == project_id,
-            KeywordPosition.check_date >= one_minute_ago
-        ).first()
-        
-        if recent_update:
-            # Устанавливаем флаг в сессии
-            session[session_key] = True
+
+        # О результате завершенной задачи сообщаем один раз
+        session_key = f'update_reported_{project_id}'
+        if session.get(session_key) == job.id:
+            return jsonify({
+                'status': 'not_running',
+                'message': 'Процесс обновления не запущен'
+            })
+        session[session_key] = job.id
+
+        if job.status == RefreshJob.STATUS_COMPLETED:
             return jsonify({
                 'status': 'completed',
                 'success': True,
-                'message': 'Позиции успешно обновлены'
+                'message': 'Позиции успешно обновлены',
+                'job_id': job.id,
+                'progress': progress
+            })
+        if job.status == RefreshJob.STATUS_FAILED:
+            return jsonify({
+                'status': 'error',
+                'message': job.error or 'Произошла ошибка при обновлении позиций',
+                'job_id': job.id,
+                'progress': progress
             })
-        
         return jsonify({
             'status': 'not_running',
-            'message': 'Процесс обновления не запущен'
+            'message': 'Обновление позиций остановлено',
+            'job_id': job.id,
+            'progress': progress
         })
             
     except Exception as e:
@@ -976,6 +781,29 @@ def check_update_status(project_id):
             'message': str(e)
         })
 
+@bp.route('/project/<int:project_id>/traffic/refresh', methods=['POST'])
+@login_required
+def refresh_traffic(project_id):
+    project = Project.query.get_or_404(project_id)
+    if project.user_id != current_user.id:
+        return jsonify({
+            'success': False,
+            'message': 'У вас нет доступа к этому проекту'
+        })
+
+    if not project.yandex_metrika_token or not project.yandex_metrika_counter:
+        return jsonify({
+            'success': False,
+            'message': 'Необходимо добавить счетчик и токен Яндекс.Метрики'
+        })
+
+    job, created = enqueue_job(project_id, kind='traffic')
+    return jsonify({
+        'success': True,
+        'message': 'Обновление трафика запущено' if created else 'Обновление трафика уже выполняется',
+        'job_id': job.id
+    })
+
 @bp.route('/project/<int:project_id>/traffic/report')
 @login_required
 def traffic_report(project_id):
@@ -984,135 +812,16 @@ def traffic_report(project_id):
         flash('У вас нет доступа к этому проекту', 'error')
         return redirect(url_for('main.dashboard'))
 
-    # Получаем параметры фильтров
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
-    min_traffic = request.args.get('min_traffic', type=int)
-    url_filter = request.args.get('url_filter')
-
-    # Базовый запрос
-    query = (URLTraffic.query
-             .join(URL)
-             .filter(URL.project_id == project_id))
-
-    # Применяем фильтры
-    if date_from:
-        query = query.filter(URLTraffic.check_date >= datetime.strptime(date_from, '%Y-%m-%d'))
-    if date_to:
-        query = query.filter(URLTraffic.check_date <= datetime.strptime(date_to, '%Y-%m-%d'))
-    if url_filter:
-        url_filter = url_filter.replace('*', '%')
-        query = query.filter(URL.url.like(url_filter))
-
-    # Получаем все записи о трафике
-    traffic_records = query.order_by(URLTraffic.check_date.asc()).all()
-
-    # Группируем данные по URL и датам
-    traffic_data = {}
-    dates = set()
-    for record in traffic_records:
-        url = record.url.url
-        date = record.check_date.strftime('%Y-%m-%d')
-        dates.add(date)
-        
-        if url not in traffic_data:
-            traffic_data[url] = {}
-        traffic_data[url][date] = record.visits
-
-    # Сортируем даты от старых к новым
-    dates = sorted(list(dates))
-
-    # Подготавливаем данные для шаблона
-    formatted_data = []
-    
-    # Вычисляем средние значения для каждой даты
-    averages = []
-    for date in dates:
-        date_values = []
-        for url_data in traffic_data.values():
-            if date in url_data:
-                try:
-                    value = int(url_data[date])
-                    date_values.append(value)
-                except (ValueError, TypeError):
-                    continue
-        
-        try:
-            if date_values:
-                avg = sum(date_values) / len(date_values)
-                averages.append(int(round(avg)))
-            else:
-                averages.append(0)
-        except (ZeroDivisionError, TypeError):
-            averages.append(0)
-
-    # Подготавливаем данные об изменениях трафика
-    changes_data = []
-    for url, data in traffic_data.items():
-        sorted_dates = sorted(data.keys())  # сортируем от старых к новым
-        if len(sorted_dates) >= 2:
-            try:
-                current_traffic = int(data[sorted_dates[-1]])  # берем самую новую дату
-                previous_traffic = int(data[sorted_dates[-2]])  # берем предыдущую дату
-                change = current_traffic - previous_traffic
-                changes_data.append({
-                    'url': url,
-                    'current_traffic': current_traffic,
-                    'previous_traffic': previous_traffic,
-                    'change': change
-                })
-            except (ValueError, TypeError):
-                continue
-
-    # Сортируем изменения по убыванию и возрастанию для топов
-    biggest_increases = sorted(changes_data, key=lambda x: x['change'], reverse=True)[:5]
-    biggest_drops = sorted(changes_data, key=lambda x: x['change'])[:5]
-
-    # Форматируем данные по URL
-    for url, data in traffic_data.items():
-        url_traffic = []
-        
-        for date in dates:
-            try:
-                value = int(data.get(date, 0))
-                change = 0
-                change_value = ''
-                
-                # Для последней даты вычисляем изменение
-                if date == dates[-1] and len(dates) > 1:
-                    prev_value = int(data.get(dates[-2], 0))
-                    change = value - prev_value
-                    if change != 0:
-                        change_value = f"{abs(change)}"
-                
-                url_traffic.append({
-                    'value': value,
-                    'change': change,
-                    'change_value': change_value
-                })
-            except (ValueError, TypeError):
-                url_traffic.append({
-                    'value': 0,
-                    'change': 0,
-                    'change_value': ''
-                })
-            
-        if min_traffic is None or max(data.values(), default=0) >= min_traffic:
-            formatted_data.append({
-                'url': url,
-                'traffic': url_traffic
-            })
-
-    # Сортируем URL по убыванию максимального трафика
-    formatted_data.sort(key=lambda x: max((item['value'] for item in x['traffic']), default=0), reverse=True)
-
-    return render_template('main/traffic_report.html',
-                         project=project,
-                         traffic_data=formatted_data,
-                         dates=dates,
-                         averages=averages,
-                         biggest_increases=biggest_increases,
-                         biggest_drops=biggest_drops)
+    # Матрица трафика, средние и топы изменений считаются в app.reports.traffic
+    filters = {
+        'date_from': request.args.get('date_from'),
+        'date_to': request.args.get('date_to'),
+        'min_traffic': request.args.get('min_traffic', type=int),
+        'url_filter': request.args.get('url_filter')
+    }
+    report = cached_report('traffic_report', project_id,
+                           lambda: build_traffic_report(project_id, **filters), **filters)
+    return render_template('main/traffic_report.html', project=project, **report)
 
 @bp.route('/project/<int:project_id>/traffic/export')
 @login_required
@@ -1122,83 +831,53 @@ def export_traffic(project_id):
         flash('У вас нет доступа к этому проекту', 'error')
         return redirect(url_for('main.dashboard'))
 
-    # Получаем данные аналогично отчету
-    query = (URLTraffic.query
-             .join(URL)
-             .filter(URL.project_id == project_id)
-             .order_by(URLTraffic.check_date.asc()))
-    
-    traffic_records = query.all()
-
-    # Группируем данные
-    traffic_data = {}
-    dates = set()
-    for record in traffic_records:
-        url = record.url.url
-        date = record.check_date.strftime('%Y-%m-%d')
-        dates.add(date)
+    # Даты и средние считаются в SQL, строки по URL читаются порциями
+    dates, averages, url_rows = traffic_matrix(project_id, header=cached_report(
+        'traffic_export_header', project_id, lambda: traffic_header(project_id)))
+    file_name = f'traffic_report_{project.name}_{datetime.now().strftime("%Y%m%d")}'
+
+    if request.args.get('format') == 'csv':
+        rows = [['Среднее'] + [averages.get(date, 0) for date in dates]]
+        return csv_gzip_response(
+            ['URL'] + dates,
+            itertools.chain(rows, ([url] + [data.get(date, 0) for date in dates] for url, data in url_rows)),
+            f'{file_name}.csv.gz'
+        )
+
+    def write_workbook(workbook):
+        worksheet = workbook.add_worksheet()
+
+        # Форматирование
+        header_format = workbook.add_format({
+            'bold': True,
+            'align': 'center',
+            'valign': 'vcenter',
+            'bg_color': '#F3F4F6'
+        })
         
-        if url not in traffic_data:
-            traffic_data[url] = {}
-        traffic_data[url][date] = record.visits
-
-    # Сортируем даты
-    dates = sorted(list(dates))
-
-    # Создаем Excel файл
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output)
-    worksheet = workbook.add_worksheet()
-
-    # Форматирование
-    header_format = workbook.add_format({
-        'bold': True,
-        'align': 'center',
-        'valign': 'vcenter',
-        'bg_color': '#F3F4F6'
-    })
-    
-    url_format = workbook.add_format({
-        'text_wrap': True,
-        'valign': 'vcenter'
-    })
+        url_format = workbook.add_format({
+            'text_wrap': True,
+            'valign': 'vcenter'
+        })
 
-    # Записываем заголовки
-    worksheet.write(0, 0, 'URL', header_format)
-    for i, date in enumerate(dates):
-        worksheet.write(0, i + 1, date, header_format)
-
-    # Записываем средние значения
-    worksheet.write(1, 0, 'Среднее', header_format)
-    for i, date in enumerate(dates):
-        date_values = []
-        for data in traffic_data.values():
-            if date in data:
-                date_values.append(data[date])
-        if date_values:
-            avg = int(round(sum(date_values) / len(date_values)))
-            worksheet.write(1, i + 1, avg)
-        else:
-            worksheet.write(1, i + 1, 0)
+        # Ширину столбцов в режиме constant_memory нужно задать до записи строк
+        worksheet.set_column(0, 0, 50)  # URL column
+        worksheet.set_column(1, max(len(dates), 1), 15)  # Date columns
 
-    # Записываем данные по URL
-    row = 2
-    for url, data in sorted(traffic_data.items(), key=lambda x: max(x[1].values(), default=0), reverse=True):
-        worksheet.write(row, 0, url, url_format)
+        # Записываем заголовки
+        worksheet.write(0, 0, 'URL', header_format)
         for i, date in enumerate(dates):
-            worksheet.write(row, i + 1, data.get(date, 0))
-        row += 1
-
-    # Устанавливаем ширину столбцов
-    worksheet.set_column(0, 0, 50)  # URL column
-    worksheet.set_column(1, len(dates), 15)  # Date columns
-
-    workbook.close()
-    output.seek(0)
-
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'traffic_report_{project.name}_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    )
+            worksheet.write(0, i + 1, date, header_format)
+
+        # Записываем средние значения
+        worksheet.write(1, 0, 'Среднее', header_format)
+        for i, date in enumerate(dates):
+            worksheet.write(1, i + 1, averages.get(date, 0))
+
+        # Записываем данные по URL
+        for row, (url, data) in enumerate(url_rows, 2):
+            worksheet.write(row, 0, url, url_format)
+            for i, date in enumerate(dates):
+                worksheet.write(row, i + 1, data.get(date, 0))
+
+    return xlsx_response(write_workbook, f'{file_name}.xlsx')
@@ -40,6 +40,8 @@ class Project(db.Model):
     keywords = db.relationship('Keyword', backref='project', lazy='dynamic', cascade='all, delete-orphan')
     urls = db.relationship('URL', backref='project', lazy='dynamic', cascade='all, delete-orphan')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Увеличивается при каждой записи позиций/трафика проекта (инвалидация кэша отчетов)
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     def __repr__(self):
         return '<Project {}>'.format(self.name)
@@ -53,24 +55,44 @@ class Region(db.Model):
     def __repr__(self):
         return '<Region {}>'.format(self.name)
 
+def _default_region_id():
+    # Импорт внутри функции: app.regions сам обращается к моделям
+    from app.regions import default_region_id
+    return default_region_id()
+
 class Keyword(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'keyword', name='uq_keyword_project_id_keyword'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     keyword = db.Column(db.String(256))
     project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'))
-    region_id = db.Column(db.Integer, db.ForeignKey('region.id'))
+    region_id = db.Column(db.Integer, db.ForeignKey('region.id'), default=_default_region_id)
     url_id = db.Column(db.Integer, db.ForeignKey('url.id', ondelete='CASCADE'))  # Добавляем связь с URL
     positions = db.relationship('KeywordPosition', backref='keyword', lazy='dynamic', cascade='all, delete-orphan')
     url = db.relationship('URL', backref=db.backref('keyword_list', lazy='dynamic'))  # Исправляем backref
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_webmaster_update = db.Column(db.DateTime)
+    # Снимок последних позиций, поддерживается PositionWriter
+    current_position = db.Column(db.Float)
+    previous_position = db.Column(db.Float)
+    position_delta = db.Column(db.Float)
+    last_check_date = db.Column(db.DateTime)
     
     def __repr__(self):
         return '<Keyword {}>'.format(self.keyword)
 
 class KeywordPosition(db.Model):
+    __table_args__ = (
+        db.Index('ix_keyword_position_keyword_id_check_date', 'keyword_id', 'check_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     keyword_id = db.Column(db.Integer, db.ForeignKey('keyword.id'))
     position = db.Column(db.Integer)
+    # Регион, для которого получена позиция (регион ключевого слова на момент проверки)
+    region_id = db.Column(db.Integer, db.ForeignKey('region.id'))
     check_date = db.Column(db.DateTime, default=datetime.utcnow)
     data_date_start = db.Column(db.DateTime)
     data_date_end = db.Column(db.DateTime)
@@ -78,6 +100,19 @@ class KeywordPosition(db.Model):
     def __repr__(self):
         return '<Position {} for Keyword {}>'.format(self.position, self.keyword_id)
 
+class KeywordDailyPosition(db.Model):
+    """Подневная позиция ключевого слова из query-analytics, одна строка на регион и день"""
+    keyword_id = db.Column(db.Integer, db.ForeignKey('keyword.id', ondelete='CASCADE'), primary_key=True)
+    # ID региона (Region.id), 0 - данные без фильтра по региону
+    region_id = db.Column(db.Integer, primary_key=True, default=0, server_default='0')
+    date = db.Column(db.Date, primary_key=True)
+    position = db.Column(db.Float, nullable=False)
+    keyword = db.relationship('Keyword', backref=db.backref('daily_positions', lazy='dynamic',
+                                                            cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return '<DailyPosition {} for Keyword {} on {}>'.format(self.position, self.keyword_id, self.date)
+
 class URL(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String(500), nullable=False)
@@ -87,7 +122,61 @@ class URL(db.Model):
     traffic_data = db.relationship('URLTraffic', backref='url', lazy='dynamic', cascade='all, delete-orphan')
     
 class URLTraffic(db.Model):
+    __table_args__ = (
+        db.Index('ix_url_traffic_url_id_check_date', 'url_id', 'check_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     url_id = db.Column(db.Integer, db.ForeignKey('url.id', ondelete='CASCADE'))
     visits = db.Column(db.Integer)
     check_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RefreshJob(db.Model):
+    """Фоновая задача обновления данных проекта (очередь задач в базе данных)"""
+    __table_args__ = (
+        db.Index('ix_refresh_job_status_created_at', 'status', 'created_at'),
+        db.Index('ix_refresh_job_project_id_kind_status', 'project_id', 'kind', 'status'),
+        db.UniqueConstraint('active_key', name='uq_refresh_job_active_key'),
+        db.UniqueConstraint('running_project_id', name='uq_refresh_job_running_project_id'),
+    )
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False, default='positions')
+    status = db.Column(db.String(16), nullable=False, default=STATUS_QUEUED)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    error = db.Column(db.Text)
+    worker_id = db.Column(db.String(128))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Прогресс выполнения, обновляется вместе с heartbeat
+    total_items = db.Column(db.Integer)
+    processed_items = db.Column(db.Integer, nullable=False, default=0)
+    failed_items = db.Column(db.Integer, nullable=False, default=0)
+    # Блокировки в базе: поля заполнены, пока задача активна, и обнуляются по ее
+    # завершении. Уникальность не допускает двух активных задач одного вида
+    # по проекту (active_key) и двух одновременно выполняющихся задач проекта
+    active_key = db.Column(db.String(64))
+    running_project_id = db.Column(db.Integer)
+    project = db.relationship('Project', backref=db.backref('refresh_jobs', lazy='dynamic', cascade='all, delete-orphan'))
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    @staticmethod
+    def lock_key(project_id, kind):
+        """Значение active_key активной задачи проекта и вида"""
+        return f"{project_id}:{kind}"
+
+    def __repr__(self):
+        return '<RefreshJob {} {} for Project {}>'.format(self.kind, self.status, self.project_id)
@@ -0,0 +1,63 @@
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Справочник регионов почти не меняется (seed_regions.py), поэтому читается
+# один раз на процесс: {id: (code, name)} и {code: id}
+_regions: Optional[Dict[int, Tuple[int, str]]] = None
+_ids_by_code: Dict[int, int] = {}
+_lock = threading.Lock()
+
+def load_regions() -> Dict[int, Tuple[int, str]]:
+    """Перечитывает справочник регионов из базы (после seed_regions.py)"""
+    global _regions, _ids_by_code
+    from app.models import Region
+
+    rows = db.session.execute(select(Region.id, Region.code, Region.name)).fetchall()
+    with _lock:
+        _regions = {region_id: (code, name) for region_id, code, name in rows}
+        _ids_by_code = {code: region_id for region_id, code, name in rows if code is not None}
+    logger.info(f"Загружен справочник регионов: {len(rows)}")
+    return _regions
+
+def get_regions() -> Dict[int, Tuple[int, str]]:
+    """Справочник регионов {id: (код Яндекса, название)}"""
+    regions = _regions
+    if regions is None:
+        regions = load_regions()
+    return regions
+
+def region_id_by_code(code: int) -> Optional[int]:
+    """ID региона по коду Яндекса или None, если такого региона нет"""
+    get_regions()
+    return _ids_by_code.get(code)
+
+def region_code(region_id: Optional[int]) -> Optional[int]:
+    """Код Яндекса региона по ID"""
+    region = get_regions().get(region_id)
+    return region[0] if region else None
+
+def region_name(region_id: Optional[int]) -> Optional[str]:
+    region = get_regions().get(region_id)
+    return region[1] if region else None
+
+def default_region_id() -> Optional[int]:
+    """ID региона по умолчанию (DEFAULT_REGION_CODE, Москва) для новых ключевых слов"""
+    return region_id_by_code(current_app.config.get('DEFAULT_REGION_CODE', 213))
+
+def init_app(app) -> None:
+    """Загружает справочник регионов при старте; до миграции базы - при первом обращении"""
+    with app.app_context():
+        try:
+            load_regions()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.warning(f"Справочник регионов не загружен при старте: {e}")
+        finally:
+            db.session.remove()
@@ -0,0 +1,9 @@
+from .positions import (
+    build_positions_report,
+    position_distribution,
+    position_bucket_condition,
+    positions_page,
+    daily_positions_series,
+    POSITION_BUCKETS,
+)
+from .traffic import build_traffic_report, load_traffic_frame, traffic_pivot
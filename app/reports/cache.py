@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from flask import current_app
+from sqlalchemy import select, update
+from app import db
+from app.models import Project
+
+logger = logging.getLogger(__name__)
+
+def bump_data_version(project_ids, session=None) -> None:
+    """
+    Увеличивает счетчик версии данных проектов
+
+    Вызывается писателями позиций и трафика в той же транзакции, что и запись
+    данных: отчеты, закэшированные под прежней версией, перестают находиться.
+
+    Args:
+        project_ids: ID проекта, список ID или подзапрос select(...project_id)
+    """
+    session = session if session is not None else db.session
+    if isinstance(project_ids, int):
+        project_ids = [project_ids]
+    session.execute(
+        update(Project.__table__)
+        .where(Project.__table__.c.id.in_(project_ids))
+        .values(data_version=Project.__table__.c.data_version + 1)
+    )
+
+def data_version(project_id: int) -> int:
+    """Текущая версия данных проекта"""
+    return db.session.execute(select(Project.data_version).where(Project.id == project_id)).scalar() or 0
+
+def report_key(name: str, project_id: int, version: int, params: dict) -> str:
+    """Ключ отчета: имя, проект, версия данных и параметры фильтров"""
+    payload = json.dumps([name, project_id, version, params], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class MemoryReportCache:
+    """LRU-кэш отчетов в памяти процесса"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SQLiteReportCache:
+    """
+    Кэш отчетов в файле SQLite
+
+    Общий для всех процессов веб-приложения с одним путем к файлу и
+    переживает перезапуск. Значения сериализуются pickle.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connection(self) -> sqlite3.Connection:
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(self.path)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS report_cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)'
+            )
+            connections[self.path] = connection
+        return connection
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM report_cache WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения кэша отчетов: {e}")
+            return None
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO report_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                    (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at)
+                )
+                connection.execute('DELETE FROM report_cache WHERE expires_at <= ?', (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка записи кэша отчетов: {e}")
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_report_cache():
+    """
+    Кэш отчетов по настройке REPORT_CACHE_BACKEND: 'memory', 'sqlite' или 'none'
+
+    Returns:
+        Объект с методами get/set или None, если кэш отключен
+    """
+    backend = current_app.config.get('REPORT_CACHE_BACKEND', 'memory')
+    if backend == 'none':
+        return None
+    with _caches_lock:
+        cache = _caches.get(backend)
+        if cache is None:
+            if backend == 'sqlite':
+                path = current_app.config['REPORT_CACHE_PATH']
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                cache = SQLiteReportCache(path)
+            elif backend == 'memory':
+                cache = MemoryReportCache(current_app.config.get('REPORT_CACHE_MAX_ENTRIES', 256))
+            else:
+                raise ValueError(f"Неизвестный REPORT_CACHE_BACKEND: {backend}")
+            _caches[backend] = cache
+        return cache
+
+def cached_report(name: str, project_id: int, builder: Callable[[], Any], **params) -> Any:
+    """
+    Отчет из кэша или результат builder(), сохраненный до следующего изменения данных
+
+    Ключ включает версию данных проекта, поэтому новая запись позиций или
+    трафика (bump_data_version) делает отчет недействительным без явной очистки.
+
+    Args:
+        name: Имя отчета
+        project_id: ID проекта
+        builder: Функция без аргументов, строящая отчет
+        params: Параметры фильтров, влияющие на результат
+    """
+    cache = get_report_cache()
+    if cache is None:
+        return builder()
+
+    key = report_key(name, project_id, data_version(project_id), params)
+    report = cache.get(key)
+    if report is None:
+        started = time.monotonic()
+        report = builder()
+        cache.set(key, report, time.time() + current_app.config.get('REPORT_CACHE_TTL', 86400))
+        logger.info(f"Отчет {name} проекта {project_id} построен за {time.monotonic() - started:.2f} с")
+    return report
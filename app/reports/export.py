@@ -0,0 +1,137 @@
+import io
+import os
+import csv
+import zlib
+import logging
+import tempfile
+from urllib.parse import quote
+from typing import Callable, Iterable, List, Iterator, Tuple, Dict, Optional
+import xlsxwriter
+from flask import send_file, Response, stream_with_context
+from sqlalchemy import func
+from app import db
+from app.models import URL, URLTraffic
+
+logger = logging.getLogger(__name__)
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_YIELD_PER = 5000
+CSV_FLUSH_BYTES = 64 * 1024
+
+def xlsx_response(write_workbook: Callable, download_name: str) -> Response:
+    """
+    Формирует XLSX во временном файле и отдает его потоком
+
+    xlsxwriter работает в режиме constant_memory: строки сбрасываются на диск
+    по мере записи, поэтому write_workbook должен писать строки по порядку.
+    Временный файл удаляется после отправки ответа.
+    """
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        write_workbook(workbook)
+        workbook.close()
+    except Exception:
+        os.remove(path)
+        raise
+
+    response = send_file(path, mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=download_name)
+
+    def remove_file():
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить временный файл экспорта {path}: {e}")
+
+    response.call_on_close(remove_file)
+    return response
+
+def csv_gzip_response(header: List[str], rows: Iterable[Iterable], download_name: str) -> Response:
+    """Отдает CSV, сжатый gzip, потоком по мере чтения строк из базы"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        compressor = zlib.compressobj(wbits=31)  # 31 - формат gzip
+
+        # BOM, чтобы Excel открывал UTF-8 без перекодировки
+        buffer.write('\ufeff')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= CSV_FLUSH_BYTES:
+                chunk = compressor.compress(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+                if chunk:
+                    yield chunk
+
+        yield compressor.compress(buffer.getvalue().encode('utf-8')) + compressor.flush()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/gzip',
+        headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(download_name)}"}
+    )
+
+def _format_day(value) -> str:
+    if isinstance(value, str):
+        return value[:10]
+    return value.strftime('%Y-%m-%d')
+
+def traffic_header(project_id: int) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Даты и средний трафик по датам для выгрузки (агрегаты в SQL)
+
+    Returns:
+        (даты, {дата: средний трафик})
+    """
+    day = func.date(URLTraffic.check_date)
+    base = db.session.query(URLTraffic).join(URL).filter(URL.project_id == project_id)
+
+    dates = [_format_day(value) for (value,) in
+             base.with_entities(day).distinct().order_by(day)]
+    averages = {_format_day(value): int(round(avg or 0)) for value, avg in
+                base.with_entities(day, func.avg(URLTraffic.visits)).group_by(day)}
+    return dates, averages
+
+def traffic_matrix(project_id: int, header: Optional[Tuple[List[str], Dict[str, int]]] = None
+                   ) -> Tuple[List[str], Dict[str, int], Iterator[Tuple[str, Dict[str, int]]]]:
+    """
+    Данные отчета по трафику для потоковой выгрузки
+
+    Args:
+        header: Готовый результат traffic_header (например, из кэша отчетов)
+
+    Returns:
+        (даты, {дата: средний трафик}, итератор (url, {дата: визиты}))
+        URL идут по убыванию максимального трафика, строки читаются порциями.
+    """
+    dates, averages = header if header is not None else traffic_header(project_id)
+    base = db.session.query(URLTraffic).join(URL).filter(URL.project_id == project_id)
+
+    ranking = (base.with_entities(URLTraffic.url_id.label('url_id'),
+                                  func.max(URLTraffic.visits).label('max_visits'))
+               .group_by(URLTraffic.url_id)
+               .subquery())
+
+    records = (db.session.query(URL.id, URL.url, URLTraffic.check_date, URLTraffic.visits)
+               .join(URLTraffic, URLTraffic.url_id == URL.id)
+               .join(ranking, ranking.c.url_id == URL.id)
+               .order_by(ranking.c.max_visits.desc(), URL.id, URLTraffic.check_date)
+               .yield_per(EXPORT_YIELD_PER))
+
+    def rows():
+        current_id = None
+        current_url = None
+        values = {}
+        for url_id, url, check_date, visits in records:
+            if url_id != current_id:
+                if current_id is not None:
+                    yield current_url, values
+                current_id, current_url, values = url_id, url, {}
+            values[_format_day(check_date)] = visits
+        if current_id is not None:
+            yield current_url, values
+
+    return dates, averages, rows()
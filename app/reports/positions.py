@@ -0,0 +1,361 @@
+import json
+import base64
+import logging
+from typing import Dict, Any, Optional
+from sqlalchemy import select, func, case, and_, or_
+from app import db
+from app.models import Keyword, KeywordPosition, KeywordDailyPosition
+
+logger = logging.getLogger(__name__)
+
+TOP_CHANGES_LIMIT = 5
+
+# Диапазоны позиций [от, до) в порядке проверки: позиция попадает в первый подходящий
+POSITION_BUCKETS = [
+    ('top1', 1.0, 2.0),
+    ('top3', 1.0, 4.0),
+    ('top5', 1.0, 6.0),
+    ('top10', 1.0, 11.0),
+    ('top100plus', 100.0, None),
+]
+# export_positions исторически называет последний диапазон top100
+BUCKET_ALIASES = {'top100': 'top100plus'}
+
+# Гранулярность агрегации подневных позиций при чтении
+GRANULARITIES = ('day', 'week', 'month')
+
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 1000
+# Значение для сортировки ключевых слов без позиции (в конце при сортировке по возрастанию)
+MISSING_POSITION_SORT_VALUE = 100000.0
+
+def position_bucket_condition(column, name: str):
+    """Условие SQL для диапазона позиций по имени (top1/top3/top5/top10/top100plus)"""
+    name = BUCKET_ALIASES.get(name, name)
+    for bucket, low, high in POSITION_BUCKETS:
+        if bucket == name:
+            condition = column >= low
+            if high is not None:
+                condition = and_(condition, column < high)
+            return condition
+    raise ValueError(f"Неизвестный диапазон позиций: {name}")
+
+def _format_date(value):
+    """Приводит дату из результата запроса к строке YYYY-MM-DD"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value[:10]
+    return value.strftime('%Y-%m-%d')
+
+def daily_positions_subquery(project_id):
+    """
+    Подзапрос с одной позицией на ключевое слово и день
+
+    Для каждого дня берется последняя проверка, prev_position - позиция из
+    предыдущего дня с данными (LAG), recency - номер дня с конца (1 - последний).
+    """
+    day = func.date(KeywordPosition.check_date)
+    ranked = (
+        select(
+            KeywordPosition.keyword_id,
+            day.label('day'),
+            KeywordPosition.position,
+            KeywordPosition.check_date,
+            KeywordPosition.data_date_start,
+            KeywordPosition.data_date_end,
+            func.row_number().over(
+                partition_by=(KeywordPosition.keyword_id, day),
+                order_by=KeywordPosition.check_date.desc()
+            ).label('rn')
+        )
+        .join(Keyword, Keyword.id == KeywordPosition.keyword_id)
+        .where(Keyword.project_id == project_id)
+        .subquery()
+    )
+    return (
+        select(
+            ranked.c.keyword_id,
+            ranked.c.day,
+            ranked.c.position,
+            ranked.c.check_date,
+            ranked.c.data_date_start,
+            ranked.c.data_date_end,
+            func.lag(ranked.c.position).over(
+                partition_by=ranked.c.keyword_id,
+                order_by=ranked.c.day
+            ).label('prev_position'),
+            func.row_number().over(
+                partition_by=ranked.c.keyword_id,
+                order_by=ranked.c.day.desc()
+            ).label('recency')
+        )
+        .where(ranked.c.rn == 1)
+        .subquery()
+    )
+
+def build_positions_report(project_id: int) -> Dict[str, Any]:
+    """
+    Собирает сводные данные для шаблона main/positions_report.html
+
+    Дедупликация по дням, изменения (LAG), средние по датам и топы изменений
+    считаются в SQL; в Python остается только раскладка результата по словарям.
+    Таблица позиций в отчет не входит: она постранично читается через positions_page.
+    """
+    daily = daily_positions_subquery(project_id)
+    both_positive = and_(daily.c.position > 0, daily.c.prev_position > 0)
+    change = daily.c.prev_position - daily.c.position
+
+    # Средние позиции и среднее изменение по датам
+    avg_positions = []
+    averages = db.session.execute(
+        select(
+            daily.c.day,
+            func.avg(daily.c.position),
+            func.sum(case((both_positive, change), else_=0)),
+            func.count()
+        )
+        .where(daily.c.position > 0)
+        .group_by(daily.c.day)
+        .order_by(daily.c.day)
+    )
+    for day, avg, total_change, count in averages:
+        avg_positions.append({
+            'x': _format_date(day),
+            'y': round(float(avg), 1),
+            'change': round(float(total_change or 0) / count, 1) if count else 0
+        })
+
+    # Сводка изменений по последней проверке каждого ключевого слова
+    latest = daily.c.recency == 1
+    summary = db.session.execute(
+        select(
+            func.count(),
+            func.sum(case((and_(both_positive, change > 0), 1), else_=0)),
+            func.sum(case((and_(both_positive, change < 0), 1), else_=0)),
+            func.sum(case((and_(both_positive, change == 0), 1), else_=0))
+        )
+        .where(latest)
+    ).one()
+    changes_data = {
+        'total_keywords': summary[0] or 0,
+        'improved': int(summary[1] or 0),
+        'worsened': int(summary[2] or 0),
+        'unchanged': int(summary[3] or 0)
+    }
+
+    def top_changes(condition, order):
+        rows = db.session.execute(
+            select(Keyword.keyword, daily.c.position, daily.c.prev_position)
+            .join(Keyword, Keyword.id == daily.c.keyword_id)
+            .where(latest, both_positive, condition)
+            .order_by(order)
+            .limit(TOP_CHANGES_LIMIT)
+        )
+        return [{
+            'keyword': keyword,
+            'current_position': position,
+            'previous_position': prev_position,
+            'change': abs(prev_position - position)
+        } for keyword, position, prev_position in rows]
+
+    return {
+        'avg_positions': avg_positions,
+        'changes_data': changes_data,
+        'biggest_improvements': top_changes(change > 0, change.desc()),
+        'biggest_drops': top_changes(change < 0, change.asc())
+    }
+
+def position_distribution(project_id: int, search: Optional[str] = None) -> Dict[str, int]:
+    """
+    Распределение ключевых слов проекта по диапазонам текущей позиции
+
+    Читает снимок Keyword.current_position, поэтому стоимость - O(ключевых слов).
+
+    Args:
+        project_id: ID проекта
+        search: Подстрока для фильтра по ключевому слову
+    """
+    conditions = [
+        (position_bucket_condition(Keyword.current_position, name), name)
+        for name, _, _ in POSITION_BUCKETS
+    ]
+    bucket = case(*conditions, else_=None).label('bucket')
+
+    query = select(bucket, func.count()).where(
+        Keyword.project_id == project_id,
+        Keyword.current_position.isnot(None)
+    )
+    if search:
+        query = query.where(Keyword.keyword.ilike(f'%{search}%'))
+
+    distribution = {name: 0 for name, _, _ in POSITION_BUCKETS}
+    rows = db.session.execute(query.group_by(bucket))
+    for name, count in rows:
+        if name is not None:
+            distribution[name] = count
+    return distribution
+
+def _encode_cursor(value, keyword_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, keyword_id]).encode()).decode()
+
+def _decode_cursor(cursor: str):
+    value, keyword_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    return value, int(keyword_id)
+
+def positions_page(project_id: int, search: Optional[str] = None, bucket: Optional[str] = None,
+                   sort: str = 'keyword', order: str = 'asc', cursor: Optional[str] = None,
+                   limit: int = PAGE_SIZE_DEFAULT) -> Dict[str, Any]:
+    """
+    Страница таблицы позиций с keyset-пагинацией по снимку позиций
+
+    Args:
+        project_id: ID проекта
+        search: Подстрока для фильтра по ключевому слову
+        bucket: Диапазон позиций (top1/top3/top5/top10/top100plus)
+        sort: Поле сортировки: keyword, position, change или date
+        order: asc или desc
+        cursor: Курсор next_cursor из предыдущей страницы
+        limit: Размер страницы (не больше PAGE_SIZE_MAX)
+
+    Returns:
+        {'items': [...], 'next_cursor': str | None, 'total': int}
+    """
+    sort_columns = {
+        'keyword': Keyword.keyword,
+        'position': func.coalesce(Keyword.current_position, MISSING_POSITION_SORT_VALUE),
+        'change': func.coalesce(Keyword.position_delta, 0.0),
+        'date': func.coalesce(Keyword.last_check_date, '1970-01-01 00:00:00'),
+    }
+    if sort not in sort_columns:
+        raise ValueError(f"Неизвестное поле сортировки: {sort}")
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Неизвестный порядок сортировки: {order}")
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+    sort_column = sort_columns[sort].label('sort_value')
+
+    filters = [Keyword.project_id == project_id]
+    if search:
+        filters.append(Keyword.keyword.ilike(f'%{search}%'))
+    if bucket:
+        filters.append(position_bucket_condition(Keyword.current_position, bucket))
+
+    total = db.session.execute(select(func.count()).select_from(Keyword).where(*filters)).scalar()
+
+    query = select(
+        Keyword.id,
+        Keyword.keyword,
+        Keyword.current_position,
+        Keyword.previous_position,
+        Keyword.position_delta,
+        Keyword.last_check_date,
+        sort_column
+    ).where(*filters)
+
+    if cursor:
+        value, last_id = _decode_cursor(cursor)
+        expression = sort_columns[sort]
+        if order == 'asc':
+            query = query.where(or_(expression > value, and_(expression == value, Keyword.id > last_id)))
+        else:
+            query = query.where(or_(expression < value, and_(expression == value, Keyword.id < last_id)))
+
+    if order == 'asc':
+        query = query.order_by(sort_columns[sort].asc(), Keyword.id.asc())
+    else:
+        query = query.order_by(sort_columns[sort].desc(), Keyword.id.desc())
+
+    rows = db.session.execute(query.limit(limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [{
+        'id': row.id,
+        'keyword': row.keyword,
+        'position': row.current_position,
+        'previous_position': row.previous_position,
+        'change': row.position_delta,
+        'date': _format_date(row.last_check_date)
+    } for row in rows]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        sort_value = last.sort_value
+        if not isinstance(sort_value, (str, int, float)):
+            sort_value = str(sort_value)
+        next_cursor = _encode_cursor(sort_value, last.id)
+
+    return {'items': items, 'next_cursor': next_cursor, 'total': total}
+
+def _period_start(column, granularity: str):
+    """Выражение SQL: начало периода (день, неделя с понедельника, месяц) для даты"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+    if granularity == 'day':
+        return column
+
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        if granularity == 'week':
+            return func.date(column, 'weekday 0', '-6 days')
+        return func.date(column, 'start of month')
+    if dialect in ('mysql', 'mariadb'):
+        if granularity == 'week':
+            return func.subdate(column, func.weekday(column))
+        return func.date_format(column, '%Y-%m-01')
+    return func.date_trunc(granularity, column)
+
+def daily_positions_series(project_id: int, granularity: str = 'week', date_from=None, date_to=None,
+                           keyword_ids=None) -> Dict[str, Any]:
+    """
+    Позиции ключевых слов проекта из подневного хранилища, агрегированные при чтении
+
+    Args:
+        project_id: ID проекта
+        granularity: day, week или month
+        date_from: Первый день (включительно)
+        date_to: Последний день (включительно)
+        keyword_ids: Ограничить набором ключевых слов
+
+    Returns:
+        {'periods': [дата начала периода, ...],
+         'keywords': {ключевое слово: {период: средняя позиция}},
+         'average': [{'x': период, 'y': средняя позиция}]}
+    """
+    period = _period_start(KeywordDailyPosition.date, granularity).label('period')
+    # Данные берутся для текущего региона ключевого слова
+    filters = [Keyword.project_id == project_id,
+               KeywordDailyPosition.region_id == func.coalesce(Keyword.region_id, 0)]
+    if date_from:
+        filters.append(KeywordDailyPosition.date >= date_from)
+    if date_to:
+        filters.append(KeywordDailyPosition.date <= date_to)
+    if keyword_ids:
+        filters.append(KeywordDailyPosition.keyword_id.in_(keyword_ids))
+
+    rows = db.session.execute(
+        select(Keyword.keyword, period, func.avg(KeywordDailyPosition.position))
+        .join(Keyword, Keyword.id == KeywordDailyPosition.keyword_id)
+        .where(*filters)
+        .group_by(Keyword.id, Keyword.keyword, period)
+    )
+    periods = set()
+    keywords = {}
+    for keyword, value, avg in rows:
+        date = _format_date(value)
+        periods.add(date)
+        keywords.setdefault(keyword, {})[date] = round(float(avg), 1)
+
+    averages = db.session.execute(
+        select(period, func.avg(KeywordDailyPosition.position))
+        .join(Keyword, Keyword.id == KeywordDailyPosition.keyword_id)
+        .where(*filters)
+        .group_by(period)
+        .order_by(period)
+    )
+    return {
+        'periods': sorted(periods),
+        'keywords': keywords,
+        'average': [{'x': _format_date(value), 'y': round(float(avg), 1)} for value, avg in averages]
+    }
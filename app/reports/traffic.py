@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from app import db
+from app.models import URL, URLTraffic
+
+logger = logging.getLogger(__name__)
+
+TOP_CHANGES_LIMIT = 5
+
+def load_traffic_frame(project_id: int, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       url_filter: Optional[str] = None) -> pd.DataFrame:
+    """
+    Загружает трафик проекта одним запросом по колонкам
+
+    Args:
+        date_from, date_to: Границы check_date в формате YYYY-MM-DD
+        url_filter: Шаблон URL, * - любая подстрока
+
+    Returns:
+        DataFrame (url_id, check_date, visits), упорядоченный по check_date
+    """
+    query = (
+        select(URLTraffic.url_id, URLTraffic.check_date, URLTraffic.visits)
+        .join(URL, URL.id == URLTraffic.url_id)
+        .where(URL.project_id == project_id)
+        .order_by(URLTraffic.check_date)
+    )
+    if date_from:
+        query = query.where(URLTraffic.check_date >= datetime.strptime(date_from, '%Y-%m-%d'))
+    if date_to:
+        query = query.where(URLTraffic.check_date <= datetime.strptime(date_to, '%Y-%m-%d'))
+    if url_filter:
+        query = query.where(URL.url.like(url_filter.replace('*', '%')))
+
+    return pd.DataFrame(db.session.execute(query).all(), columns=['url_id', 'check_date', 'visits'])
+
+def traffic_pivot(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Матрица визитов URL x день
+
+    На день берется последняя запись URL; строки идут в порядке первого
+    появления URL в данных, столбцы - дни по возрастанию, пропуски - NaN.
+    """
+    frame = frame.dropna(subset=['visits']).copy()
+    frame['day'] = pd.to_datetime(frame['check_date']).dt.normalize()
+    frame = frame.drop_duplicates(['url_id', 'day'], keep='last')
+    matrix = frame.pivot(index='url_id', columns='day', values='visits')
+    return matrix.reindex(index=pd.unique(frame['url_id']))
+
+def build_traffic_report(project_id: int, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                         min_traffic: Optional[int] = None, url_filter: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Собирает данные для шаблона main/traffic_report.html
+
+    Средние по датам, изменения за последние два дня с данными, топы изменений
+    и фильтр min_traffic считаются над матрицей NumPy; в Python остается только
+    раскладка строк для шаблона.
+    """
+    matrix = traffic_pivot(load_traffic_frame(project_id, date_from, date_to, url_filter))
+    dates = [day.strftime('%Y-%m-%d') for day in matrix.columns]
+    if matrix.empty:
+        return {'traffic_data': [], 'dates': dates, 'averages': [],
+                'biggest_increases': [], 'biggest_drops': []}
+
+    url_names = dict(db.session.execute(
+        select(URL.id, URL.url).where(URL.project_id == project_id)
+    ).fetchall())
+    urls = [url_names.get(url_id) for url_id in matrix.index]
+
+    values = matrix.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0).astype(np.int64)
+
+    # Среднее по дате - по URL, у которых есть данные за эту дату
+    counts = present.sum(axis=0)
+    sums = filled.sum(axis=0)
+    averages = np.round(np.divide(sums, counts, out=np.zeros(len(dates)), where=counts > 0)).astype(int).tolist()
+
+    # Изменение URL между двумя его последними датами с данными
+    columns = np.arange(len(dates))
+    last = np.where(present, columns, -1).max(axis=1)
+    previous = np.where(present & (columns < last[:, None]), columns, -1).max(axis=1)
+    rows = np.flatnonzero(previous >= 0)
+    current_traffic = filled[rows, last[rows]]
+    previous_traffic = filled[rows, previous[rows]]
+    change = current_traffic - previous_traffic
+
+    def top_changes(order) -> List[Dict[str, Any]]:
+        return [{
+            'url': urls[rows[i]],
+            'current_traffic': int(current_traffic[i]),
+            'previous_traffic': int(previous_traffic[i]),
+            'change': int(change[i])
+        } for i in order[:TOP_CHANGES_LIMIT]]
+
+    # Таблица: изменение показывается только для последней даты отчета
+    if len(dates) > 1:
+        last_change = filled[:, -1] - filled[:, -2]
+    else:
+        last_change = np.zeros(len(urls), dtype=np.int64)
+    max_traffic = filled.max(axis=1)
+    selected = np.arange(len(urls)) if min_traffic is None else np.flatnonzero(max_traffic >= min_traffic)
+    selected = selected[np.argsort(-max_traffic[selected], kind='stable')]
+
+    traffic_data = []
+    for index in selected:
+        cells = [{'value': value, 'change': 0, 'change_value': ''} for value in filled[index].tolist()]
+        delta = int(last_change[index])
+        if delta and len(dates) > 1:
+            cells[-1] = {'value': cells[-1]['value'], 'change': delta, 'change_value': str(abs(delta))}
+        traffic_data.append({'url': urls[index], 'traffic': cells})
+
+    return {
+        'traffic_data': traffic_data,
+        'dates': dates,
+        'averages': averages,
+        'biggest_increases': top_changes(np.argsort(-change, kind='stable')),
+        'biggest_drops': top_changes(np.argsort(change, kind='stable'))
+    }
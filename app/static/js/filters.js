@@ -3,113 +3,153 @@ document.addEventListener('DOMContentLoaded', function() {
         keyword: '',
         position: ''
     };
+    // Сортировка таблицы (поля positions_page: keyword, position, change, date)
+    let activeSort = {
+        sort: 'keyword',
+        order: 'asc'
+    };
 
-    // Функция для подсчета распределения позиций
-    function updatePositionDistribution() {
-        const rows = document.querySelectorAll('tbody tr:not(.bg-blue-50)');
-        let distribution = {
-            top1: 0,
-            top3: 0,
-            top5: 0,
-            top10: 0,
-            top100plus: 0
-        };
-
-        rows.forEach(row => {
-            if (row.style.display !== 'none') {
-                // Получаем первую позицию (самая новая дата)
-                const cells = Array.from(row.querySelectorAll('td'));
-                const firstPositionCell = cells[1]; // Первая ячейка после ключевого слова
-                const positionText = firstPositionCell.textContent.trim().split(' ')[0]; // Берем только число, без стрелочки
-                const position = parseFloat(positionText);
-
-                if (!isNaN(position)) {
-                    if (position >= 1.0 && position < 2.0) distribution.top1++;
-                    else if (position >= 1.0 && position < 4.0) distribution.top3++;
-                    else if (position >= 1.0 && position < 6.0) distribution.top5++;
-                    else if (position >= 1.0 && position < 11.0) distribution.top10++;
-                    else if (position >= 100.0) distribution.top100plus++;
-                }
-            }
+    const table = document.getElementById('positionsTable');
+    const tbody = table.querySelector('tbody');
+    const loadMoreBtn = document.getElementById('loadMore');
+    // Курсор следующей страницы; первая страница отрендерена на сервере
+    let nextCursor = table.dataset.nextCursor || null;
+    let loading = false;
+    // Номер запроса: ответы устаревших запросов (после смены фильтров) отбрасываются
+    let requestId = 0;
+
+    // Формирует URL JSON API таблицы позиций с текущими фильтрами и сортировкой
+    function buildDataUrl(extra) {
+        const params = new URLSearchParams();
+        if (activeFilters.keyword) params.set('keyword', activeFilters.keyword);
+        if (activeFilters.position) params.set('position', activeFilters.position);
+        params.set('sort', activeSort.sort);
+        params.set('order', activeSort.order);
+        Object.entries(extra || {}).forEach(([key, value]) => params.set(key, value));
+        return `/project/${projectId}/positions/data?${params.toString()}`;
+    }
+
+    function fetchPage(extra) {
+        return fetch(buildDataUrl(extra)).then(response => {
+            if (!response.ok) throw new Error('Network response was not ok');
+            return response.json();
         });
+    }
 
-        // Обновляем отображение распределения
-        document.querySelector('[data-distribution="top1"]').textContent = distribution.top1;
-        document.querySelector('[data-distribution="top3"]').textContent = distribution.top3;
-        document.querySelector('[data-distribution="top5"]').textContent = distribution.top5;
-        document.querySelector('[data-distribution="top10"]').textContent = distribution.top10;
-        document.querySelector('[data-distribution="top100plus"]').textContent = distribution.top100plus;
+    // Обновляет распределение по позициям (считается на сервере в SQL)
+    function updatePositionDistribution(distribution) {
+        Object.entries(distribution).forEach(([bucket, count]) => {
+            const element = document.querySelector(`[data-distribution="${bucket}"]`);
+            if (element) element.textContent = count;
+        });
     }
 
-    // Функция фильтрации
-    function filterTable() {
-        console.log('Активные фильтры:', activeFilters);
-
-        const rows = document.querySelectorAll('tbody tr:not(.bg-blue-50)'); // Исключаем строку со средними значениями
-
-        rows.forEach((row, rowIndex) => {
-            let show = true;
-            const keyword = row.querySelector('td:first-child').textContent.toLowerCase();
-            const cells = Array.from(row.querySelectorAll('td'));
-            
-            // Получаем значение первой позиции (самая новая дата)
-            const firstPositionCell = cells[1]; // Первая ячейка после ключевого слова
-            const positionText = firstPositionCell.textContent.trim().split(' ')[0]; // Берем только число, без стрелочки
-            const position = parseFloat(positionText);
-            
-            console.log(`Строка ${rowIndex}:`, {
-                keyword,
-                position,
-                cellsCount: cells.length
-            });
+    function formatPosition(value) {
+        return value === null || value === undefined ? '-' : value.toFixed(1);
+    }
 
-            // Фильтр по поиску ключевого слова (частичное совпадение)
-            if (activeFilters.keyword && !keyword.includes(activeFilters.keyword.toLowerCase())) {
-                show = false;
-                console.log(`Строка ${rowIndex}: не прошла фильтр по ключевому слову`);
-            }
+    function createCell(content, className) {
+        const cell = document.createElement('td');
+        cell.className = `px-6 py-4 whitespace-nowrap text-sm ${className || 'text-gray-500'}`;
+        if (content instanceof Node) {
+            cell.appendChild(content);
+        } else {
+            cell.textContent = content;
+        }
+        return cell;
+    }
 
-            // Фильтр по позициям
-            if (show && activeFilters.position && !isNaN(position)) {
-                let showByPosition = false;
-                
-                switch (activeFilters.position) {
-                    case 'top1':
-                        showByPosition = position >= 1.0 && position < 2.0;
-                        break;
-                    case 'top3':
-                        showByPosition = position >= 1.0 && position < 4.0;
-                        break;
-                    case 'top5':
-                        showByPosition = position >= 1.0 && position < 6.0;
-                        break;
-                    case 'top10':
-                        showByPosition = position >= 1.0 && position < 11.0;
-                        break;
-                    case 'top100plus':
-                        showByPosition = position >= 100.0;
-                        break;
-                    default:
-                        showByPosition = true;
-                }
-                
-                console.log(`Строка ${rowIndex}: позиция ${position}, фильтр ${activeFilters.position}, результат: ${showByPosition}`);
-                show = showByPosition;
-            }
+    function createRow(item) {
+        const row = document.createElement('tr');
+        row.appendChild(createCell(item.keyword, 'font-medium text-gray-900'));
+        row.appendChild(createCell(formatPosition(item.position)));
+        row.appendChild(createCell(formatPosition(item.previous_position)));
+
+        let change = '-';
+        if (item.change) {
+            change = document.createElement('small');
+            change.className = item.change > 0 ? 'text-success' : 'text-danger';
+            change.textContent = `${item.change > 0 ? '↑' : '↓'}${Math.abs(item.change).toFixed(1)}`;
+        }
+        row.appendChild(createCell(change));
+        row.appendChild(createCell(item.date || '-'));
+        return row;
+    }
 
-            row.style.display = show ? '' : 'none';
-            console.log(`Строка ${rowIndex}: итоговое отображение = ${show}`);
-        });
+    // Добавляет страницу в таблицу и запоминает курсор следующей
+    function appendPage(data) {
+        const fragment = document.createDocumentFragment();
+        data.items.forEach(item => fragment.appendChild(createRow(item)));
+        tbody.appendChild(fragment);
+
+        nextCursor = data.next_cursor;
+        loadMoreBtn.classList.toggle('hidden', !nextCursor);
+        document.getElementById('positionsShown').textContent = tbody.rows.length;
+        document.getElementById('positionsTotal').textContent = data.total;
+    }
 
-        // Обновляем распределение после фильтрации
-        updatePositionDistribution();
+    // Загружает следующую страницу по keyset-курсору
+    function loadNextPage() {
+        if (loading || !nextCursor) return;
+        loading = true;
+        const current = requestId;
+        fetchPage({cursor: nextCursor})
+            .then(data => {
+                if (current === requestId) appendPage(data);
+            })
+            .catch(error => console.error('Error:', error))
+            .finally(() => { loading = false; });
     }
 
+    // Перезагружает таблицу с первой страницы после смены фильтров или сортировки
+    function reloadTable() {
+        const current = ++requestId;
+        loading = true;
+        fetchPage()
+            .then(data => {
+                if (current !== requestId) return;
+                tbody.innerHTML = '';
+                appendPage(data);
+                updatePositionDistribution(data.distribution);
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                alert('Ошибка при фильтрации данных');
+            })
+            .finally(() => {
+                if (current === requestId) loading = false;
+            });
+    }
+
+    loadMoreBtn.addEventListener('click', loadNextPage);
+
+    // Бесконечная прокрутка: следующая страница подгружается у конца таблицы
+    if ('IntersectionObserver' in window) {
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+        }, {rootMargin: '200px'});
+        observer.observe(document.getElementById('positionsSentinel'));
+    }
+
+    // Сортировка по клику на заголовок: повторный клик меняет направление
+    table.querySelectorAll('th[data-sort]').forEach(header => {
+        header.addEventListener('click', function() {
+            const sort = this.dataset.sort;
+            if (activeSort.sort === sort) {
+                activeSort.order = activeSort.order === 'asc' ? 'desc' : 'asc';
+            } else {
+                activeSort.sort = sort;
+                activeSort.order = 'asc';
+            }
+            reloadTable();
+        });
+    });
+
     // Обработчик применения фильтров
     document.getElementById('applyFilters').addEventListener('click', function() {
         activeFilters.keyword = document.getElementById('keywordSearch').value;
         activeFilters.position = document.getElementById('positionFilter').value;
-        filterTable();
+        reloadTable();
     });
 
     // Обработчик сброса фильтров
@@ -118,45 +158,45 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('positionFilter').value = '';
         activeFilters.keyword = '';
         activeFilters.position = '';
-        filterTable();
+        reloadTable();
     });
 
-    // Инициализация распределения при загрузке страницы
-    updatePositionDistribution();
-
     // Обработчик обновления данных
-    document.getElementById('refreshBtn').addEventListener('click', function() {
-        const spinner = document.getElementById('refreshSpinner');
-        spinner.classList.remove('hidden');
-        this.disabled = true;
-
-        fetch(`/project/${projectId}/positions/refresh`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
-            }
-        })
-        .then(response => {
-            if (!response.ok) throw new Error('Network response was not ok');
-            return response.json();
-        })
-        .then(data => {
-            if (data.status === 'success') {
-                location.reload();
-            } else {
+    const refreshBtn = document.getElementById('refreshBtn');
+    if (refreshBtn) {
+        refreshBtn.addEventListener('click', function() {
+            const spinner = document.getElementById('refreshSpinner');
+            spinner.classList.remove('hidden');
+            this.disabled = true;
+
+            fetch(`/project/${projectId}/positions/refresh`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': csrfToken
+                }
+            })
+            .then(response => {
+                if (!response.ok) throw new Error('Network response was not ok');
+                return response.json();
+            })
+            .then(data => {
+                if (data.status === 'success') {
+                    location.reload();
+                } else {
+                    alert('Ошибка при обновлении данных');
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
                 alert('Ошибка при обновлении данных');
-            }
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            alert('Ошибка при обновлении данных');
-        })
-        .finally(() => {
-            spinner.classList.add('hidden');
-            this.disabled = false;
+            })
+            .finally(() => {
+                spinner.classList.add('hidden');
+                this.disabled = false;
+            });
         });
-    });
+    }
 
     // Обработчик экспорта в Excel
     document.getElementById('exportBtn').addEventListener('click', function() {
@@ -0,0 +1,296 @@
+import os
+import time
+import socket
+import signal
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import RefreshJob
+from app.tasks.progress import ProgressTracker, job_progress, publish
+from app.utils.backoff import RetryBudget, use_retry_budget
+from app.yandex.cache import get_response_cache
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    """Задача остановлена по запросу пользователя"""
+
+def _handlers():
+    """Обработчики задач по виду: kind -> callable(project_id, job=JobContext)"""
+    from app.tasks.update_positions import update_project_positions
+    from app.tasks.update_traffic import update_project_traffic
+    return {
+        'positions': update_project_positions,
+        'traffic': update_project_traffic,
+    }
+
+def enqueue_job(project_id, kind='positions'):
+    """
+    Ставит задачу в очередь, если для проекта нет активной задачи того же вида
+
+    Проверку гарантирует уникальный RefreshJob.active_key: если задачу того же
+    вида параллельно поставил другой запрос или планировщик, INSERT отклоняется
+    и возвращается уже активная задача.
+
+    Returns:
+        (RefreshJob, created): существующая активная задача и False,
+        либо новая задача и True
+    """
+    active = (RefreshJob.query
+              .filter(RefreshJob.project_id == project_id,
+                      RefreshJob.kind == kind,
+                      RefreshJob.status.in_(RefreshJob.ACTIVE_STATUSES))
+              .order_by(RefreshJob.id)
+              .first())
+    if active:
+        logger.info(f"Задача {kind} для проекта {project_id} уже в очереди: {active.id} ({active.status})")
+        return active, False
+
+    job = RefreshJob(project_id=project_id, kind=kind, active_key=RefreshJob.lock_key(project_id, kind))
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        active = get_active_job(project_id, kind)
+        if active is None:
+            raise
+        logger.info(f"Задача {kind} для проекта {project_id} поставлена параллельно: {active.id} ({active.status})")
+        return active, False
+    logger.info(f"Задача {job.id} ({kind}) для проекта {project_id} поставлена в очередь")
+    return job, True
+
+def request_cancel(job_id):
+    """Запрашивает остановку задачи. Задача в очереди отменяется сразу."""
+    job = db.session.get(RefreshJob, job_id)
+    if not job or not job.is_active:
+        return False
+
+    if job.status == RefreshJob.STATUS_QUEUED:
+        job.status = RefreshJob.STATUS_CANCELLED
+        job.finished_at = datetime.utcnow()
+        job.active_key = None
+    job.cancel_requested = True
+    db.session.commit()
+    logger.info(f"Запрошена отмена задачи {job_id}")
+    return True
+
+def get_active_job(project_id, kind='positions'):
+    """Активная (в очереди или выполняется) задача проекта"""
+    return (RefreshJob.query
+            .filter(RefreshJob.project_id == project_id,
+                    RefreshJob.kind == kind,
+                    RefreshJob.status.in_(RefreshJob.ACTIVE_STATUSES))
+            .order_by(RefreshJob.id.desc())
+            .first())
+
+def get_latest_job(project_id, kind='positions'):
+    """Последняя задача проекта в любом статусе"""
+    return (RefreshJob.query
+            .filter(RefreshJob.project_id == project_id, RefreshJob.kind == kind)
+            .order_by(RefreshJob.id.desc())
+            .first())
+
+def reap_stale_jobs(stale_after):
+    """Помечает упавшими задачи, чей воркер перестал отправлять heartbeat"""
+    deadline = datetime.utcnow() - timedelta(seconds=stale_after)
+    count = (RefreshJob.query
+             .filter(RefreshJob.status == RefreshJob.STATUS_RUNNING,
+                     RefreshJob.heartbeat_at < deadline)
+             .update({
+                 RefreshJob.status: RefreshJob.STATUS_FAILED,
+                 RefreshJob.error: 'Воркер перестал отвечать',
+                 RefreshJob.finished_at: datetime.utcnow(),
+                 RefreshJob.active_key: None,
+                 RefreshJob.running_project_id: None
+             }, synchronize_session=False))
+    db.session.commit()
+    if count:
+        logger.warning(f"Помечено зависших задач: {count}")
+    return count
+
+def claim_next_job(worker_id):
+    """
+    Забирает самую старую задачу из очереди
+
+    Задачи проектов, по которым уже выполняется задача, пропускаются.
+    Захват выполняется условным UPDATE ... WHERE status = 'queued', поэтому
+    одну задачу не может взять больше одного воркера. Тот же UPDATE заполняет
+    уникальный running_project_id: если другой воркер успел начать задачу того
+    же проекта, база отклоняет захват и кандидат пропускается.
+    """
+    busy_projects = select(RefreshJob.project_id).where(RefreshJob.status == RefreshJob.STATUS_RUNNING)
+    candidates = (RefreshJob.query
+                  .filter(RefreshJob.status == RefreshJob.STATUS_QUEUED,
+                          ~RefreshJob.project_id.in_(busy_projects))
+                  .order_by(RefreshJob.created_at, RefreshJob.id)
+                  .limit(5)
+                  .all())
+
+    for candidate in candidates:
+        now = datetime.utcnow()
+        try:
+            claimed = (RefreshJob.query
+                       .filter(RefreshJob.id == candidate.id,
+                               RefreshJob.status == RefreshJob.STATUS_QUEUED)
+                       .update({
+                           RefreshJob.status: RefreshJob.STATUS_RUNNING,
+                           RefreshJob.worker_id: worker_id,
+                           RefreshJob.started_at: now,
+                           RefreshJob.heartbeat_at: now,
+                           RefreshJob.running_project_id: candidate.project_id
+                       }, synchronize_session=False))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            logger.info(f"Проект {candidate.project_id} уже обновляется другим воркером, задача {candidate.id} ждет")
+            continue
+        if claimed == 1:
+            db.session.refresh(candidate)
+            return candidate
+    return None
+
+class JobContext:
+    """
+    Связь выполняющейся задачи с ее записью в очереди
+
+    Передается обработчику; should_cancel() не чаще раза в heartbeat_interval
+    обновляет heartbeat вместе со счетчиками прогресса и перечитывает флаг отмены.
+    """
+
+    def __init__(self, job, heartbeat_interval):
+        self.job_id = job.id
+        self.project_id = job.project_id
+        self.kind = job.kind
+        self.heartbeat_interval = heartbeat_interval
+        self.progress = None
+        self._last_heartbeat = time.monotonic()
+        self._cancelled = False
+
+    def start_progress(self, total):
+        """Создает счетчик прогресса задачи на total элементов и сразу сохраняет его"""
+        self.progress = ProgressTracker(self.project_id, total, kind=self.kind, job_id=self.job_id)
+        self._save_heartbeat()
+        self.progress.publish(force=True)
+        return self.progress
+
+    def _save_heartbeat(self):
+        values = {RefreshJob.heartbeat_at: datetime.utcnow()}
+        if self.progress is not None:
+            values.update({
+                RefreshJob.total_items: self.progress.total,
+                RefreshJob.processed_items: self.progress.processed,
+                RefreshJob.failed_items: self.progress.failed
+            })
+        RefreshJob.query.filter_by(id=self.job_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def should_cancel(self):
+        if self._cancelled:
+            return True
+
+        now = time.monotonic()
+        if now - self._last_heartbeat >= self.heartbeat_interval:
+            self._last_heartbeat = now
+            self._save_heartbeat()
+            cancel_requested = db.session.execute(
+                select(RefreshJob.cancel_requested).where(RefreshJob.id == self.job_id)
+            ).scalar()
+            self._cancelled = bool(cancel_requested)
+        return self._cancelled
+
+def _finish_job(job_id, status, error=None, progress=None):
+    """Записывает итог задачи и публикует событие завершения в комнату проекта"""
+    db.session.rollback()
+    values = {
+        RefreshJob.status: status,
+        RefreshJob.error: error,
+        RefreshJob.finished_at: datetime.utcnow(),
+        RefreshJob.active_key: None,
+        RefreshJob.running_project_id: None
+    }
+    if progress is not None:
+        values.update({
+            RefreshJob.total_items: progress.total,
+            RefreshJob.processed_items: progress.processed,
+            RefreshJob.failed_items: progress.failed
+        })
+    RefreshJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+    db.session.commit()
+
+    job = db.session.get(RefreshJob, job_id)
+    if job is not None:
+        payload = job_progress(job)
+        payload['message'] = error
+        event = 'update_error' if status == RefreshJob.STATUS_FAILED else 'update_complete'
+        publish(event, payload, job.project_id)
+
+def run_job(job):
+    """Выполняет задачу и записывает результат в очередь"""
+    handler = _handlers().get(job.kind)
+    if handler is None:
+        _finish_job(job.id, RefreshJob.STATUS_FAILED, f"Неизвестный вид задачи: {job.kind}")
+        return
+
+    context = JobContext(job, current_app.config.get('JOB_HEARTBEAT_INTERVAL', 10))
+    logger.info(f"Воркер начал задачу {job.id} ({job.kind}) для проекта {job.project_id}")
+    # Один бюджет повторов на задачу: недоступный API не держит воркер часами
+    budget = RetryBudget(current_app.config.get('JOB_RETRY_BUDGET'),
+                         current_app.config.get('JOB_RETRY_MAX_SLEEP'))
+    try:
+        with use_retry_budget(budget):
+            handler(job.project_id, job=context)
+    except JobCancelled:
+        logger.info(f"Задача {job.id} отменена")
+        _finish_job(job.id, RefreshJob.STATUS_CANCELLED, progress=context.progress)
+    except Exception as e:
+        logger.error(f"Задача {job.id} завершилась с ошибкой: {e}")
+        _finish_job(job.id, RefreshJob.STATUS_FAILED, str(e), progress=context.progress)
+    else:
+        status = RefreshJob.STATUS_CANCELLED if context.should_cancel() else RefreshJob.STATUS_COMPLETED
+        _finish_job(job.id, status, progress=context.progress)
+        logger.info(f"Задача {job.id} завершена: {status}")
+    finally:
+        logger.info(f"Задача {job.id}: повторов запросов {budget.retries}, ожидание {budget.slept:.1f} с")
+        cache = get_response_cache()
+        if cache is not None:
+            logger.info(f"Кэш ответов API: {cache.stats()}")
+
+def run_worker(once=False):
+    """
+    Основной цикл воркера: забирает задачи из очереди и выполняет их по одной
+
+    Должен вызываться в контексте приложения. SIGTERM/SIGINT завершают цикл
+    после текущей задачи.
+
+    Args:
+        once: Обработать очередь до пустой и выйти
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = current_app.config.get('JOB_POLL_INTERVAL', 5)
+    stale_after = current_app.config.get('JOB_STALE_AFTER', 600)
+    stopping = []
+
+    def stop(signum, frame):
+        logger.info(f"Воркер {worker_id} получил сигнал {signum}, завершение после текущей задачи")
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Воркер {worker_id} запущен")
+    while not stopping:
+        reap_stale_jobs(stale_after)
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        db.session.remove()
+
+    logger.info(f"Воркер {worker_id} остановлен")
@@ -0,0 +1,242 @@
+import logging
+from datetime import datetime
+from sqlalchemy import update, select, delete, case, or_, func, bindparam, tuple_
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from app import db
+from app.models import Keyword, KeywordPosition, KeywordDailyPosition
+from app.reports.positions import daily_positions_subquery
+from app.reports.cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+class PositionWriter:
+    """
+    Пакетная запись позиций ключевых слов
+
+    Принимает уже известные keyword_id, копит строки и пишет их порциями
+    многострочным INSERT в keyword_position. Поле Keyword.last_webmaster_update
+    обновляется одним UPDATE ... WHERE id IN (...) на порцию, снимок последних
+    позиций на Keyword - пакетным UPDATE по ключевым словам порции.
+    Подневные значения (add_daily) пишутся в keyword_daily_position через upsert,
+    поэтому повторная загрузка тех же дней не создает дублей.
+    """
+
+    def __init__(self, session=None, chunk_size=DEFAULT_CHUNK_SIZE, commit=False, update_keywords=True,
+                 update_snapshot=True):
+        """
+        Args:
+            session: Сессия SQLAlchemy (по умолчанию db.session)
+            chunk_size: Количество строк в одном INSERT
+            commit: Фиксировать транзакцию после каждой порции
+            update_keywords: Обновлять Keyword.last_webmaster_update
+            update_snapshot: Обновлять снимок текущей/предыдущей позиции на Keyword
+        """
+        self.session = session if session is not None else db.session
+        self.chunk_size = chunk_size
+        self.commit = commit
+        self.update_keywords = update_keywords
+        self.update_snapshot = update_snapshot
+        self.written = 0
+        # Ключевые слова порции, которую не удалось записать последним flush()
+        self.failed_keyword_ids = set()
+        self._rows = []
+        self._daily_rows = {}
+
+    def add(self, keyword_id, position, check_date=None, data_date_start=None, data_date_end=None,
+            region_id=None):
+        """Добавляет позицию в буфер, при заполнении порции записывает ее"""
+        self._rows.append({
+            'keyword_id': keyword_id,
+            'position': position,
+            'region_id': region_id,
+            'check_date': check_date or datetime.utcnow(),
+            'data_date_start': data_date_start,
+            'data_date_end': data_date_end
+        })
+        if len(self._rows) >= self.chunk_size:
+            self.flush()
+
+    def add_daily(self, keyword_id, day, position, region_id=None):
+        """Добавляет подневную позицию; повтор того же дня и региона в буфере заменяет значение"""
+        self._daily_rows[(keyword_id, region_id or 0, day)] = position
+        if len(self._daily_rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Записывает накопленные позиции, возвращает количество записанных строк
+
+        Буфер очищается до записи: если запись падает, ключевые слова порции
+        сохраняются в failed_keyword_ids, а исключение пробрасывается -
+        вызывающий откатывает транзакцию и учитывает эти слова как ошибки.
+        """
+        self.failed_keyword_ids = set()
+        if not self._rows and not self._daily_rows:
+            return 0
+
+        rows, self._rows = self._rows, []
+        daily_rows, self._daily_rows = self._daily_rows, {}
+        try:
+            return self._write(rows, daily_rows)
+        except Exception:
+            self.failed_keyword_ids = ({row['keyword_id'] for row in rows}
+                                       | {keyword_id for keyword_id, _, _ in daily_rows})
+            raise
+
+    def _write(self, rows, daily_rows):
+        # Новые данные делают закэшированные отчеты проектов порции устаревшими
+        keyword_ids = {row['keyword_id'] for row in rows} | {keyword_id for keyword_id, _, _ in daily_rows}
+        bump_data_version(select(Keyword.project_id).where(Keyword.id.in_(keyword_ids)).distinct(), self.session)
+        if daily_rows:
+            upsert_daily_positions(self.session, [
+                {'keyword_id': keyword_id, 'region_id': region_id, 'date': day, 'position': position}
+                for (keyword_id, region_id, day), position in daily_rows.items()
+            ])
+        if not rows:
+            if self.commit:
+                self.session.commit()
+            return 0
+
+        self.session.execute(KeywordPosition.__table__.insert(), rows)
+
+        if self.update_keywords:
+            keyword_ids = {row['keyword_id'] for row in rows}
+            self.session.execute(
+                update(Keyword.__table__)
+                .where(Keyword.__table__.c.id.in_(keyword_ids))
+                .values(last_webmaster_update=datetime.utcnow())
+            )
+
+        if self.update_snapshot:
+            self._update_snapshots(rows)
+
+        if self.commit:
+            self.session.commit()
+
+        self.written += len(rows)
+        logger.info(f"Записано {len(rows)} позиций (всего {self.written})")
+        return len(rows)
+
+    def _update_snapshots(self, rows):
+        """
+        Сдвигает снимок позиций ключевых слов порции
+
+        Повторная проверка в тот же день заменяет текущую позицию, не трогая
+        предыдущую; более старые данные (бэкфилл) снимок не меняют. Присваивания
+        упорядочены так, чтобы каждое ссылалось только на еще не измененные
+        столбцы: MySQL вычисляет SET слева направо, остальные СУБД - по старым значениям.
+        """
+        keyword = Keyword.__table__
+        position = bindparam('snapshot_position')
+        check_date = bindparam('snapshot_date')
+        is_new_day = or_(
+            keyword.c.last_check_date.is_(None),
+            func.date(keyword.c.last_check_date) < func.date(check_date)
+        )
+        previous_position = case((is_new_day, keyword.c.current_position), else_=keyword.c.previous_position)
+
+        statement = (
+            update(keyword)
+            .where(keyword.c.id == bindparam('snapshot_keyword_id'))
+            .where(or_(keyword.c.last_check_date.is_(None), keyword.c.last_check_date <= check_date))
+            .ordered_values(
+                (keyword.c.position_delta, previous_position - position),
+                (keyword.c.previous_position, previous_position),
+                (keyword.c.current_position, position),
+                (keyword.c.last_check_date, check_date)
+            )
+        )
+        self.session.execute(statement, [{
+            'snapshot_keyword_id': row['keyword_id'],
+            'snapshot_position': row['position'],
+            'snapshot_date': row['check_date']
+        } for row in sorted(rows, key=lambda row: row['check_date'])])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._rows = []
+            self._daily_rows = {}
+        return False
+
+def upsert_daily_positions(session, rows):
+    """
+    Вставляет подневные позиции, заменяя значения уже сохраненных дней
+
+    Используется нативный upsert СУБД (ON DUPLICATE KEY UPDATE в MySQL,
+    ON CONFLICT в SQLite/PostgreSQL); для остальных - удаление и вставка.
+    """
+    if not rows:
+        return
+    table = KeywordDailyPosition.__table__
+    dialect = session.get_bind().dialect.name
+
+    if dialect in ('mysql', 'mariadb'):
+        statement = mysql.insert(table)
+        statement = statement.on_duplicate_key_update(position=statement.inserted.position)
+    elif dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite if dialect == 'sqlite' else postgresql).insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.keyword_id, table.c.region_id, table.c.date],
+            set_={'position': statement.excluded.position}
+        )
+    else:
+        session.execute(delete(table).where(
+            tuple_(table.c.keyword_id, table.c.region_id, table.c.date).in_(
+                [(row['keyword_id'], row['region_id'], row['date']) for row in rows])
+        ))
+        statement = table.insert()
+    session.execute(statement, rows)
+
+def rebuild_position_snapshots(project_id, session=None):
+    """
+    Пересчитывает снимок позиций ключевых слов проекта по всей истории
+
+    Используется для первичного заполнения и после массовой перезаписи позиций.
+    Транзакцию не фиксирует.
+
+    Returns:
+        Количество ключевых слов с позициями
+    """
+    session = session if session is not None else db.session
+    keyword = Keyword.__table__
+
+    session.execute(
+        update(keyword)
+        .where(keyword.c.project_id == project_id)
+        .values(current_position=None, previous_position=None, position_delta=None, last_check_date=None)
+    )
+
+    daily = daily_positions_subquery(project_id)
+    latest = session.execute(
+        select(daily.c.keyword_id, daily.c.position, daily.c.prev_position, daily.c.check_date)
+        .where(daily.c.recency == 1)
+    ).fetchall()
+    if not latest:
+        return 0
+
+    session.execute(
+        update(keyword)
+        .where(keyword.c.id == bindparam('snapshot_keyword_id'))
+        .values(
+            current_position=bindparam('snapshot_position'),
+            previous_position=bindparam('snapshot_previous'),
+            position_delta=bindparam('snapshot_delta'),
+            last_check_date=bindparam('snapshot_date')
+        ),
+        [{
+            'snapshot_keyword_id': keyword_id,
+            'snapshot_position': position,
+            'snapshot_previous': prev_position,
+            'snapshot_delta': prev_position - position if prev_position is not None and position is not None else None,
+            'snapshot_date': check_date
+        } for keyword_id, position, prev_position, check_date in latest]
+    )
+    bump_data_version(project_id, session)
+    return len(latest)
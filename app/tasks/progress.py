@@ -0,0 +1,90 @@
+import time
+import logging
+from datetime import datetime
+from app import socketio
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMIT_INTERVAL = 1.0
+
+def project_room(project_id):
+    """Комната Socket.IO, в которую публикуются события проекта"""
+    return f'project_{project_id}'
+
+def progress_payload(project_id, kind, total, processed, failed, elapsed, job_id=None, status='running'):
+    """
+    Событие прогресса: выполнено, ошибки, скорость (элементов в секунду) и
+    оценка оставшегося времени в секундах
+    """
+    throughput = processed / elapsed if elapsed and elapsed > 0 else 0.0
+    eta = None
+    if total and throughput > 0:
+        eta = max(total - processed, 0) / throughput
+    return {
+        'job_id': job_id,
+        'project_id': project_id,
+        'kind': kind,
+        'status': status,
+        'total': total,
+        'processed': processed,
+        'failed': failed,
+        'progress': int(processed * 100 / total) if total else 0,
+        'throughput': round(throughput, 2),
+        'eta_seconds': int(round(eta)) if eta is not None else None
+    }
+
+def job_progress(job):
+    """Прогресс задачи из очереди по ее записи в базе данных"""
+    elapsed = None
+    if job.started_at:
+        elapsed = ((job.finished_at or job.heartbeat_at or datetime.utcnow()) - job.started_at).total_seconds()
+    return progress_payload(job.project_id, job.kind, job.total_items, job.processed_items or 0,
+                            job.failed_items or 0, elapsed, job_id=job.id, status=job.status)
+
+def publish(event, payload, project_id):
+    """Отправляет событие в комнату проекта, ошибки доставки не прерывают обновление"""
+    try:
+        socketio.emit(event, payload, to=project_room(project_id))
+    except Exception as e:
+        logger.warning(f"Не удалось отправить событие {event} для проекта {project_id}: {e}")
+
+class ProgressTracker:
+    """
+    Счетчики выполнения обновления проекта
+
+    advance() вызывается на каждый обработанный элемент; событие update_progress
+    отправляется в комнату проекта не чаще раза в emit_interval секунд.
+    """
+
+    def __init__(self, project_id, total, kind='positions', job_id=None, emit_interval=DEFAULT_EMIT_INTERVAL):
+        self.project_id = project_id
+        self.total = total
+        self.kind = kind
+        self.job_id = job_id
+        self.emit_interval = emit_interval
+        self.processed = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._last_emit = None
+
+    def advance(self, ok=True):
+        self.processed += 1
+        if not ok:
+            self.failed += 1
+        self.publish()
+
+    def mark_failed(self, count):
+        """Переводит в ошибки count уже учтенных как успешные элементов (например, потерянную порцию записи)"""
+        self.failed += count
+        self.publish()
+
+    def snapshot(self, status='running'):
+        return progress_payload(self.project_id, self.kind, self.total, self.processed, self.failed,
+                                time.monotonic() - self._started, job_id=self.job_id, status=status)
+
+    def publish(self, force=False):
+        now = time.monotonic()
+        if not force and self._last_emit is not None and now - self._last_emit < self.emit_interval:
+            return
+        self._last_emit = now
+        publish('update_progress', self.snapshot(), self.project_id)
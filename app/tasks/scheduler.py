@@ -0,0 +1,159 @@
+import time
+import signal
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, func
+from app import db
+from app.models import Project, Keyword, URL, RefreshJob
+from app.tasks.jobs import enqueue_job
+
+logger = logging.getLogger(__name__)
+
+# Множитель для равномерного разброса фаз проектов по интервалу (хеш Кнута)
+_PHASE_MULTIPLIER = 2654435761
+_EPOCH = datetime(1970, 1, 1)
+
+def project_phase(project_id, interval_seconds):
+    """Смещение запуска проекта внутри интервала, постоянное для проекта"""
+    return (project_id * _PHASE_MULTIPLIER) % max(int(interval_seconds), 1)
+
+def latest_slot(project_id, interval_seconds, now):
+    """
+    Последний плановый момент запуска проекта не позже now (время UTC)
+
+    Моменты запуска проекта идут с шагом interval_seconds со сдвигом на фазу
+    проекта, поэтому проекты стартуют в разное время, а не все сразу.
+    """
+    interval_seconds = max(int(interval_seconds), 1)
+    timestamp = int((now - _EPOCH).total_seconds())
+    phase = project_phase(project_id, interval_seconds)
+    return _EPOCH + timedelta(seconds=timestamp - (timestamp - phase) % interval_seconds)
+
+def _last_updates(kind):
+    """Время последнего обновления данных каждого проекта по виду задачи"""
+    if kind == 'positions':
+        column, owner = Keyword.last_webmaster_update, Keyword.project_id
+    else:
+        column, owner = URL.last_metrika_update, URL.project_id
+    rows = db.session.execute(select(owner, func.max(column)).group_by(owner))
+    return dict(rows.fetchall())
+
+def _eligible_projects(kind):
+    """Проекты с настроенным доступом к API для вида задачи"""
+    if kind == 'positions':
+        conditions = (Project.yandex_webmaster_token.isnot(None), Project.yandex_webmaster_host.isnot(None))
+    else:
+        conditions = (Project.yandex_metrika_token.isnot(None), Project.yandex_metrika_counter.isnot(None))
+    return [project_id for (project_id,) in db.session.execute(select(Project.id).where(*conditions))]
+
+def due_jobs(now=None):
+    """
+    Задачи, которые пора поставить в очередь
+
+    Проект попадает в список, если его плановый момент уже наступил, а данные
+    обновлялись раньше этого момента (например, ручное обновление после
+    планового момента делает запуск ненужным). После задачи, запущенной позже
+    планового момента, проект ждет следующего момента, даже если она упала.
+
+    Returns:
+        Список (плановый момент, project_id, kind), самые просроченные первыми
+    """
+    now = now or datetime.utcnow()
+    intervals = {
+        'positions': current_app.config.get('SCHEDULER_POSITIONS_INTERVAL', 86400),
+        'traffic': current_app.config.get('SCHEDULER_TRAFFIC_INTERVAL', 86400),
+    }
+
+    active = set(db.session.execute(
+        select(RefreshJob.project_id, RefreshJob.kind)
+        .where(RefreshJob.status.in_(RefreshJob.ACTIVE_STATUSES))
+    ).fetchall())
+    # Последняя задача по проекту и виду: упавшая задача не перезапускается до следующего момента
+    last_jobs = {(project_id, kind): created_at for project_id, kind, created_at in db.session.execute(
+        select(RefreshJob.project_id, RefreshJob.kind, func.max(RefreshJob.created_at))
+        .group_by(RefreshJob.project_id, RefreshJob.kind)
+    )}
+
+    due = []
+    for kind, interval in intervals.items():
+        if not interval:
+            continue
+        last_updates = _last_updates(kind)
+        for project_id in _eligible_projects(kind):
+            if (project_id, kind) in active:
+                continue
+            slot = latest_slot(project_id, interval, now)
+            last_job = last_jobs.get((project_id, kind))
+            if last_job is not None and last_job >= slot:
+                continue
+            last_update = last_updates.get(project_id)
+            if last_update is None or last_update < slot:
+                due.append((slot, project_id, kind))
+    due.sort()
+    return due
+
+def schedule_once(now=None):
+    """
+    Ставит в очередь просроченные задачи с учетом общего лимита
+
+    Одновременно в очереди и в работе не больше SCHEDULER_MAX_ACTIVE_JOBS задач,
+    остальные проекты дожидаются следующего прохода.
+
+    Returns:
+        Количество поставленных задач
+    """
+    max_active = current_app.config.get('SCHEDULER_MAX_ACTIVE_JOBS', 4)
+    active_count = db.session.execute(
+        select(func.count()).select_from(RefreshJob)
+        .where(RefreshJob.status.in_(RefreshJob.ACTIVE_STATUSES))
+    ).scalar()
+    capacity = max_active - active_count
+    if capacity <= 0:
+        logger.info(f"Лимит активных задач достигнут ({active_count}/{max_active})")
+        return 0
+
+    due = due_jobs(now)
+    enqueued = 0
+    for slot, project_id, kind in due[:capacity]:
+        job, created = enqueue_job(project_id, kind=kind)
+        if created:
+            enqueued += 1
+            logger.info(f"Плановое обновление {kind} проекта {project_id} (момент {slot:%Y-%m-%d %H:%M})")
+    if len(due) > capacity:
+        logger.info(f"Отложено до следующего прохода: {len(due) - capacity} задач")
+    return enqueued
+
+def run_scheduler(once=False):
+    """
+    Основной цикл планировщика
+
+    Должен вызываться в контексте приложения. Задачи выполняет worker.py,
+    планировщик только ставит их в очередь.
+
+    Args:
+        once: Выполнить один проход и выйти
+    """
+    tick = current_app.config.get('SCHEDULER_TICK_INTERVAL', 60)
+    stopping = []
+
+    def stop(signum, frame):
+        logger.info(f"Планировщик получил сигнал {signum}, завершение")
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info("Планировщик запущен")
+    while not stopping:
+        try:
+            schedule_once()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Ошибка планировщика: {e}")
+        finally:
+            db.session.remove()
+        if once:
+            break
+        time.sleep(tick)
+    logger.info("Планировщик остановлен")
@@ -1,12 +1,19 @@
 import logging
-import os
+import contextvars
+import queue
+import threading
 from datetime import datetime, timedelta
-import requests
-import backoff
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
 from app import db
-from app.models import Project, Keyword, KeywordPosition
+from app.models import Project
 from app.yandex import YandexWebmasterAPI
 from app.email import send_email
+from app.tasks.position_writer import PositionWriter
+from app.tasks.jobs import JobCancelled
+from app.utils.backoff import FatalError
+from app.regions import region_code
+from app.tasks.progress import ProgressTracker, publish
 
 # Настройка логирования в консоль
 logging.basicConfig(
@@ -18,49 +25,145 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3)
-def fetch_position_data(host, query, token, user_id):
-    """Получает позицию для ключевого слова из API Яндекс.Вебмастер."""
-    try:
-        api = YandexWebmasterAPI(
-            oauth_token=token,
-            user_id=user_id
-        )
-        
-        # Получаем даты для запроса (последние 7 дней)
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=7)
-        
-        logger.info(f"Запрашиваем позиции для '{query}' с {start_date} по {end_date}")
-        
-        # Получаем данные из API
-        positions = api.get_keywords_positions(
-            host_url=host,
-            keywords=[query]
-        )
-        
-        if positions and query in positions:
-            position, date_range = positions[query]
-            if position is not None:
-                logger.info(f"Средняя позиция для '{query}': {position:.2f}")
-                return position, date_range
-        
-        logger.warning(f"Нет данных о позициях для '{query}'")
+# Окно, по которому считается средняя позиция обновления
+DAILY_WINDOW_DAYS = 7
+# Как часто (в секундах) ожидание результатов выгрузки прерывается для should_cancel()
+RESULTS_POLL_INTERVAL = 1.0
+# Маркер окончания выгрузки региона в очереди результатов
+_REGION_DONE = object()
+
+def position_result(daily):
+    """Средняя позиция за последние DAILY_WINDOW_DAYS дней с данными.
+    
+    Returns:
+        (средняя позиция, первый день, последний день, [(день, позиция)]) или None
+    """
+    if not daily:
         return None
+    recent = daily[-DAILY_WINDOW_DAYS:]
+    position = sum(value for _, value in recent) / len(recent)
+    return position, recent[0][0], recent[-1][0], daily
+
+def fetch_region_positions(api, host, queries, region=None, on_results=None):
+    """Получает позиции ключевых слов одного региона одной постраничной выгрузкой.
+    
+    Args:
+        queries: Ключевые слова региона
+        region: Код региона Яндекса (None - без фильтра по региону)
+        on_results: Вызывается после каждой страницы выгрузки с найденными на ней
+            словами {ключевое слово: результат position_result}
+    
+    Returns:
+        {ключевое слово: результат position_result или None}
+    """
+    start_date = datetime.now().date() - timedelta(days=DAILY_WINDOW_DAYS - 1)
+    logger.info(f"Запрашиваем позиции {len(queries)} ключевых слов в регионе {region or 'все'} с {start_date}")
+    
+    def on_page(found):
+        if on_results is not None:
+            on_results({query: position_result(daily) for query, daily in found.items()})
+    
+    daily = api.get_daily_positions_bulk(host, queries, start_date,
+                                         region_ids=[region] if region else None, on_page=on_page)
+    return {query: position_result(daily.get(query)) for query in queries}
+
+def fetch_positions_by_region(api, host, keywords, workers, should_cancel=None):
+    """Получает позиции ключевых слов, группируя их по региону.
+    
+    На каждый регион выполняется одна выгрузка query-analytics с фильтром по
+    региону, поэтому число запросов пропорционально числу регионов, а не
+    ключевых слов. Регионы выгружаются параллельно, не более workers
+    одновременно: для проекта с одним регионом выгрузка всегда одна.
+    
+    Генератор: отдает пары (keyword, result) постранично, по мере того как
+    выгрузки находят слова; ненайденные слова региона отдаются с result=None
+    после окончания его выгрузки. Потоки только передают результаты в очередь,
+    а база данных и should_cancel() используются в вызывающем потоке, который
+    опрашивает should_cancel() и во время выгрузки (heartbeat, отмена). При
+    should_cancel() == True выбрасывается JobCancelled, и выгрузки
+    останавливаются перед следующей страницей. При любой ошибке (в том числе
+    FatalError из запроса) остальные выгрузки также останавливаются.
+    Выгрузки выполняются в копии контекста, чтобы в потоках действовал бюджет
+    повторов задачи.
+    """
+    groups = {}
+    for keyword in keywords:
+        groups.setdefault(keyword.region_id, []).append(keyword)
+    logger.info(f"Ключевые слова сгруппированы по {len(groups)} регионам")
+    
+    results = queue.Queue()
+    stop = threading.Event()
+    
+    def fetch_region(region_id, region, by_query):
+        reported = set()
         
-    except Exception as e:
-        logger.error(f"Ошибка при получении позиции для '{query}': {str(e)}")
-        return None
+        def on_results(found):
+            # Между страницами: после отмены или ошибки выгрузка прекращается
+            if stop.is_set():
+                raise JobCancelled()
+            for query, result in found.items():
+                reported.add(query)
+                for keyword in by_query[query]:
+                    results.put((keyword, result))
+        
+        try:
+            region_results = fetch_region_positions(api, host, list(by_query), region, on_results)
+        except JobCancelled:
+            region_results = None
+        except FatalError as e:
+            results.put(e)
+            region_results = None
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки позиций региона {region_id}: {e}")
+            region_results = {}
+        if region_results is not None:
+            for query, group in by_query.items():
+                if query not in reported:
+                    for keyword in group:
+                        results.put((keyword, region_results.get(query)))
+        # Маркер идет последним: после него результатов региона в очереди нет
+        results.put(_REGION_DONE)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as executor:
+        futures = []
+        for region_id, group in groups.items():
+            by_query = {}
+            for keyword in group:
+                by_query.setdefault(keyword.keyword, []).append(keyword)
+            futures.append(executor.submit(contextvars.copy_context().run, fetch_region,
+                                           region_id, region_code(region_id), by_query))
+        try:
+            running = len(futures)
+            while running:
+                if should_cancel and should_cancel():
+                    raise JobCancelled()
+                try:
+                    item = results.get(timeout=RESULTS_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if item is _REGION_DONE:
+                    running -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for pending in futures:
+                pending.cancel()
 
-def update_project_positions(project_id):
-    """Обновляет позиции для всех ключевых слов проекта."""
-    pid_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'logs', f'update_positions_{project_id}.pid')
+def update_project_positions(project_id, workers=None, job=None):
+    """Обновляет позиции для всех ключевых слов проекта.
+    
+    Args:
+        project_id: ID проекта
+        workers: Максимум параллельных выгрузок регионов
+        job: JobContext задачи из очереди (для отмены и heartbeat)
+    """
+    project = None
+    should_cancel = job.should_cancel if job else None
     
     try:
-        # Создаем PID файл
-        with open(pid_file, 'w') as f:
-            f.write(str(os.getpid()))
-            
         logger.info(f"Начало обновления позиций для проекта {project_id}")
         
         # Получаем проект
@@ -79,26 +182,69 @@ def update_project_positions(project_id):
             
         logger.info(f"Найдено {len(keywords)} ключевых слов")
 
-        # Получаем позиции для всех ключевых слов
-        logger.info("Запрашиваем позиции из API...")
-        positions = {}
-        for keyword in keywords:
-            logger.info(f"Получаем позицию для '{keyword.keyword}'...")
-            result = fetch_position_data(
-                project.yandex_webmaster_host,
-                keyword.keyword,
-                project.yandex_webmaster_token,
-                project.yandex_webmaster_user_id
-            )
-            if result:
-                position, date_range = result
-                positions[keyword.keyword] = (position, date_range)
-                logger.info(f"Позиция для '{keyword.keyword}': {position}")
-            else:
-                logger.warning(f"Не удалось получить позицию для '{keyword.keyword}'")
+        workers = workers or current_app.config.get('POSITIONS_UPDATE_WORKERS', 8)
+        writer = PositionWriter(
+            chunk_size=current_app.config.get('POSITIONS_WRITE_CHUNK_SIZE', 1000),
+            commit=True
+        )
+        api = YandexWebmasterAPI(
+            oauth_token=project.yandex_webmaster_token,
+            user_id=project.yandex_webmaster_user_id
+        )
+
+        # Прогресс публикуется в комнату проекта Socket.IO и, для задач из очереди, сохраняется в refresh_job
+        if job:
+            progress = job.start_progress(len(keywords))
+        else:
+            progress = ProgressTracker(project_id, len(keywords))
+            progress.publish(force=True)
+
+        # Получаем позиции параллельно и сразу пишем их в базу данных
+        logger.info(f"Запрашиваем позиции из API по регионам (до {workers} потоков)...")
+        success_count = 0
+        error_count = 0
         
-        if not positions:
-            logger.warning("API вернул пустой словарь позиций")
+        results = fetch_positions_by_region(
+            api, project.yandex_webmaster_host, keywords, workers, should_cancel)
+        try:
+            for keyword, result in results:
+                if not result:
+                    logger.warning(f"Не удалось получить позицию для '{keyword.keyword}'")
+                    progress.advance(ok=False)
+                    continue
+            
+                position, first_day, last_day, daily = result
+            
+                try:
+                    # Порции записываются многострочным INSERT и сразу фиксируются
+                    writer.add(keyword.id, position,
+                               data_date_start=datetime.combine(first_day, datetime.min.time()),
+                               data_date_end=datetime.combine(last_day, datetime.min.time()),
+                               region_id=keyword.region_id)
+                    for day, value in daily:
+                        writer.add_daily(keyword.id, day, value, region_id=keyword.region_id)
+                    success_count += 1
+                    progress.advance()
+                    logger.info(f"Позиция для '{keyword.keyword}': {position}")
+                except Exception as e:
+                    db.session.rollback()
+                    # Вместе с текущим словом потеряна вся порция: уже посчитанные
+                    # в ней слова переводятся из успешных в ошибки
+                    lost = len(writer.failed_keyword_ids - {keyword.id})
+                    success_count -= lost
+                    error_count += lost + 1
+                    progress.mark_failed(lost)
+                    progress.advance(ok=False)
+                    logger.error(f"Ошибка при записи порции позиций ({lost + 1} ключевых слов, "
+                                 f"последнее '{keyword.keyword}'): {e}")
+        except JobCancelled:
+            # Уже полученные позиции сохраняем, остальные запросы отменены
+            writer.flush()
+            logger.info(f"Обновление позиций проекта {project_id} отменено, сохранено {success_count} позиций")
+            raise
+        
+        if success_count == 0 and error_count == 0:
+            logger.warning("API не вернул ни одной позиции")
             send_email(
                 subject=f"Нет данных по позициям для проекта {project.name}",
                 recipient=project.user.email,
@@ -106,55 +252,12 @@ def update_project_positions(project_id):
             )
             return
 
-        # Обновляем позиции в базе данных
-        success_count = 0
-        error_count = 0
-        
-        logger.info(f"Начинаем обновление {len(positions)} позиций в базе данных")
-        
-        for keyword_text, (position, date_range) in positions.items():
-            if position is not None:
-                keyword = Keyword.query.filter_by(
-                    project_id=project_id,
-                    keyword=keyword_text
-                ).first()
-                
-                if keyword:
-                    try:
-                        # Создаем новую запись в таблице KeywordPosition
-                        keyword_position = KeywordPosition(
-                            keyword_id=keyword.id,
-                            position=position,
-                            check_date=datetime.utcnow()
-                        )
-                        
-                        # Парсим даты из строки формата "dd.mm - dd.mm"
-                        if date_range:
-                            try:
-                                start_str, end_str = date_range.split(' - ')
-                                current_year = datetime.now().year
-                                
-                                # Преобразуем строки в объекты datetime
-                                start_date = datetime.strptime(f"{start_str}.{current_year}", "%d.%m.%Y")
-                                end_date = datetime.strptime(f"{end_str}.{current_year}", "%d.%m.%Y")
-                                
-                                keyword_position.data_date_start = start_date
-                                keyword_position.data_date_end = end_date
-                            except Exception as e:
-                                logger.warning(f"Ошибка при парсинге дат '{date_range}': {e}")
-                        
-                        db.session.add(keyword_position)
-                        keyword.last_webmaster_update = datetime.utcnow()
-                        success_count += 1
-                        logger.info(f"Успешно обновлена позиция для '{keyword_text}': {position}")
-                    except Exception as e:
-                        error_count += 1
-                        logger.error(f"Ошибка при обновлении позиции для '{keyword_text}': {e}")
-
         if success_count > 0:
             try:
-                db.session.commit()
+                writer.flush()
                 logger.info(f"Успешно сохранено {success_count} позиций в базе данных")
+                if not job:
+                    publish('update_complete', progress.snapshot(status='completed'), project_id)
                 
                 # Отправляем email об успешном обновлении
                 message = f"Успешно обновлено {success_count} из {len(keywords)} ключевых слов"
@@ -174,8 +277,12 @@ def update_project_positions(project_id):
             logger.warning("Нет успешно обновленных позиций")
             db.session.rollback()
 
+    except JobCancelled:
+        raise
     except Exception as e:
         logger.error(f"Критическая ошибка при обновлении позиций: {e}")
+        if project is None:
+            raise
         try:
             send_email(
                 subject=f"Ошибка обновления позиций для проекта {project.name}",
@@ -185,9 +292,3 @@ def update_project_positions(project_id):
         except:
             logger.error("Не удалось отправить email об ошибке")
         raise
-    finally:
-        # Удаляем PID файл в любом случае
-        try:
-            os.remove(pid_file)
-        except OSError:
-            pass
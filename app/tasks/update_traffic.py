@@ -0,0 +1,100 @@
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, update, select
+from app import db
+from app.models import Project, URL, URLTraffic
+from app.yandex_metrika import YandexMetrikaAPI
+from app.tasks.jobs import JobCancelled
+from app.tasks.progress import ProgressTracker, publish
+from app.reports.cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+def update_project_traffic(project_id, days=None, job=None):
+    """
+    Обновляет подневный трафик всех URL проекта из Яндекс.Метрики
+
+    Трафик запрашивается одним отчетом по счетчику (страницы входа x дни) и
+    сопоставляется с URL проекта локально. Строки url_traffic за обновляемые
+    дни перезаписываются, поэтому повторный запуск не создает дублей.
+
+    Args:
+        project_id: ID проекта
+        days: Количество последних полных дней (по умолчанию TRAFFIC_REFRESH_DAYS)
+        job: JobContext задачи из очереди (для отмены и heartbeat)
+
+    Returns:
+        Количество записанных строк
+    """
+    project = Project.query.get(project_id)
+    if not project:
+        logger.error(f"Проект {project_id} не найден")
+        return 0
+    if not project.yandex_metrika_token or not project.yandex_metrika_counter:
+        raise ValueError('Для проекта не указан счетчик или токен Яндекс.Метрики')
+
+    urls = db.session.execute(select(URL.id, URL.url).where(URL.project_id == project_id)).fetchall()
+    if not urls:
+        logger.warning(f"У проекта {project_id} нет URL для обновления трафика")
+        return 0
+
+    days = days or current_app.config.get('TRAFFIC_REFRESH_DAYS', 7)
+    # Текущий день в Метрике неполный, поэтому берем дни до вчерашнего включительно
+    end_date = datetime.now().date() - timedelta(days=1)
+    start_date = end_date - timedelta(days=days - 1)
+    logger.info(f"Обновление трафика проекта {project_id}: {len(urls)} URL с {start_date} по {end_date}")
+
+    if job:
+        progress = job.start_progress(len(urls))
+    else:
+        progress = ProgressTracker(project_id, len(urls), kind='traffic')
+        progress.publish(force=True)
+
+    api = YandexMetrikaAPI(project.yandex_metrika_token)
+    traffic = api.get_daily_traffic_bulk(project.yandex_metrika_counter, [url for _, url in urls],
+                                         start_date, end_date)
+    if job and job.should_cancel():
+        raise JobCancelled()
+
+    # Дни без визитов сохраняются нулями, чтобы в отчете не было пропусков
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    chunk_size = current_app.config.get('POSITIONS_WRITE_CHUNK_SIZE', 1000)
+    project_url_ids = select(URL.id).where(URL.project_id == project_id)
+
+    db.session.execute(
+        delete(URLTraffic)
+        .where(URLTraffic.url_id.in_(project_url_ids),
+               URLTraffic.check_date >= datetime.combine(start_date, datetime.min.time()),
+               URLTraffic.check_date < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+    )
+
+    rows = []
+    written = 0
+    for url_id, url in urls:
+        daily = traffic.get(url, {})
+        for date in dates:
+            rows.append({
+                'url_id': url_id,
+                'visits': int(daily.get(date, 0)),
+                'check_date': datetime.combine(date, datetime.min.time())
+            })
+        if len(rows) >= chunk_size:
+            db.session.execute(URLTraffic.__table__.insert(), rows)
+            written += len(rows)
+            rows = []
+        progress.advance(ok=url in traffic)
+    if rows:
+        db.session.execute(URLTraffic.__table__.insert(), rows)
+        written += len(rows)
+
+    db.session.execute(
+        update(URL).where(URL.project_id == project_id).values(last_metrika_update=datetime.utcnow())
+    )
+    bump_data_version(project_id)
+    db.session.commit()
+
+    if not job:
+        publish('update_complete', progress.snapshot(status='completed'), project_id)
+    logger.info(f"Трафик проекта {project_id} обновлен: {written} строк, данные найдены для {len(traffic)} URL")
+    return written
@@ -1,53 +1,260 @@
 import time
 import random
+import asyncio
 import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from functools import wraps
-from typing import Callable, Any
+from typing import Callable, Any, Optional, Dict
+import requests
 
 logger = logging.getLogger(__name__)
 
+# Коды ответа, после которых повтор имеет смысл
+RETRYABLE_STATUS_CODES = frozenset([408, 425, 429, 500, 502, 503, 504])
+# Верхняя граница паузы по Retry-After
+MAX_RETRY_AFTER = 300.0
+
+class RetryableError(Exception):
+    """Ошибка, после которой запрос можно повторить"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class FatalError(Exception):
+    """Ошибка, которую бессмысленно повторять (неверный токен, нет доступа, неверный запрос)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка Retry-After (секунды или HTTP-дата) в секундах"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Классифицирует ошибку: повторять ли вызов
+
+    Сетевые ошибки и таймауты, 408/425/429 и 5xx повторяются; остальные 4xx
+    (в том числе 401/403 при неверном токене) и ошибки кода - нет.
+    """
+    if isinstance(error, FatalError):
+        return False
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, requests.exceptions.RequestException):
+        response = getattr(error, 'response', None)
+        if response is None:
+            return True
+        return response.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def retry_after_from_error(error: BaseException) -> Optional[float]:
+    """Пауза, запрошенная сервером: из RetryableError или заголовка Retry-After ответа"""
+    if isinstance(error, RetryableError):
+        return error.retry_after
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return parse_retry_after(response.headers.get('Retry-After'))
+    return None
+
+class RetryBudget:
+    """
+    Общий лимит повторов для одной задачи
+
+    Все вызовы с повтором внутри задачи расходуют один бюджет: когда он
+    исчерпан, ошибки больше не повторяются, и задача не тратит часы на
+    недоступный API.
+    """
+
+    def __init__(self, max_retries: Optional[int] = None, max_sleep: Optional[float] = None):
+        """
+        Args:
+            max_retries: Сколько повторов допускается на всю задачу
+            max_sleep: Сколько секунд суммарно можно провести в ожидании
+        """
+        self.max_retries = max_retries
+        self.max_sleep = max_sleep
+        self.retries = 0
+        self.slept = 0.0
+        self._lock = threading.Lock()
+
+    def consume(self, delay: float) -> bool:
+        """Резервирует один повтор с паузой delay; False - бюджет исчерпан"""
+        with self._lock:
+            if self.max_retries is not None and self.retries >= self.max_retries:
+                return False
+            if self.max_sleep is not None and self.slept + delay > self.max_sleep:
+                return False
+            self.retries += 1
+            self.slept += delay
+            return True
+
+_current_budget: contextvars.ContextVar = contextvars.ContextVar('retry_budget', default=None)
+
+@contextmanager
+def use_retry_budget(budget: RetryBudget):
+    """
+    Устанавливает бюджет повторов для кода внутри блока
+
+    Бюджет хранится в contextvars: потоки пула получают его, если задачи
+    отправляются через contextvars.copy_context().run.
+    """
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+def current_budget() -> Optional[RetryBudget]:
+    return _current_budget.get()
+
+class RetryMetrics:
+    """Счетчики повторов по имени операции: вызовы, повторы, отказы и время ожидания"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, field: str, value: float = 1) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                'calls': 0, 'retries': 0, 'giveups': 0, 'fatal': 0, 'budget_exhausted': 0, 'slept': 0.0
+            })
+            stats[field] += value
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+metrics = RetryMetrics()
+
+def consume_retry(name: str, delay: float) -> bool:
+    """
+    Учитывает повтор в текущем бюджете и метриках
+
+    Returns:
+        False, если бюджет задачи исчерпан и повторять нельзя
+    """
+    budget = current_budget()
+    if budget is not None and not budget.consume(delay):
+        metrics.record(name, 'budget_exhausted')
+        return False
+    metrics.record(name, 'retries')
+    metrics.record(name, 'slept', delay)
+    return True
+
 def exponential_backoff(
     max_retries: int = 5,
     base_delay: float = 1.0,
     max_delay: float = 60.0,
     exponential_base: float = 2.0,
-    jitter: bool = True
+    jitter: bool = True,
+    retryable: Callable[[BaseException], bool] = is_retryable,
+    name: Optional[str] = None
 ) -> Callable:
     """
     Декоратор для реализации экспоненциального backoff с поддержкой jitter
-    
+
+    Работает и с обычными функциями, и с корутинами (пауза через asyncio.sleep).
+    Повторяются только ошибки, для которых retryable(error) истинно; пауза
+    из Retry-After имеет приоритет над расчетной. Повторы расходуют бюджет
+    текущей задачи (use_retry_budget) и учитываются в metrics.
+
     Args:
         max_retries: Максимальное количество попыток
         base_delay: Начальная задержка в секундах
         max_delay: Максимальная задержка в секундах
         exponential_base: База для экспоненциального роста
         jitter: Использовать ли случайное отклонение для предотвращения thundering herd
+        retryable: Классификатор ошибок (по умолчанию is_retryable)
+        name: Имя операции в метриках (по умолчанию имя функции)
     """
+    def next_delay(retries: int, error: BaseException) -> float:
+        retry_after = retry_after_from_error(error)
+        if retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER)
+
+        # Вычисляем задержку
+        delay = min(base_delay * (exponential_base ** (retries - 1)), max_delay)
+
+        # Добавляем случайное отклонение если включен jitter
+        if jitter:
+            delay = delay * (0.5 + random.random())
+        return delay
+
+    def should_retry(operation: str, retries: int, error: BaseException) -> Optional[float]:
+        """Пауза перед следующей попыткой или None, если ошибку нужно пробросить"""
+        if not retryable(error):
+            metrics.record(operation, 'fatal')
+            logger.error(f"{operation}: ошибка не подлежит повтору: {str(error)}")
+            return None
+        if retries > max_retries:
+            metrics.record(operation, 'giveups')
+            logger.error(f"Превышено максимальное количество попыток ({max_retries}). Последняя ошибка: {str(error)}")
+            return None
+
+        delay = next_delay(retries, error)
+        if not consume_retry(operation, delay):
+            logger.error(f"{operation}: бюджет повторов задачи исчерпан. Последняя ошибка: {str(error)}")
+            return None
+
+        logger.warning(f"Попытка {retries} из {max_retries} не удалась. "
+                    f"Ожидание {delay:.2f} секунд перед следующей попыткой. "
+                    f"Ошибка: {str(error)}")
+        return delay
+
     def decorator(func: Callable) -> Callable:
+        operation = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                metrics.record(operation, 'calls')
+                retries = 0
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        retries += 1
+                        delay = should_retry(operation, retries, e)
+                        if delay is None:
+                            raise
+                        await asyncio.sleep(delay)
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
+            metrics.record(operation, 'calls')
             retries = 0
             while True:
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
                     retries += 1
-                    if retries > max_retries:
-                        logger.error(f"Превышено максимальное количество попыток ({max_retries}). Последняя ошибка: {str(e)}")
+                    delay = should_retry(operation, retries, e)
+                    if delay is None:
                         raise
-                    
-                    # Вычисляем задержку
-                    delay = min(base_delay * (exponential_base ** (retries - 1)), max_delay)
-                    
-                    # Добавляем случайное отклонение если включен jitter
-                    if jitter:
-                        delay = delay * (0.5 + random.random())
-                    
-                    logger.warning(f"Попытка {retries} из {max_retries} не удалась. "
-                                f"Ожидание {delay:.2f} секунд перед следующей попыткой. "
-                                f"Ошибка: {str(e)}")
-                    
                     time.sleep(delay)
-            
+
         return wrapper
     return decorator
@@ -0,0 +1,171 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from typing import Dict, Optional
+from app.utils.settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket в памяти процесса
+
+    acquire() резервирует токен и спит ровно до момента, когда он станет
+    доступен, поэтому запросы идут с разрешенной частотой без всплесков и
+    повторных проверок. pause() останавливает выдачу токенов (например, по
+    Retry-After из ответа 429).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: Токенов (запросов) в секунду, 0 - без ограничения
+            capacity: Размер корзины - сколько запросов можно отправить подряд
+                      после простоя (по умолчанию 1)
+        """
+        self.rate = rate
+        self.capacity = capacity or 1.0
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._blocked_until = 0.0
+
+    def acquire(self) -> float:
+        """Блокирует поток до получения токена, возвращает время ожидания в секундах"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._tokens, self._updated, wait = _reserve(
+                self._tokens, self._updated, self._blocked_until, self.rate, self.capacity, time.time())
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Не выдает токены ближайшие seconds секунд и сбрасывает накопленный запас"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+class SQLiteTokenBucket:
+    """
+    Token bucket, состояние которого хранится в файле SQLite
+
+    Несколько процессов (веб-приложение, воркеры, скрипты) с одним путем к
+    базе делят общий лимит: резервирование выполняется в транзакции
+    BEGIN IMMEDIATE, которая сериализует доступ к строке корзины.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, path: str, key: str, rate: float, capacity: Optional[float] = None):
+        self.path = path
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity or 1.0
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3-соединение нельзя делить между потоками: одно на поток и файл
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(self.path)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS token_bucket ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, '
+                'blocked_until REAL NOT NULL DEFAULT 0)'
+            )
+            connections[self.path] = connection
+        return connection
+
+    def _update(self, change):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = connection.execute(
+                'SELECT tokens, updated, blocked_until FROM token_bucket WHERE key = ?', (self.key,)
+            ).fetchone()
+            tokens, updated, blocked_until = row if row else (self.capacity, now, 0.0)
+            tokens, updated, blocked_until, result = change(tokens, updated, blocked_until, now)
+            connection.execute(
+                'INSERT OR REPLACE INTO token_bucket (key, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)',
+                (self.key, tokens, updated, blocked_until)
+            )
+            connection.execute('COMMIT')
+            return result
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def acquire(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+
+        def reserve(tokens, updated, blocked_until, now):
+            tokens, updated, wait = _reserve(tokens, updated, blocked_until, self.rate, self.capacity, now)
+            return tokens, updated, blocked_until, wait
+
+        wait = self._update(reserve)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        def block(tokens, updated, blocked_until, now):
+            return min(tokens, 0.0), updated, max(blocked_until, now + seconds), None
+
+        self._update(block)
+
+def _reserve(tokens, updated, blocked_until, rate, capacity, now):
+    """
+    Пополняет корзину на момент now и резервирует один токен
+
+    Returns:
+        (остаток токенов, момент пересчета, сколько ждать до токена)
+    """
+    start = max(now, blocked_until)
+    tokens = min(capacity, tokens + max(start - updated, 0.0) * rate)
+    tokens -= 1.0
+    wait = (start - now) + (-tokens / rate if tokens < 0 else 0.0)
+    return tokens, max(start, updated), wait
+
+_buckets: Dict[str, object] = {}
+_buckets_lock = threading.Lock()
+
+def bucket_key(family: str, token: Optional[str] = None) -> str:
+    """Ключ корзины: семейство API и отпечаток OAuth-токена (сам токен не сохраняется)"""
+    if not token:
+        return family
+    return f"{family}:{hashlib.sha256(token.encode()).hexdigest()[:16]}"
+
+def get_token_bucket(family: str, token: Optional[str] = None):
+    """
+    Возвращает общую корзину для семейства API и OAuth-токена
+
+    Частота берется из настройки API_RATE_LIMITS[family]; при
+    RATE_LIMIT_BACKEND = 'sqlite' состояние делится между процессами через
+    файл RATE_LIMIT_DB_PATH.
+    """
+    key = bucket_key(family, token)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            rate = (get_setting('API_RATE_LIMITS') or {}).get(family, 0)
+            capacity = get_setting('RATE_LIMIT_BURST')
+            backend = get_setting('RATE_LIMIT_BACKEND')
+            if backend == 'sqlite':
+                path = get_setting('RATE_LIMIT_DB_PATH')
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                bucket = SQLiteTokenBucket(path, key, rate, capacity)
+            else:
+                bucket = TokenBucket(rate, capacity)
+            logger.info(f"Создан ограничитель '{key}': {rate} запросов/сек ({backend})")
+            _buckets[key] = bucket
+        return bucket
@@ -0,0 +1,15 @@
+from typing import Any
+from flask import current_app, has_app_context
+from config import Config
+
+def get_setting(name: str) -> Any:
+    """
+    Значение настройки из конфигурации текущего приложения
+
+    Внутри контекста приложения читается current_app.config, поэтому действуют
+    переопределения create_app(config_class=...); вне контекста (скрипты без
+    приложения) - значение по умолчанию из Config.
+    """
+    if has_app_context():
+        return current_app.config.get(name, getattr(Config, name, None))
+    return getattr(Config, name, None)
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from app.utils.settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+def make_key(*parts: Any) -> str:
+    """Ключ кэша из частей запроса (эндпоинт, тело, отпечаток токена и т.п.)"""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def token_fingerprint(token: Optional[str]) -> str:
+    """Отпечаток OAuth-токена для ключа: данные разных токенов не смешиваются"""
+    return hashlib.sha256((token or '').encode()).hexdigest()[:16]
+
+def expires_for_window(date_to: date, today_ttl: Optional[float] = None,
+                       now: Optional[datetime] = None) -> float:
+    """
+    Момент устаревания ответа за окно дат, заканчивающееся date_to
+
+    Статистика Яндекса подневная: окно, захватывающее сегодняшний день, живет
+    до полуночи (или today_ttl секунд, если данные текущего дня пополняются),
+    окно целиком в прошлом - YANDEX_CACHE_HISTORY_TTL.
+    """
+    now = now or datetime.now()
+    if date_to >= now.date():
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time()).timestamp()
+        if today_ttl is not None:
+            return min(midnight, now.timestamp() + today_ttl)
+        return midnight
+    return now.timestamp() + get_setting('YANDEX_CACHE_HISTORY_TTL')
+
+class ResponseCache:
+    """
+    Кэш ответов API: LRU в памяти и необязательный второй уровень в SQLite
+
+    Значения - JSON-совместимые объекты. Второй уровень общий для процессов
+    с одним путем к файлу и переживает перезапуск.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, max_entries: int = 1000, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = path
+        self._memory: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(self.path)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            connections[self.path] = connection
+        return connection
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            self._stats[field] += 1
+
+    def _remember(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+
+        if self.path:
+            try:
+                row = self._connection().execute(
+                    'SELECT value, expires_at FROM response_cache WHERE key = ? AND expires_at > ?', (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка чтения кэша ответов: {e}")
+                row = None
+            if row:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self._count('disk_hits')
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        self._remember(key, value, expires_at)
+        self._count('stores')
+        if self.path:
+            try:
+                connection = self._connection()
+                with connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                        (key, json.dumps(value, ensure_ascii=False), expires_at)
+                    )
+                    connection.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),))
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка записи кэша ответов: {e}")
+
+    def fetch(self, key: str, loader: Callable[[], Any], expires_at: float) -> Any:
+        """Значение из кэша или результат loader(); None (ошибка запроса) не кэшируется"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value, expires_at)
+        return value
+
+    def get_window(self, base_key: str, date_from: date, date_to: date) -> Optional[List[Dict[str, Any]]]:
+        """
+        Строки с полем 'date' за окно [date_from, date_to] из ранее сохраненного окна
+
+        Попадание засчитывается, если сохраненное окно целиком покрывает
+        запрошенное: пересекающиеся выгрузки (бэкфилл, повторный отчет)
+        обслуживаются локально фильтрацией по дате.
+        """
+        cached = self.get(base_key)
+        if not cached:
+            return None
+        if cached['date_from'] > date_from.isoformat() or cached['date_to'] < date_to.isoformat():
+            return None
+        low, high = date_from.isoformat(), date_to.isoformat()
+        return [row for row in cached['rows'] if low <= row['date'][:10] <= high]
+
+    def set_window(self, base_key: str, date_from: date, date_to: date, rows: List[Dict[str, Any]],
+                   today_ttl: Optional[float] = None) -> None:
+        """Сохраняет строки окна, если оно не покрыто уже сохраненным окном"""
+        with self._lock:
+            entry = self._memory.get(base_key)
+        if entry is not None and entry[0] > time.time():
+            cached = entry[1]
+            if cached['date_from'] <= date_from.isoformat() and cached['date_to'] >= date_to.isoformat():
+                return
+        self.set(base_key, {
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'rows': rows
+        }, expires_for_window(date_to, today_ttl))
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            connection = self._connection()
+            with connection:
+                connection.execute('DELETE FROM response_cache')
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Общий для процесса кэш ответов или None, если кэш отключен (YANDEX_CACHE_ENABLED)"""
+    global _cache
+    if not get_setting('YANDEX_CACHE_ENABLED'):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            path = get_setting('YANDEX_CACHE_PATH')
+            max_entries = get_setting('YANDEX_CACHE_MAX_ENTRIES')
+            if path:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            _cache = ResponseCache(max_entries, path)
+            logger.info(f"Кэш ответов API: {max_entries} записей в памяти, диск: {path or 'нет'}")
+        return _cache
@@ -1,6 +1,7 @@
 import requests
 import logging
 from flask import current_app
+from .session import request as pooled_request
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +20,8 @@ class YandexMetrikaAPI:
         logger.info(f"Начало валидации счетчика Метрики {counter_id}")
         try:
             logger.info(f"Отправка запроса к API Метрики для счетчика {counter_id}")
-            response = requests.get(
+            response = pooled_request(
+                'GET',
                 f'{self.BASE_URL}/counter/{counter_id}',
                 headers=self.headers
             )
@@ -77,7 +79,7 @@ class YandexMetrikaAPI:
                 
             current_app.logger.info(f"Запрос к Метрике: {url} с параметрами {params}")
             
-            response = requests.get(url, params=params, headers=self.headers)
+            response = pooled_request('GET', url, params=params, headers=self.headers)
             response.raise_for_status()
             
             data = response.json()
@@ -0,0 +1,88 @@
+import threading
+import logging
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from app.utils.settings import get_setting
+from app.utils.rate_limiter import get_token_bucket
+from app.utils.backoff import parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# Семейства API по хосту: у каждого свой лимит запросов на OAuth-токен
+API_FAMILIES = {
+    'api.webmaster.yandex.net': 'webmaster',
+    'api-metrika.yandex.net': 'metrika',
+}
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+def _build_session() -> requests.Session:
+    """
+    Создает сессию с пулом keep-alive соединений
+
+    Транспорт не повторяет запросы: повторы (сеть, 429, 5xx) выполняет только
+    exponential_backoff клиентов, чтобы они учитывались в бюджете задачи и метриках.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=get_setting('YANDEX_HTTP_POOL_SIZE'),
+        max_retries=0
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session(url: str) -> requests.Session:
+    """
+    Возвращает общую для процесса сессию для хоста из url
+
+    На каждый хост API создается одна сессия, поэтому TCP/TLS соединения
+    переиспользуются между запросами и потоками.
+    """
+    host = urlsplit(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            logger.info(f"Создан пул HTTP-соединений для {host} (размер {get_setting('YANDEX_HTTP_POOL_SIZE')})")
+            session = _sessions[host] = _build_session()
+        return session
+
+def _oauth_token(headers) -> Optional[str]:
+    authorization = (headers or {}).get('Authorization', '')
+    return authorization[len('OAuth '):] if authorization.startswith('OAuth ') else None
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Аналог requests.request через пул соединений с таймаутом по умолчанию
+
+    Запросы к API Яндекса заранее ограничиваются token bucket семейства API и
+    OAuth-токена. Ответ 429 приостанавливает корзину на Retry-After (ее делят
+    все потоки и, при общем бэкенде, процессы) и возвращается вызывающему:
+    повтор запроса - дело exponential_backoff.
+    """
+    kwargs.setdefault('timeout', get_setting('YANDEX_HTTP_TIMEOUT'))
+    family = API_FAMILIES.get(urlsplit(url).netloc)
+    if family is None:
+        return get_session(url).request(method, url, **kwargs)
+
+    bucket = get_token_bucket(family, _oauth_token(kwargs.get('headers')))
+    bucket.acquire()
+    response = get_session(url).request(method, url, **kwargs)
+    if response.status_code == 429:
+        pause = parse_retry_after(response.headers.get('Retry-After'))
+        if pause is None:
+            pause = get_setting('YANDEX_HTTP_429_PAUSE')
+        logger.warning(f"{family}: 429 Too Many Requests, корзина приостановлена на {pause:.1f} с")
+        bucket.pause(pause)
+    return response
+
+def close_sessions() -> None:
+    """Закрывает все сессии пула (например, перед завершением процесса)"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -3,13 +3,23 @@ import logging
 import math
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, Dict, Any, List
+from typing import Optional, Tuple, Dict, Any, List, Iterator, Callable
 from flask import current_app
+from .session import request as pooled_request
+from app.utils.backoff import FatalError, exponential_backoff, RETRYABLE_STATUS_CODES
+from .cache import get_response_cache, make_key, token_fingerprint, expires_for_window
 
 logger = logging.getLogger(__name__)
 
+def normalize_query(query: str) -> str:
+    """Приводит поисковый запрос к виду для сопоставления: нижний регистр, одиночные пробелы"""
+    return ' '.join(query.lower().split())
+
 class YandexWebmasterAPI:
     BASE_URL = "https://api.webmaster.yandex.net/v4"
+    QUERY_ANALYTICS_PAGE_SIZE = 500
+    # Глубина подневной статистики query-analytics
+    MAX_HISTORY_DAYS = 365
     
     def __init__(self, *, oauth_token: str, user_id: str):
         """
@@ -20,19 +30,36 @@ class YandexWebmasterAPI:
             user_id: ID пользователя в Яндекс.Вебмастере
         """
         self.user_id = user_id
+        self._token_fingerprint = token_fingerprint(oauth_token)
         self.headers = {
             "Authorization": f"OAuth {oauth_token}",
             "Content-Type": "application/json"
         }
         logger.info(f"Инициализация YandexWebmasterAPI для user_id: {user_id}")
     
+    @exponential_backoff(max_retries=4, name='webmaster')
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Отправляет запрос с повтором временных ошибок (сеть, 429, 5xx)"""
+        response = pooled_request(method, url, headers=self.headers, **kwargs)
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            response.raise_for_status()
+        return response
+
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Dict[str, Any]]:
-        """Выполняет запрос к API с обработкой ошибок"""
+        """
+        Выполняет запрос к API с обработкой ошибок
+        
+        Возвращает None при ошибке запроса (в том числе после исчерпания
+        повторов); при 401/403 выбрасывает FatalError.
+        """
         url = f"{self.BASE_URL}{endpoint}"
         logger.info(f"Отправка {method} запроса к: {url}")
         
         try:
-            response = requests.request(method, url, headers=self.headers, **kwargs)
+            response = self._send(method, url, **kwargs)
+            if response.status_code in (401, 403):
+                # Неверный токен или нет доступа к хосту: повторы и остальные запросы бесполезны
+                raise FatalError(f"Нет доступа к API Вебмастера: {response.status_code}", response.status_code)
             if response.status_code != 200:
                 error_msg = f"Ошибка при запросе к API: {response.status_code}"
                 try:
@@ -50,44 +77,43 @@ class YandexWebmasterAPI:
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка при запросе к API: {e}")
             return None
+
+    def _cached_request(self, method: str, endpoint: str, date_to, **kwargs) -> Optional[Dict[str, Any]]:
+        """
+        _make_request с кэшем ответа по эндпоинту и телу запроса
+
+        Ответ хранится, пока не устареет окно статистики, заканчивающееся date_to;
+        ошибки (None) не кэшируются.
+        """
+        cache = get_response_cache()
+        if cache is None:
+            return self._make_request(method, endpoint, **kwargs)
+        key = make_key('webmaster', self._token_fingerprint, method, endpoint, kwargs)
+        return cache.fetch(key, lambda: self._make_request(method, endpoint, **kwargs), expires_for_window(date_to))
     
-    def get_keywords_positions(self, host_url: str, keywords: List[str]) -> Dict[str, Tuple[Optional[float], Optional[str]]]:
+    def _query_position_entries(self, host_id: str, query: str, date_from,
+                                region_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
         """
-        Получает позиции для списка ключевых слов
+        Запрашивает статистику одного запроса и возвращает ее записи POSITION
+        
+        Записи кэшируются по хосту и запросу вместе с окном дат: запрос окна,
+        которое покрыто уже выгруженным (повторный запуск, бэкфилл), не идет в API.
         
         Args:
-            host_url: URL хоста (используется как host_id)
-            keywords: Список ключевых слов
-            
-        Returns:
-            Dict[str, Tuple[float, str]]: Словарь {ключевое слово: (позиция, дата)}
+            host_id: ID хоста
+            query: Поисковый запрос
+            date_from: Начальная дата выборки
+            region_ids: Коды регионов Яндекса (None - все регионы)
         """
-        logger.info(f"Получение позиций для {len(keywords)} ключевых слов на хосте {host_url}")
-        
-        # Используем host_url как host_id
-        host_id = host_url
-        
-        # Получаем позиции для каждого ключевого слова
-        results = {}
-        for keyword in keywords:
-            try:
-                position, date = self.get_keyword_position(host_id, keyword)
-                if position is not None:
-                    results[keyword] = (position, date)
-                else:
-                    logger.warning(f"Не удалось получить позицию для '{keyword}'")
-            except Exception as e:
-                logger.error(f"Ошибка при получении позиции для '{keyword}': {e}")
-                
-        return results
-
-    def get_keyword_position(self, host_id: str, query: str) -> Tuple[Optional[float], Optional[str]]:
-        """Получает позицию ключевого слова"""
-        logger.info(f"Получение позиции для запроса '{query}' на хосте {host_id}")
-        
-        # Определяем диапазон дат (последние 7 дней)
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=6)
+        cache = get_response_cache()
+        today = datetime.now().date()
+        cache_key = make_key('webmaster', 'position_entries', self._token_fingerprint, self.user_id, host_id, query,
+                             sorted(region_ids or []))
+        if cache is not None:
+            cached = cache.get_window(cache_key, date_from, today)
+            if cached is not None:
+                logger.info(f"Позиции запроса '{query}' с {date_from} взяты из кэша")
+                return cached
         
         url = f"/user/{self.user_id}/hosts/{host_id}/query-analytics/list"
         params = {
@@ -103,11 +129,13 @@ class YandexWebmasterAPI:
                 ]
             },
             "sort_by_date": {
-                "date": start_date.strftime("%Y-%m-%d"),
+                "date": date_from.strftime("%Y-%m-%d"),
                 "statistic_field": "IMPRESSIONS",
                 "by": "ASC"
             }
         }
+        if region_ids:
+            params["region_ids"] = list(region_ids)
         
         # Логируем запрос для отладки
         logger.info(f"API запрос: POST {url}")
@@ -117,35 +145,213 @@ class YandexWebmasterAPI:
         if not data or 'text_indicator_to_statistics' not in data:
             logger.warning(f"Нет данных по запросу '{query}' в ответе API")
             logger.warning(f"Ответ API: {data}")
-            return None, None
+            return []
             
+        # Сопоставление как в get_daily_positions_bulk: без учета регистра и лишних пробелов
+        key = normalize_query(query)
         positions = [stat for stat in data['text_indicator_to_statistics']
-                    if stat['text_indicator']['value'] == query]
+                    if normalize_query(stat['text_indicator']['value']) == key]
                     
+        position_entries = []
         if not positions:
             logger.warning(f"Позиция для запроса '{query}' не найдена в данных API")
-            return None, None
+        else:
+            position_entries = [entry for entry in positions[0]['statistics'] if entry['field'] == 'POSITION']
+            if not position_entries:
+                logger.warning(f"Нет данных о позициях для запроса '{query}'")
+        
+        # Пустой ответ тоже сохраняется: до обновления статистики он не изменится
+        if cache is not None:
+            cache.set_window(cache_key, date_from, today, position_entries)
+        return position_entries
+
+    def get_daily_positions_bulk(self, host_id: str, keywords: List[str], date_from,
+                                 region_ids: Optional[List[int]] = None,
+                                 on_page: Optional[Callable[[Dict[str, List[Tuple[Any, float]]]], None]] = None
+                                 ) -> Dict[str, List[Tuple[Any, float]]]:
+        """
+        Получает подневные позиции списка ключевых слов одним постраничным проходом
+        
+        Количество запросов зависит от числа страниц query-analytics хоста в
+        регионе, а не от числа ключевых слов; проход заканчивается, как только
+        найдены все слова.
+        
+        Args:
+            host_id: ID хоста
+            keywords: Ключевые слова
+            date_from: Первый день подневных данных
+            region_ids: Коды регионов Яндекса (None - все регионы)
+            on_page: Вызывается после каждой страницы со словами, найденными на ней
+                ({ключевое слово: [(дата, позиция), ...]}, может быть пустым);
+                исключение из on_page прерывает выгрузку
+            
+        Returns:
+            {ключевое слово: [(дата, позиция), ...]} для слов, по которым есть данные
+        """
+        # Индекс {нормализованный запрос: [исходные ключевые слова]}
+        index: Dict[str, List[str]] = {}
+        for keyword in keywords:
+            index.setdefault(normalize_query(keyword), []).append(keyword)
+        
+        results = {}
+        page_results = {}
+        pending = set(index)
+        
+        def page_done():
+            if on_page is not None:
+                on_page(dict(page_results))
+            page_results.clear()
+        
+        for stat in self.iter_query_analytics(host_id, date_from, region_ids=region_ids, on_page=page_done):
+            key = normalize_query(stat['text_indicator']['value'])
+            if key not in pending:
+                continue
+            pending.discard(key)
             
-        position_data = positions[0]['statistics']
-        position_entries = [entry for entry in position_data if entry['field'] == 'POSITION']
+            daily = self._daily_positions(stat['statistics'], date_from)
+            if daily:
+                for keyword in index[key]:
+                    results[keyword] = daily
+                    page_results[keyword] = daily
+            # Все отслеживаемые слова найдены - остальные страницы не нужны
+            if not pending:
+                break
+        # При досрочном выходе последняя страница еще не передана в on_page
+        if page_results:
+            page_done()
+        
+        logger.info(f"Подневные позиции (регионы {region_ids or 'все'}): найдены для {len(results)} "
+                    f"из {len(keywords)} ключевых слов")
+        return results
+
+    @staticmethod
+    def _daily_positions(statistics: List[Dict[str, Any]], date_from) -> List[Tuple[Any, float]]:
+        """Подневные значения POSITION начиная с date_from, отсортированные по дате"""
+        daily = {}
+        for entry in statistics:
+            if entry.get('field', 'POSITION') != 'POSITION' or entry.get('value') is None:
+                continue
+            day = datetime.strptime(entry['date'][:10], '%Y-%m-%d').date()
+            if day >= date_from:
+                daily[day] = float(entry['value'])
+        return sorted(daily.items())
+
+    def get_keyword_position_history(self, host_id: str, query: str, periods_count: int,
+                                     period_days: int = 7, end_date=None,
+                                     region_ids: Optional[List[int]] = None) -> List[Tuple[float, Any, Any]]:
+        """
+        Получает историю позиций ключевого слова за несколько периодов одним запросом
         
-        if not position_entries:
-            logger.warning(f"Нет данных о позициях для запроса '{query}'")
-            return None, None
+        Ответ query-analytics содержит подневную серию статистики, поэтому весь
+        диапазон запрашивается один раз, а средние по периодам считаются локально.
+        
+        Args:
+            host_id: ID хоста
+            query: Поисковый запрос
+            periods_count: Количество периодов (не больше MAX_HISTORY_DAYS в сумме)
+            period_days: Длина периода в днях
+            end_date: Последний день последнего периода (по умолчанию сегодня)
+            region_ids: Коды регионов Яндекса (None - все регионы)
             
-        # Берем последние 7 дней и считаем среднее
-        position_entries_sorted = sorted(position_entries, key=lambda x: x['date'], reverse=True)[:7]
-        positions_values = [entry['value'] for entry in position_entries_sorted]
+        Returns:
+            Список (средняя позиция, начало периода, конец периода) от нового к старому,
+            периоды без данных пропускаются
+        """
+        end_date = end_date or datetime.now().date()
+        periods_count = min(periods_count, self.MAX_HISTORY_DAYS // period_days)
+        start_date = end_date - timedelta(days=periods_count * period_days - 1)
+        logger.info(f"Получение истории позиций для '{query}' с {start_date} по {end_date} ({periods_count} периодов)")
+        
+        position_entries = self._query_position_entries(host_id, query, start_date, region_ids)
+        return self.bucket_positions(position_entries, end_date, periods_count, period_days)
+
+    @staticmethod
+    def bucket_positions(position_entries: List[Dict[str, Any]], end_date, periods_count: int,
+                         period_days: int = 7) -> List[Tuple[float, Any, Any]]:
+        """
+        Группирует подневные значения POSITION по периодам, заканчивающимся end_date
+        
+        Returns:
+            Список (средняя позиция, начало периода, конец периода) от нового к старому
+        """
+        if not position_entries or periods_count <= 0:
+            return []
+        
+        dates = np.array([entry['date'][:10] for entry in position_entries], dtype='datetime64[D]')
+        values = np.array([entry['value'] for entry in position_entries], dtype=float)
+        
+        # Номер периода, считая от end_date назад: 0 - последний период
+        offsets = (np.datetime64(end_date, 'D') - dates).astype(int)
+        mask = (offsets >= 0) & (offsets < periods_count * period_days) & ~np.isnan(values)
+        buckets = offsets[mask] // period_days
+        
+        sums = np.bincount(buckets, weights=values[mask], minlength=periods_count)
+        counts = np.bincount(buckets, minlength=periods_count)
+        
+        results = []
+        for bucket in np.flatnonzero(counts):
+            period_end = end_date - timedelta(days=int(bucket) * period_days)
+            period_start = period_end - timedelta(days=period_days - 1)
+            results.append((float(sums[bucket] / counts[bucket]), period_start, period_end))
+        return results
+
+    def iter_query_analytics(self, host_id: str, date_from, text_contains: Optional[str] = None,
+                             region_ids: Optional[List[int]] = None,
+                             on_page: Optional[Callable[[], None]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Постранично выгружает статистику query-analytics хоста
         
-        if not positions_values:
-            logger.warning(f"Нет значений позиций для запроса '{query}'")
-            return None, None
+        Args:
+            host_id: ID хоста
+            date_from: Дата, по которой сортируется выдача
+            text_contains: Подстрока для фильтра TEXT_CONTAINS (None - все запросы)
+            region_ids: Коды регионов Яндекса (None - все регионы)
+            on_page: Вызывается после того, как отдана очередная страница, до
+                запроса следующей; исключение из on_page прерывает выгрузку
             
-        position_avg = np.mean(positions_values)
-        date_range = f"{start_date.strftime('%d.%m')} - {end_date.strftime('%d.%m')}"
+        Yields:
+            Элементы text_indicator_to_statistics
+        """
+        url = f"/user/{self.user_id}/hosts/{host_id}/query-analytics/list"
+        params = {
+            "offset": 0,
+            "limit": self.QUERY_ANALYTICS_PAGE_SIZE,
+            "text_indicator": "QUERY",
+            "sort_by_date": {
+                "date": date_from.strftime("%Y-%m-%d"),
+                "statistic_field": "IMPRESSIONS",
+                "by": "DESC"
+            }
+        }
+        if text_contains:
+            params["filters"] = {
+                "text_filters": [
+                    {
+                        "text_indicator": "QUERY",
+                        "operation": "TEXT_CONTAINS",
+                        "value": text_contains
+                    }
+                ]
+            }
+        if region_ids:
+            params["region_ids"] = list(region_ids)
         
-        logger.info(f"Средняя позиция для '{query}': {position_avg} за период {date_range}")
-        return position_avg, date_range
+        today = datetime.now().date()
+        while True:
+            data = self._cached_request("POST", url, today, json=params)
+            if not data or 'text_indicator_to_statistics' not in data:
+                logger.warning(f"Нет данных query-analytics для хоста {host_id} (offset {params['offset']})")
+                return
+            
+            page = data['text_indicator_to_statistics']
+            yield from page
+            if on_page is not None:
+                on_page()
+            
+            params["offset"] += len(page)
+            total = data.get('count')
+            if len(page) < self.QUERY_ANALYTICS_PAGE_SIZE or (total is not None and params["offset"] >= total):
+                return
 
     def validate_host(self, host_url: str) -> Tuple[bool, str]:
         """
@@ -164,7 +370,8 @@ class YandexWebmasterAPI:
             endpoint = f'/user/{self.user_id}/hosts/{host_url}'
             logger.info(f"Отправка GET запроса к {self.BASE_URL}{endpoint}")
             
-            response = requests.get(
+            response = pooled_request(
+                'GET',
                 f"{self.BASE_URL}{endpoint}",
                 headers=self.headers
             )
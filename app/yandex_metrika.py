@@ -1,74 +1,125 @@
 import requests
 import logging
-from datetime import datetime, timedelta
-import backoff
+from datetime import datetime
+from urllib.parse import urlsplit
+from app.yandex.session import request as pooled_request
+from app.utils.backoff import exponential_backoff
+from app.yandex.cache import get_response_cache, make_key, token_fingerprint
+from app.utils.settings import get_setting
 
 logger = logging.getLogger(__name__)
 
+def normalize_url(url):
+    """
+    Приводит URL к ключу для сопоставления со startURL Метрики
+
+    Схема, www., параметры запроса, якорь и завершающий слеш не учитываются,
+    поэтому визиты с UTM-метками попадают на ту же страницу.
+    """
+    parts = urlsplit(url if '//' in url else f'//{url}')
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    path = parts.path.rstrip('/') or '/'
+    return f'{host}{path}'
+
 class YandexMetrikaAPI:
+    # Максимальный размер страницы отчета stat/v1/data
+    REPORT_PAGE_SIZE = 100000
+
     def __init__(self, oauth_token):
         self.oauth_token = oauth_token
         self.base_url = "https://api-metrika.yandex.net/stat/v1/data"
 
-    @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=5)
+    @exponential_backoff(max_retries=4, name='metrika')
     def _make_request(self, params):
-        """Выполняет запрос к API с автоматическим повтором при ошибках"""
+        """Выполняет запрос к API с повтором временных ошибок (сеть, 429, 5xx)"""
         headers = {"Authorization": f"OAuth {self.oauth_token}"}
         
         try:
-            response = requests.get(self.base_url, headers=headers, params=params)
+            response = pooled_request('GET', self.base_url, headers=headers, params=params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             logger.error(f"Error making request to Metrika API: {str(e)}")
             raise
 
-    def get_traffic_data(self, counter_id, urls):
-        """Получает данные о трафике для списка URL"""
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=6)
+    def iter_start_url_traffic(self, counter_id, date1, date2, metric='ym:s:users'):
+        """
+        Постранично выгружает отчет счетчика по страницам входа и дням
+        
+        Один отчет с измерениями ym:s:startURL и ym:s:date заменяет отдельные
+        запросы с фильтром по каждому URL. Полностью выгруженный отчет
+        кэшируется по счетчику и метрике: окно дат, покрытое уже выгруженным,
+        отдается из кэша.
+        
+        Yields:
+            (startURL, дата, значение метрики)
+        """
+        cache = get_response_cache()
+        cache_key = make_key('metrika', 'start_url_traffic', token_fingerprint(self.oauth_token), counter_id, metric)
+        if cache is not None:
+            cached = cache.get_window(cache_key, date1, date2)
+            if cached is not None:
+                logger.info(f"Отчет Метрики по счетчику {counter_id} с {date1} по {date2} взят из кэша")
+                for row in cached:
+                    yield row['url'], datetime.strptime(row['date'], '%Y-%m-%d').date(), row['value']
+                return
+        
+        rows = []
+        for start_url, day, value in self._iter_start_url_pages(counter_id, date1, date2, metric):
+            rows.append({'url': start_url, 'date': day.isoformat(), 'value': value})
+            yield start_url, day, value
+        if cache is not None:
+            cache.set_window(cache_key, date1, date2, rows, today_ttl=get_setting('METRIKA_CACHE_TODAY_TTL'))
+
+    def _iter_start_url_pages(self, counter_id, date1, date2, metric):
+        """Постраничная выгрузка отчета по страницам входа и дням из API"""
+        params = {
+            'ids': counter_id,
+            'metrics': metric,
+            'dimensions': 'ym:s:startURL,ym:s:date',
+            'date1': date1.strftime('%Y-%m-%d'),
+            'date2': date2.strftime('%Y-%m-%d'),
+            'accuracy': 'full',
+            'offset': 1,  # В Метрике строки нумеруются с 1
+            'limit': self.REPORT_PAGE_SIZE
+        }
         
-        traffic_data = {}
+        while True:
+            data = self._make_request(params)
+            rows = data.get('data') or []
+            for row in rows:
+                start_url = row['dimensions'][0]['name']
+                day = datetime.strptime(row['dimensions'][1]['name'], '%Y-%m-%d').date()
+                yield start_url, day, row['metrics'][0]
+            
+            params['offset'] += len(rows)
+            total = data.get('total_rows')
+            if len(rows) < self.REPORT_PAGE_SIZE or (total is not None and params['offset'] > total):
+                return
+
+    def get_daily_traffic_bulk(self, counter_id, urls, date1, date2, metric='ym:s:users'):
+        """
+        Получает подневный трафик для списка URL одним отчетом по счетчику
+        
+        Returns:
+            {url: {дата: значение}} для URL из urls, по которым были визиты
+        """
+        index = {}
         for url in urls:
-            try:
-                params = {
-                    'ids': counter_id,
-                    'metrics': 'ym:s:users',
-                    'dimensions': 'ym:s:date',
-                    'filters': f"ym:s:startURL=='{url}'",
-                    'date1': start_date.strftime('%Y-%m-%d'),
-                    'date2': end_date.strftime('%Y-%m-%d'),
-                    'limit': 10000
-                }
-                
-                data = self._make_request(params)
-                
-                if 'data' in data:
-                    # Собираем данные по дням
-                    daily_data = []
-                    for row in data['data']:
-                        date = datetime.strptime(row['dimensions'][0]['name'], '%Y-%m-%d').date()
-                        visitors = row['metrics'][0]
-                        daily_data.append((date, visitors))
-                    
-                    # Сортируем по дате
-                    daily_data.sort(key=lambda x: x[0])
-                    
-                    # Вычисляем среднее количество посетителей
-                    if daily_data:
-                        avg_visitors = sum(visitors for _, visitors in daily_data) / len(daily_data)
-                        date_range = f"{start_date.strftime('%d.%m')} - {end_date.strftime('%d.%m')}"
-                        traffic_data[url] = (avg_visitors, date_range)
-                        continue
-                
-                logger.warning(f"No traffic data found for URL: {url}")
-                traffic_data[url] = (0, None)
-                
-            except Exception as e:
-                logger.error(f"Error getting traffic for URL '{url}': {str(e)}")
-                traffic_data[url] = (0, None)
+            index.setdefault(normalize_url(url), []).append(url)
+        
+        traffic = {}
+        rows_count = 0
+        for start_url, date, value in self.iter_start_url_traffic(counter_id, date1, date2, metric):
+            rows_count += 1
+            for url in index.get(normalize_url(start_url), ()):
+                daily = traffic.setdefault(url, {})
+                daily[date] = daily.get(date, 0) + value
         
-        return traffic_data
+        logger.info(f"Отчет Метрики: {rows_count} строк, трафик найден для {len(traffic)} из {len(urls)} URL")
+        return traffic
 
     def validate_counter(self, counter_id):
         """Проверяет доступность счетчика в Яндекс.Метрике"""
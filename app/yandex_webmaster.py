@@ -1,19 +1,28 @@
 import requests
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
-import backoff
+from app.yandex.session import request as pooled_request
+from app.utils.backoff import exponential_backoff
+from app.yandex.cache import get_response_cache, make_key, token_fingerprint, expires_for_window
 
 logger = logging.getLogger(__name__)
 
+# Кэш соответствия ascii_host_url -> host_id: {user_id: (expires_at, {host_url: host_id})}
+HOST_ID_CACHE_TTL = 24 * 60 * 60
+_host_id_cache = {}
+_host_id_cache_lock = threading.Lock()
+
 class YandexWebmasterAPI:
     def __init__(self, oauth_token, user_id):
         self.oauth_token = oauth_token
         self.user_id = user_id
         self.base_url = "https://api.webmaster.yandex.net/v4/user"
 
-    @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=5)
+    @exponential_backoff(max_retries=4, name='webmaster')
     def _make_request(self, method, endpoint, **kwargs):
-        """Выполняет запрос к API с автоматическим повтором при ошибках"""
+        """Выполняет запрос к API с повтором временных ошибок (сеть, 429, 5xx)"""
         url = f"{self.base_url}/{self.user_id}/{endpoint}"
         headers = {"Authorization": f"OAuth {self.oauth_token}"}
         
@@ -23,38 +32,70 @@ class YandexWebmasterAPI:
             kwargs['headers'] = headers
 
         try:
-            response = requests.request(method, url, **kwargs)
+            response = pooled_request(method, url, **kwargs)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             logger.error(f"Error making request to {endpoint}: {str(e)}")
             raise
 
+    def _cached_request(self, method, endpoint, date_to, **kwargs):
+        """_make_request с кэшем ответа по эндпоинту и телу запроса до устаревания окна date_to"""
+        cache = get_response_cache()
+        if cache is None:
+            return self._make_request(method, endpoint, **kwargs)
+        key = make_key('webmaster', token_fingerprint(self.oauth_token), self.user_id, method, endpoint, kwargs)
+        return cache.fetch(key, lambda: self._make_request(method, endpoint, **kwargs), expires_for_window(date_to))
+
+    def resolve_host_id(self, host_url):
+        """
+        Возвращает host_id для URL хоста
+        
+        Список хостов пользователя запрашивается один раз и кэшируется на
+        HOST_ID_CACHE_TTL секунд: host_id практически никогда не меняется.
+        """
+        now = time.monotonic()
+        with _host_id_cache_lock:
+            entry = _host_id_cache.get(self.user_id)
+        
+        if entry is None or entry[0] <= now:
+            hosts_response = self._make_request('GET', 'hosts')
+            mapping = {}
+            for host in hosts_response.get('hosts', []):
+                mapping[host['ascii_host_url']] = host['host_id']
+                # Допускаем, что в проекте уже указан сам host_id
+                mapping[host['host_id']] = host['host_id']
+            entry = (now + HOST_ID_CACHE_TTL, mapping)
+            with _host_id_cache_lock:
+                _host_id_cache[self.user_id] = entry
+            logger.info(f"Host ID cache refreshed for user {self.user_id}: {len(hosts_response.get('hosts', []))} hosts")
+        
+        return entry[1].get(host_url)
+
     def get_keywords_positions(self, host_url, keywords, date_from=None, date_to=None):
         """Получает позиции для списка ключевых слов"""
         if date_from is None or date_to is None:
             date_to = datetime.now().date()
             date_from = date_to - timedelta(days=6)
         
+        # Получаем ID хоста из URL один раз на весь список ключевых слов
+        try:
+            host_id = self.resolve_host_id(host_url)
+        except Exception as e:
+            logger.error(f"Error resolving host ID for URL '{host_url}': {str(e)}")
+            host_id = None
+        
+        if not host_id:
+            logger.error(f"Host ID not found for URL: {host_url}")
+            return {keyword: (None, None) for keyword in keywords}
+        
         positions = {}
         for keyword in keywords:
             try:
-                # Получаем ID хоста из URL
-                hosts_response = self._make_request('GET', 'hosts')
-                host_id = None
-                for host in hosts_response['hosts']:
-                    if host['ascii_host_url'] == host_url:
-                        host_id = host['host_id']
-                        break
-                
-                if not host_id:
-                    logger.error(f"Host ID not found for URL: {host_url}")
-                    positions[keyword] = (None, None)
-                    continue
-
-                data = self._make_request(
+                data = self._cached_request(
                     'POST',
                     f"hosts/{host_id}/query-analytics/list",
+                    date_to,
                     json={
                         "filters": {
                             "text_filters": [{
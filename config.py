@@ -17,3 +17,64 @@ class Config:
     
     # App settings
     APP_NAME = os.environ.get('APP_NAME', 'PROMIT SEO')
+
+    # Position updater settings
+    # Max parallel per-region pulls (no effect for single-region projects);
+    # also the default thread count of scripts/get_historical_positions.py
+    POSITIONS_UPDATE_WORKERS = int(os.environ.get('POSITIONS_UPDATE_WORKERS', 8))
+    POSITIONS_WRITE_CHUNK_SIZE = int(os.environ.get('POSITIONS_WRITE_CHUNK_SIZE', 1000))
+    WEBMASTER_REQUESTS_PER_SECOND = float(os.environ.get('WEBMASTER_REQUESTS_PER_SECOND', 5))
+
+    # Traffic updater settings
+    TRAFFIC_REFRESH_DAYS = int(os.environ.get('TRAFFIC_REFRESH_DAYS', 7))
+
+    # Yandex API HTTP connection pool settings
+    YANDEX_HTTP_POOL_SIZE = int(os.environ.get('YANDEX_HTTP_POOL_SIZE', 16))
+    YANDEX_HTTP_TIMEOUT = float(os.environ.get('YANDEX_HTTP_TIMEOUT', 30))
+    # Rate limiter pause after a 429 without Retry-After; retries are left to exponential_backoff
+    YANDEX_HTTP_429_PAUSE = float(os.environ.get('YANDEX_HTTP_429_PAUSE', 5))
+
+    # Proactive rate limiting: token bucket per API family and OAuth token.
+    # RATE_LIMIT_BACKEND=sqlite shares buckets between processes via RATE_LIMIT_DB_PATH
+    METRIKA_REQUESTS_PER_SECOND = float(os.environ.get('METRIKA_REQUESTS_PER_SECOND', 3))
+    API_RATE_LIMITS = {
+        'webmaster': WEBMASTER_REQUESTS_PER_SECOND,
+        'metrika': METRIKA_REQUESTS_PER_SECOND,
+    }
+    RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 1))
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB_PATH') or os.path.join(basedir, 'instance', 'rate_limits.db')
+
+    # Yandex API response cache: in-memory LRU plus optional SQLite tier (empty path disables it).
+    # Windows that include today expire at midnight (Metrika: after METRIKA_CACHE_TODAY_TTL seconds)
+    YANDEX_CACHE_ENABLED = os.environ.get('YANDEX_CACHE_ENABLED', '1') != '0'
+    YANDEX_CACHE_MAX_ENTRIES = int(os.environ.get('YANDEX_CACHE_MAX_ENTRIES', 1000))
+    YANDEX_CACHE_PATH = os.environ.get('YANDEX_CACHE_PATH', os.path.join(basedir, 'instance', 'yandex_cache.db'))
+    YANDEX_CACHE_HISTORY_TTL = int(os.environ.get('YANDEX_CACHE_HISTORY_TTL', 7 * 86400))
+    METRIKA_CACHE_TODAY_TTL = int(os.environ.get('METRIKA_CACHE_TODAY_TTL', 3600))
+
+    # Yandex region code assigned to keywords added without a region (213 - Moscow)
+    DEFAULT_REGION_CODE = int(os.environ.get('DEFAULT_REGION_CODE', 213))
+
+    # Report cache ('memory', 'sqlite' or 'none'); entries are keyed by the project data version
+    REPORT_CACHE_BACKEND = os.environ.get('REPORT_CACHE_BACKEND', 'memory')
+    REPORT_CACHE_MAX_ENTRIES = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 256))
+    REPORT_CACHE_PATH = os.environ.get('REPORT_CACHE_PATH') or os.path.join(basedir, 'instance', 'report_cache.db')
+    REPORT_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', 86400))
+
+    # Background job queue settings
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 5))
+    JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 600))
+    # Retry budget shared by all API calls of one job
+    JOB_RETRY_BUDGET = int(os.environ.get('JOB_RETRY_BUDGET', 50))
+    JOB_RETRY_MAX_SLEEP = float(os.environ.get('JOB_RETRY_MAX_SLEEP', 300))
+
+    # Scheduler settings (intervals in seconds, 0 disables the kind)
+    SCHEDULER_POSITIONS_INTERVAL = int(os.environ.get('SCHEDULER_POSITIONS_INTERVAL', 86400))
+    SCHEDULER_TRAFFIC_INTERVAL = int(os.environ.get('SCHEDULER_TRAFFIC_INTERVAL', 86400))
+    SCHEDULER_MAX_ACTIVE_JOBS = int(os.environ.get('SCHEDULER_MAX_ACTIVE_JOBS', 4))
+    SCHEDULER_TICK_INTERVAL = float(os.environ.get('SCHEDULER_TICK_INTERVAL', 60))
+
+    # Socket.IO message queue (e.g. redis://localhost:6379/0) so worker.py can emit progress events
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
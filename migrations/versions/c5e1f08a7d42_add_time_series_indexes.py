@@ -0,0 +1,65 @@
+"""Add composite indexes for position and traffic time series
+
+Revision ID: c5e1f08a7d42
+Revises: a3d31a6119c8
+Create Date: 2026-10-18 10:12:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1f08a7d42'
+down_revision = 'a3d31a6119c8'
+branch_labels = None
+depends_on = None
+
+
+def merge_duplicate_keywords():
+    """Оставляет по одному ключевому слову на (project_id, keyword), переносит позиции дублей"""
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+        "SELECT project_id, keyword, MIN(id) FROM keyword "
+        "GROUP BY project_id, keyword HAVING COUNT(*) > 1"
+    )).fetchall()
+
+    for project_id, keyword, keep_id in duplicates:
+        duplicate_ids = [row[0] for row in conn.execute(
+            sa.text("SELECT id FROM keyword WHERE project_id = :project_id AND keyword = :keyword AND id <> :keep_id"),
+            {'project_id': project_id, 'keyword': keyword, 'keep_id': keep_id}
+        )]
+        conn.execute(
+            sa.text("UPDATE keyword_position SET keyword_id = :keep_id WHERE keyword_id IN :ids")
+            .bindparams(sa.bindparam('ids', expanding=True)),
+            {'keep_id': keep_id, 'ids': duplicate_ids}
+        )
+        conn.execute(
+            sa.text("DELETE FROM keyword WHERE id IN :ids")
+            .bindparams(sa.bindparam('ids', expanding=True)),
+            {'ids': duplicate_ids}
+        )
+
+
+def upgrade():
+    merge_duplicate_keywords()
+
+    with op.batch_alter_table('keyword', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_keyword_project_id_keyword', ['project_id', 'keyword'])
+
+    with op.batch_alter_table('keyword_position', schema=None) as batch_op:
+        batch_op.create_index('ix_keyword_position_keyword_id_check_date', ['keyword_id', 'check_date'], unique=False)
+
+    with op.batch_alter_table('url_traffic', schema=None) as batch_op:
+        batch_op.create_index('ix_url_traffic_url_id_check_date', ['url_id', 'check_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('url_traffic', schema=None) as batch_op:
+        batch_op.drop_index('ix_url_traffic_url_id_check_date')
+
+    with op.batch_alter_table('keyword_position', schema=None) as batch_op:
+        batch_op.drop_index('ix_keyword_position_keyword_id_check_date')
+
+    with op.batch_alter_table('keyword', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_keyword_project_id_keyword', type_='unique')
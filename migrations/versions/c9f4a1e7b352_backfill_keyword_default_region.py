@@ -0,0 +1,38 @@
+"""Backfill default region for keywords
+
+Revision ID: c9f4a1e7b352
+Revises: b6e2f9d4c813
+Create Date: 2026-10-18 17:20:51.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9f4a1e7b352'
+down_revision = 'b6e2f9d4c813'
+branch_labels = None
+depends_on = None
+
+# Код региона по умолчанию (Москва), см. Config.DEFAULT_REGION_CODE
+DEFAULT_REGION_CODE = 213
+
+
+def upgrade():
+    region = sa.table('region', sa.column('id', sa.Integer), sa.column('name', sa.String), sa.column('code', sa.Integer))
+    keyword = sa.table('keyword', sa.column('region_id', sa.Integer))
+    connection = op.get_bind()
+
+    # Регион по умолчанию раньше создавался при открытии страницы проекта
+    exists = connection.execute(sa.select(region.c.id).where(region.c.code == DEFAULT_REGION_CODE)).first()
+    if exists is None:
+        op.bulk_insert(region, [{'name': 'Москва', 'code': DEFAULT_REGION_CODE}])
+
+    default_region = sa.select(region.c.id).where(region.c.code == DEFAULT_REGION_CODE).scalar_subquery()
+    op.execute(keyword.update().where(keyword.c.region_id.is_(None)).values(region_id=default_region))
+
+
+def downgrade():
+    # Заполненные регионы не отличить от выбранных пользователем, откатывать нечего
+    pass
@@ -0,0 +1,71 @@
+"""Store positions per keyword and region
+
+Revision ID: d5a8e2c7f614
+Revises: c9f4a1e7b352
+Create Date: 2026-10-18 18:03:27.551870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8e2c7f614'
+down_revision = 'c9f4a1e7b352'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('keyword_position', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('region_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_keyword_position_region_id_region', 'region', ['region_id'], ['id'])
+
+    # Существующие позиции получены для текущего региона ключевого слова
+    keyword = sa.table('keyword', sa.column('id', sa.Integer), sa.column('region_id', sa.Integer))
+    keyword_position = sa.table('keyword_position', sa.column('keyword_id', sa.Integer), sa.column('region_id', sa.Integer))
+    op.execute(
+        keyword_position.update().values(
+            region_id=sa.select(keyword.c.region_id).where(keyword.c.id == keyword_position.c.keyword_id).scalar_subquery()
+        )
+    )
+
+    # Регион входит в первичный ключ подневных позиций: таблица пересоздается с переносом данных
+    op.create_table('keyword_daily_position_new',
+    sa.Column('keyword_id', sa.Integer(), nullable=False),
+    sa.Column('region_id', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('position', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['keyword_id'], ['keyword.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('keyword_id', 'region_id', 'date')
+    )
+    op.execute(
+        'INSERT INTO keyword_daily_position_new (keyword_id, region_id, date, position) '
+        'SELECT d.keyword_id, COALESCE(k.region_id, 0), d.date, d.position '
+        'FROM keyword_daily_position d JOIN keyword k ON k.id = d.keyword_id'
+    )
+    op.drop_table('keyword_daily_position')
+    op.rename_table('keyword_daily_position_new', 'keyword_daily_position')
+
+
+def downgrade():
+    op.create_table('keyword_daily_position_old',
+    sa.Column('keyword_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('position', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['keyword_id'], ['keyword.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('keyword_id', 'date')
+    )
+    # Остаются данные текущего региона ключевого слова
+    op.execute(
+        'INSERT INTO keyword_daily_position_old (keyword_id, date, position) '
+        'SELECT d.keyword_id, d.date, d.position '
+        'FROM keyword_daily_position d JOIN keyword k ON k.id = d.keyword_id '
+        'WHERE d.region_id = COALESCE(k.region_id, 0)'
+    )
+    op.drop_table('keyword_daily_position')
+    op.rename_table('keyword_daily_position_old', 'keyword_daily_position')
+
+    with op.batch_alter_table('keyword_position', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_keyword_position_region_id_region', type_='foreignkey')
+        batch_op.drop_column('region_id')
@@ -0,0 +1,64 @@
+"""Enforce one active refresh job per project in the database
+
+Revision ID: e8b3f6a2d947
+Revises: d5a8e2c7f614
+Create Date: 2026-10-18 20:14:09.318572
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3f6a2d947'
+down_revision = 'd5a8e2c7f614'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('refresh_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('active_key', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('running_project_id', sa.Integer(), nullable=True))
+
+    # Ключи получают активные задачи; дубликаты, поставленные до появления
+    # ограничения, отменяются, чтобы уникальные индексы можно было создать
+    refresh_job = sa.table('refresh_job',
+                           sa.column('id', sa.Integer), sa.column('project_id', sa.Integer),
+                           sa.column('kind', sa.String), sa.column('status', sa.String),
+                           sa.column('error', sa.Text), sa.column('finished_at', sa.DateTime),
+                           sa.column('active_key', sa.String), sa.column('running_project_id', sa.Integer))
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(refresh_job.c.id, refresh_job.c.project_id, refresh_job.c.kind, refresh_job.c.status)
+        .where(refresh_job.c.status.in_(['queued', 'running']))
+        .order_by(sa.case((refresh_job.c.status == 'running', 0), else_=1), refresh_job.c.id)
+    ).fetchall()
+    active_keys = set()
+    running_projects = set()
+    for job_id, project_id, kind, status in rows:
+        key = f"{project_id}:{kind}"
+        if key in active_keys or (status == 'running' and project_id in running_projects):
+            connection.execute(
+                refresh_job.update().where(refresh_job.c.id == job_id)
+                .values(status='cancelled', error='Дубликат активной задачи', finished_at=sa.func.now())
+            )
+            continue
+        active_keys.add(key)
+        values = {'active_key': key}
+        if status == 'running':
+            running_projects.add(project_id)
+            values['running_project_id'] = project_id
+        connection.execute(refresh_job.update().where(refresh_job.c.id == job_id).values(**values))
+
+    with op.batch_alter_table('refresh_job', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_refresh_job_active_key', ['active_key'])
+        batch_op.create_unique_constraint('uq_refresh_job_running_project_id', ['running_project_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('refresh_job', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_refresh_job_running_project_id', type_='unique')
+        batch_op.drop_constraint('uq_refresh_job_active_key', type_='unique')
+        batch_op.drop_column('running_project_id')
+        batch_op.drop_column('active_key')
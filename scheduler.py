@@ -0,0 +1,23 @@
+import argparse
+import logging
+from app import create_app
+from app.tasks.scheduler import run_scheduler
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def main():
+    parser = argparse.ArgumentParser(description='Планировщик планового обновления данных проектов')
+    parser.add_argument('--once', action='store_true',
+                        help='Поставить просроченные задачи в очередь и выйти')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        run_scheduler(once=args.once)
+
+if __name__ == '__main__':
+    main()
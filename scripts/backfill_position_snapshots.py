@@ -0,0 +1,26 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.models import Project
+from app.tasks.position_writer import rebuild_position_snapshots
+
+def backfill_position_snapshots(project_id=None):
+    app = create_app()
+    with app.app_context():
+        query = Project.query
+        if project_id is not None:
+            query = query.filter_by(id=project_id)
+
+        for project in query.all():
+            count = rebuild_position_snapshots(project.id)
+            db.session.commit()
+            print(f"Проект {project.id} ({project.name}): обновлен снимок для {count} ключевых слов")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Заполнение снимка последних позиций ключевых слов')
+    parser.add_argument('project_id', type=int, nargs='?', help='ID проекта (по умолчанию - все проекты)')
+    args = parser.parse_args()
+    backfill_position_snapshots(args.project_id)
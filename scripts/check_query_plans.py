@@ -0,0 +1,60 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app import create_app, db
+
+# Запросы отчетов и индексы, которые они должны использовать
+CHECKS = [
+    (
+        "Позиции ключевого слова по датам",
+        "SELECT position, check_date FROM keyword_position "
+        "WHERE keyword_id = 1 ORDER BY check_date",
+        "ix_keyword_position_keyword_id_check_date"
+    ),
+    (
+        "Трафик URL по датам",
+        "SELECT visits, check_date FROM url_traffic "
+        "WHERE url_id = 1 ORDER BY check_date",
+        "ix_url_traffic_url_id_check_date"
+    ),
+    (
+        "Поиск ключевого слова в проекте",
+        "SELECT id FROM keyword WHERE project_id = 1 AND keyword = 'test'",
+        "uq_keyword_project_id_keyword"
+    ),
+]
+
+def explain(sql):
+    """Возвращает план запроса в виде строки для текущей СУБД"""
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+    else:
+        rows = db.session.execute(text(f"EXPLAIN {sql}")).fetchall()
+    return '\n'.join(' | '.join(str(value) for value in row) for row in rows)
+
+def check_query_plans():
+    app = create_app()
+    with app.app_context():
+        failed = 0
+        for title, sql, index_name in CHECKS:
+            plan = explain(sql)
+            # SQLite называет индекс уникального ограничения sqlite_autoindex_*
+            uses_index = index_name in plan or (
+                index_name.startswith('uq_') and 'sqlite_autoindex_keyword' in plan
+            )
+            status = "OK" if uses_index else "FULL SCAN"
+            print(f"[{status}] {title}")
+            print(f"  {plan}")
+            if not uses_index:
+                failed += 1
+                print(f"  Ожидался индекс {index_name}")
+
+        if failed:
+            print(f"\nЗапросов без индекса: {failed}. Выполните flask db upgrade.")
+            sys.exit(1)
+        print("\nВсе запросы используют индексы")
+
+if __name__ == '__main__':
+    check_query_plans()
@@ -30,6 +30,7 @@ REGIONS = [
     (11158, "Курганская область"),
     (10705, "Курская область"),
     (10712, "Липецкая область"),
+    (213, "Москва"),
     (1, "Москва и Московская область"),
     (10897, "Мурманская область"),
     (11079, "Нижегородская область"),
@@ -72,15 +73,17 @@ REGIONS = [
 def fill_regions():
     app = create_app()
     with app.app_context():
-        print("Удаляем старые регионы...")
-        Region.query.delete()
-        db.session.commit()
+        # Регионы обновляются по коду, а не удаляются: на них ссылаются ключевые слова
+        existing = {region.code: region for region in Region.query.all()}
         
         print("Добавляем новые регионы в базу данных...")
         for yandex_id, name in REGIONS:
-            region = Region(yandex_id=yandex_id, name=name)
-            db.session.add(region)
-            print(f"Добавлен регион: {name} (ID: {yandex_id})")
+            region = existing.get(yandex_id)
+            if region is None:
+                db.session.add(Region(code=yandex_id, name=name))
+                print(f"Добавлен регион: {name} (ID: {yandex_id})")
+            else:
+                region.name = name
         
         db.session.commit()
         print("Регионы успешно обновлены!")
@@ -6,6 +6,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app, db
 from app.models import Project, URL, URLTraffic
+from app.reports.cache import bump_data_version
 from datetime import datetime, timedelta
 import random
 
@@ -52,6 +53,7 @@ def generate_traffic_data(project_id, num_dates=10):
                 prev_traffic = traffic_value
 
         try:
+            bump_data_version(project_id)
             db.session.commit()
             print(f"Successfully generated traffic data for project {project_id}")
         except Exception as e:
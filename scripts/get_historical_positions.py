@@ -1,18 +1,19 @@
 import sys
 import os
 import logging
-from datetime import datetime, timedelta
-import numpy as np
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Set, Tuple
 import argparse
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
-import time
 
 
 # Добавляем путь к корневой директории проекта
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.models import Project, Keyword, KeywordPosition
+from app.models import Project, Keyword, KeywordPosition, Region
+from app.tasks.position_writer import PositionWriter
 from app.yandex.webmaster import YandexWebmasterAPI
 from config import Config
 
@@ -27,72 +28,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_historical_positions(api: YandexWebmasterAPI, host_id: str, query: str, periods_count: int) -> list:
+def backfill_periods(periods_count: int, today=None) -> List[Tuple[date, date]]:
     """
-    Получает исторические данные о позициях ключевого слова за несколько периодов
+    Недельные периоды для загрузки истории, от последнего к первому
+
+    Периоды выровнены по календарным неделям (понедельник - воскресенье) и
+    заканчиваются последней полной неделей, поэтому при повторном запуске в
+    другой день границы периодов совпадают с уже загруженными.
     """
-    logger.info(f"Получение исторических позиций для запроса '{query}' на хосте {host_id} за {periods_count} периодов")
-    
-    results = []
+    today = today or datetime.now().date()
+    last_sunday = today - timedelta(days=today.weekday() + 1)
+    periods = []
     for period in range(periods_count):
-        # Вычисляем даты для текущего периода
-        end_date = datetime.now().date() - timedelta(days=period * 7)
-        start_date = end_date - timedelta(days=6)
-        
-        url = f"/user/{api.user_id}/hosts/{host_id}/query-analytics/list"
-        params = {
-            "operation": "TEXT_CONTAINS",
-            "limit": "500",
-            "filters": {
-                "text_filters": [
-                    {
-                        "text_indicator": "QUERY",
-                        "operation": "TEXT_MATCH",
-                        "value": query
-                    }
-                ]
-            },
-            "sort_by_date": {
-                "date": start_date.strftime("%Y-%m-%d"),
-                "statistic_field": "IMPRESSIONS",
-                "by": "ASC"
-            }
-        }
-        
-        data = api._make_request("POST", url, json=params)
-        if not data or 'text_indicator_to_statistics' not in data:
-            logger.warning(f"Нет данных по запросу '{query}' за период {start_date} - {end_date}")
-            continue
-            
-        positions = [stat for stat in data['text_indicator_to_statistics']
-                    if stat['text_indicator']['value'] == query]
-                    
-        if not positions:
-            logger.warning(f"Позиция для запроса '{query}' не найдена за период {start_date} - {end_date}")
-            continue
-            
-        position_data = positions[0]['statistics']
-        position_entries = [entry for entry in position_data if entry['field'] == 'POSITION']
-        
-        if not position_entries:
-            logger.warning(f"Нет данных о позициях для запроса '{query}' за период {start_date} - {end_date}")
-            continue
-            
-        # Берем данные за текущий период и считаем среднее
-        positions_values = [entry['value'] for entry in position_entries]
-        
-        if positions_values:
-            position_avg = np.mean(positions_values)
-            date_range = f"{start_date.strftime('%d.%m')} - {end_date.strftime('%d.%m')}"
-            results.append((position_avg, date_range))
-            logger.info(f"Средняя позиция для '{query}': {position_avg} за период {date_range}")
-            
+        end_date = last_sunday - timedelta(days=period * 7)
+        periods.append((end_date - timedelta(days=6), end_date))
+    return periods
+
+def load_checkpoints(session, project_id: int, since: date) -> Set[Tuple[int, date]]:
+    """
+    Уже загруженные пары (keyword_id, начало периода) проекта
+
+    Порции позиций фиксируются по мере записи, поэтому записи в keyword_position
+    и есть контрольные точки: после перезапуска эти периоды не запрашиваются.
+    """
+    day = func.date(KeywordPosition.data_date_start)
+    rows = (session.query(KeywordPosition.keyword_id, day)
+            .join(Keyword, Keyword.id == KeywordPosition.keyword_id)
+            .filter(Keyword.project_id == project_id,
+                    KeywordPosition.data_date_start >= datetime.combine(since, datetime.min.time()))
+            .distinct())
+    checkpoints = set()
+    for keyword_id, value in rows:
+        if isinstance(value, str):
+            value = datetime.strptime(value[:10], '%Y-%m-%d').date()
+        checkpoints.add((keyword_id, value))
+    return checkpoints
+
+def get_historical_positions(api: YandexWebmasterAPI, host_id: str, query: str,
+                             periods: List[Tuple[date, date]], region: Optional[int] = None) -> list:
+    """
+    Получает исторические данные о позициях ключевого слова за указанные периоды
+
+    Вся история запрашивается одним запросом от самого раннего до самого позднего
+    периода, средние по неделям считаются локально. region - код региона
+    Яндекса ключевого слова (None - без фильтра по региону).
+
+    Returns:
+        Список (средняя позиция, начало периода, конец периода)
+    """
+    logger.info(f"Получение исторических позиций для запроса '{query}' на хосте {host_id} за {len(periods)} периодов")
+
+    end_date = max(period_end for _, period_end in periods)
+    start_date = min(period_start for period_start, _ in periods)
+    periods_count = ((end_date - start_date).days + 1) // 7
+
+    history = api.get_keyword_position_history(host_id, query, periods_count, end_date=end_date,
+                                               region_ids=[region] if region else None)
+
+    wanted = {period_start for period_start, _ in periods}
+    results = [item for item in history if item[1] in wanted]
+    for position_avg, period_start, period_end in results:
+        logger.info(f"Средняя позиция для '{query}': {position_avg} за период {period_start} - {period_end}")
+    if len(results) < len(periods):
+        logger.warning(f"Нет данных о позициях для запроса '{query}' за {len(periods) - len(results)} периодов")
     return results
 
 def main():
     parser = argparse.ArgumentParser(description='Получение исторических данных о позициях ключевых слов')
     parser.add_argument('project_id', type=int, help='ID проекта')
     parser.add_argument('periods_count', type=int, help='Количество периодов (1 период = 7 дней)')
+    parser.add_argument('--workers', type=int, default=Config.POSITIONS_UPDATE_WORKERS,
+                        help='Количество ключевых слов, обрабатываемых параллельно')
+    parser.add_argument('--chunk-size', type=int, default=Config.POSITIONS_WRITE_CHUNK_SIZE,
+                        help='Количество позиций в одной фиксируемой порции')
     args = parser.parse_args()
 
     # Создаем подключение к базе данных
@@ -119,57 +127,71 @@ def main():
             logger.error("У проекта нет ключевых слов для обновления")
             return
 
+        # Коды регионов Яндекса для фильтра выгрузки: {Region.id: code}
+        region_codes = dict(session.query(Region.id, Region.code).all())
+
+        periods = backfill_periods(args.periods_count)
+        checkpoints = load_checkpoints(session, args.project_id, periods[-1][0])
+
+        # Для каждого ключевого слова запрашиваем только еще не загруженные периоды
+        pending = []
+        for keyword in keywords:
+            missing = [period for period in periods if (keyword.id, period[0]) not in checkpoints]
+            if missing:
+                pending.append((keyword.id, keyword.keyword, keyword.region_id, missing))
+        skipped = len(keywords) * len(periods) - sum(len(item[-1]) for item in pending)
+        logger.info(f"Периодов к загрузке: {len(keywords) * len(periods) - skipped}, уже загружено: {skipped}")
+
         success_count = 0
         error_count = 0
+        # Каждая порция фиксируется сразу: при падении теряется не больше одной порции.
+        # Дата обновления ключевых слов не трогается: по ней планировщик решает, что
+        # проект свеж, а бэкфилл загружает только старые данные
+        writer = PositionWriter(session=session, chunk_size=args.chunk_size, commit=True,
+                                update_keywords=False)
         
-        # Обрабатываем каждое ключевое слово
-        for keyword in keywords:
+        # Запросы к API идут в потоках, запись в базу - только в основном потоке
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                executor.submit(get_historical_positions, api, project.yandex_webmaster_host,
+                                query, missing, region_codes.get(region_id)): (keyword_id, query, region_id)
+                for keyword_id, query, region_id, missing in pending
+            }
             try:
-                historical_data = get_historical_positions(
-                    api,
-                    project.yandex_webmaster_host,
-                    keyword.keyword,
-                    args.periods_count
-                )
-
-                if historical_data:
-                    for position, date_range in historical_data:
+                for future in as_completed(futures):
+                    keyword_id, query, region_id = futures[future]
+                    try:
+                        historical_data = future.result()
+                    except Exception as e:
+                        logger.error(f"Ошибка при получении исторических данных для '{query}': {e}")
+                        error_count += 1
+                        continue
+
+                    for position, start_date, end_date in historical_data:
                         try:
-                            # Создаем новую запись в таблице KeywordPosition
-                            keyword_position = KeywordPosition(
-                                keyword_id=keyword.id,
-                                position=position,
-                                check_date=datetime.utcnow()
+                            writer.add(
+                                keyword_id,
+                                position,
+                                # Дата проверки - конец периода, а не момент загрузки
+                                check_date=datetime.combine(end_date, datetime.min.time()),
+                                data_date_start=datetime.combine(start_date, datetime.min.time()),
+                                data_date_end=datetime.combine(end_date, datetime.min.time()),
+                                region_id=region_id
                             )
-                            
-                            # Парсим даты из строки формата "dd.mm - dd.mm"
-                            if date_range:
-                                start_date_str, end_date_str = date_range.split(' - ')
-                                current_year = datetime.now().year
-                                
-                                # Преобразуем строки дат в объекты datetime
-                                start_date = datetime.strptime(f"{start_date_str}.{current_year}", '%d.%m.%Y')
-                                end_date = datetime.strptime(f"{end_date_str}.{current_year}", '%d.%m.%Y')
-                                
-                                # Устанавливаем даты
-                                keyword_position.data_date_start = start_date
-                                keyword_position.data_date_end = end_date
-                                
-                            session.add(keyword_position)
                             success_count += 1
                         except Exception as e:
-                            logger.error(f"Ошибка при сохранении исторических данных для '{keyword.keyword}': {e}")
+                            session.rollback()
+                            logger.error(f"Ошибка при сохранении исторических данных для '{query}': {e}")
                             error_count += 1
+            except KeyboardInterrupt:
+                logger.warning("Загрузка прервана, сохраняем полученные данные")
+                for future in futures:
+                    future.cancel()
 
-            except Exception as e:
-                logger.error(f"Ошибка при получении исторических данных для '{keyword.keyword}': {e}")
-                error_count += 1
-
+        writer.flush()
         if success_count > 0:
-            session.commit()
             logger.info(f"Успешно получены исторические данные: {success_count} записей (ошибок: {error_count})")
         else:
-            session.rollback()
             logger.error("Не удалось сохранить исторические данные")
 
     except Exception as e:
@@ -28,6 +28,7 @@ regions_data = [
     {"yandex_id": 11158, "name": "Курганская область"},
     {"yandex_id": 10705, "name": "Курская область"},
     {"yandex_id": 10712, "name": "Липецкая область"},
+    {"yandex_id": 213, "name": "Москва"},
     {"yandex_id": 1, "name": "Москва и Московская область"},
     {"yandex_id": 10897, "name": "Мурманская область"},
     {"yandex_id": 11079, "name": "Нижегородская область"},
@@ -70,20 +71,21 @@ regions_data = [
 def seed_regions():
     print("Начинаем заполнение справочника регионов...")
     
-    # Очищаем таблицу регионов
-    Region.query.delete()
-    
-    # Добавляем регионы
+    # Регионы обновляются по коду, а не удаляются: на них ссылаются ключевые слова
+    existing = {region.code: region for region in Region.query.all()}
+    added = 0
     for region_data in regions_data:
-        region = Region(
-            yandex_id=region_data["yandex_id"],
-            name=region_data["name"]
-        )
-        db.session.add(region)
+        region = existing.get(region_data["yandex_id"])
+        if region is None:
+            db.session.add(Region(code=region_data["yandex_id"], name=region_data["name"]))
+            added += 1
+        else:
+            region.name = region_data["name"]
     
     # Сохраняем изменения
     db.session.commit()
-    print(f"Добавлено {len(regions_data)} регионов")
+    print(f"Добавлено {added} регионов, обновлено {len(regions_data) - added}")
+    print("Перезапустите приложение и воркеры, чтобы они перечитали справочник регионов")
 
 if __name__ == '__main__':
     with app.app_context():
@@ -0,0 +1,23 @@
+import argparse
+import logging
+from app import create_app
+from app.tasks.jobs import run_worker
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def main():
+    parser = argparse.ArgumentParser(description='Воркер очереди задач обновления данных проектов')
+    parser.add_argument('--once', action='store_true',
+                        help='Обработать задачи, находящиеся в очереди, и выйти')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        run_worker(once=args.once)
+
+if __name__ == '__main__':
+    main()